@@ -0,0 +1,190 @@
+import os
+import sys
+import logging
+from collections import OrderedDict
+
+# Add the directory containing your module to the Python path (wants absolute paths)
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from indexing import get_analyzer
+from index_store import open_index
+from postings import to_docnos
+from search import analyze_boolean_query, evaluate_boolean, parse_proximity, proximity_doc_ids
+from ranked_retrieval import rank_query
+from scoring import RESULTS_PER_QUERY, RESULT_DIGITS
+from query_cache import index_generation
+from metrics import span, enabled as metrics_enabled, export as export_metrics, summary as metrics_summary
+
+logging.basicConfig(
+    level=logging.INFO,  # Set the logging level (e.g., INFO, DEBUG, WARNING)
+    format="{} : %(asctime)s - %(levelname)s : %(message)s".format("Batch Search Module") # Log message format
+)
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Batch evaluation of query files.
+
+All queries of a file are analyzed before any of them is evaluated, the distinct terms of the whole batch are
+fetched from the index once into a BatchIndex and every query then runs against that view. Queries sharing
+terms share the decoded postings, however small the LRU of a memory-mapped index is.
+Results are written in the results.boolean.txt (q,DOCNO) and results.ranked.txt (q,DOCNO,score) formats.
+'''
+
+
+class BatchIndex:
+    '''
+    Index view for one batch of queries. Every term is fetched from the underlying index at most once
+    and kept until the batch is done. It answers the lookups the search functions make
+    (index[term], term in index, index.get, index.doc_freq, "__all_docs__" and "__docnos__").
+    '''
+    def __init__(self, index, terms=()):
+        self.index=index
+        #results cached on the view stay valid for the index behind it
+        self.generation=index_generation(index)
+        self.entries={}
+        self.lookups=0
+        self.fetch(terms)
+
+    def fetch(self, terms):
+        for term in terms:
+            self.lookups+=1
+            if term not in self.entries:
+                self.entries[term]=self.index.get(term)
+
+    def get(self, term, default=None):
+        if term in ("__all_docs__", "__docnos__"):
+            return self.index[term]
+        if term not in self.entries:
+            self.fetch([term])
+        entry=self.entries[term]
+        return default if entry is None else entry
+
+    def __getitem__(self, term):
+        entry=self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def doc_freq(self, term):
+        entry=self.get(term)
+        return entry["doc_freq"] if entry is not None else 0
+
+    def keys(self):
+        return self.index.keys()
+
+def read_query_file(path):
+    '''
+    Reads a query file of "<query number> <query>" lines, returns the queries in file order.
+    '''
+    query_list=[]
+    with open(path, 'r') as file:
+        for line in file:
+            line=line.split()
+            if line:
+                query_list.append(" ".join(line[1:]))
+    return query_list
+
+def boolean_terms(query_terms):
+    '''
+    Index terms an analyzed boolean query reads: its operands and the analyzed words of its phrases.
+    '''
+    analyzer=get_analyzer()
+    for term in query_terms:
+        if term in analyzer.operators:
+            continue
+        if term[0]=='"' and term[-1]=='"':
+            yield from analyzer.analyze(term.strip('"'))
+        else:
+            yield term
+
+def batch_boolean_search(query_list, index, cache=None):
+    '''
+    Evaluates boolean and proximity (#...) queries as one batch.
+    Returns {query number: DOCNOs}, query numbers counting from 1; proximity DOCNOs come back sorted as ints
+    like proximity_search returns them.
+    '''
+    with span("batch_boolean_search"):
+        analyzed=[]
+        terms=[]
+        for query in query_list:
+            if '#' in query:
+                query_terms=parse_proximity(query)[1]
+                terms.extend(query_terms)
+            else:
+                query_terms=analyze_boolean_query(query)
+                terms.extend(boolean_terms(query_terms))
+            analyzed.append(query_terms)
+
+        batch_index=BatchIndex(index, terms)
+        logger.info("{} queries: {} term lookups, {} postings lists fetched".format(len(query_list), batch_index.lookups, len(batch_index.entries)))
+
+        res=OrderedDict()
+        for q_num, (query, query_terms) in enumerate(zip(query_list, analyzed), 1):
+            if '#' in query:
+                res[q_num]=sorted(int(docno) for docno in to_docnos(proximity_doc_ids(query, batch_index, batch_index.entries, cache), index))
+            else:
+                with span("boolean_query"):
+                    res[q_num]=to_docnos(evaluate_boolean(query_terms, batch_index, query, cache), index)
+    return res
+
+def batch_ranked_search(query_list, index, k=RESULTS_PER_QUERY, cache=None):
+    '''
+    Ranks the top k docs of every query as one batch.
+    Returns {query number: [(DOCNO, score)]} best first, like ranked_retrieval.
+    '''
+    with span("batch_ranked_search"):
+        analyzer=get_analyzer()
+        analyzed=[analyzer.analyze(query) for query in query_list]
+        batch_index=BatchIndex(index, (term for query_terms in analyzed for term in query_terms))
+        logger.info("{} queries: {} term lookups, {} postings lists fetched".format(len(query_list), batch_index.lookups, len(batch_index.entries)))
+
+        docnos=index["__docnos__"]
+        res=OrderedDict()
+        for q_num, query_terms in enumerate(analyzed, 1):
+            res[q_num]=[(docnos[doc], score) for score, doc in rank_query(query_terms, batch_index, k, cache=cache)]
+    return res
+
+def write_boolean_results(res, path):
+    with open(path, 'w') as file:
+        for q_num in res:
+            for doc in res[q_num]:
+                file.write("{},{}\n".format(q_num, doc))
+
+def write_ranked_results(res, path, digits=None):
+    '''
+    digits rounds the scores, None writes them unrounded.
+    '''
+    with open(path, 'w') as file:
+        for q_num in res:
+            for doc, score in res[q_num]:
+                if digits is not None:
+                    score=round(score, digits)
+                file.write(f"{q_num},{doc},{score}\n")
+
+def run_query_files(index, boolean_path="data/test_set/queries.boolean.txt", ranked_path="data/test_set/queries.ranked.txt",
+                    result_dir="data/test_set/result", k=RESULTS_PER_QUERY, digits=RESULT_DIGITS):
+    '''
+    Evaluates both query files and writes results.boolean.txt and results.ranked.txt to result_dir.
+    A None path skips that file. Ranked results keep the top k of every query with scores rounded to digits,
+    the results.ranked.txt format every entry point writes.
+    '''
+    if boolean_path is not None:
+        write_boolean_results(batch_boolean_search(read_query_file(boolean_path), index), os.path.join(result_dir, "results.boolean.txt"))
+        logger.info("Boolean results written")
+    if ranked_path is not None:
+        write_ranked_results(batch_ranked_search(read_query_file(ranked_path), index, k), os.path.join(result_dir, "results.ranked.txt"), digits)
+        logger.info("Ranked results written")
+
+
+if __name__ == "__main__":
+    index=open_index("data/index.bin")
+    run_query_files(index)
+    #per stage timings and counters, recorded when SEARCH_METRICS is set
+    if metrics_enabled():
+        for line in metrics_summary(export_metrics()):
+            logger.info(line)
@@ -0,0 +1,369 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import itertools
+import shutil
+import argparse
+import platform
+import datetime
+import logging
+import resource
+import subprocess
+import tracemalloc
+from xml.sax.saxutils import escape
+
+# Add the directory containing your module to the Python path (wants absolute paths)
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from indexing import preprocessor, create_inverted_index, get_analyzer, STOP_WORDS_PATH
+from index_store import open_index, load_index, write_binary_index, INDEX_PATH
+from postings_codecs import CODEC_NAMES, CODEC_MIN_LENGTH
+from search import boolean_doc_ids, phrase_doc_ids, proximity_doc_ids
+from ranked_retrieval import rank_query
+from scoring import RESULTS_PER_QUERY
+from vectorized_scoring import np, TermDocMatrix
+from load_generator import percentile
+
+logging.basicConfig(
+    level=logging.INFO,  # Set the logging level (e.g., INFO, DEBUG, WARNING)
+    format="{} : %(asctime)s - %(levelname)s : %(message)s".format("Benchmark") # Log message format
+)
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Reproducible benchmark of the indexing and search paths.
+
+For every corpus size a synthetic TREC style XML collection is generated from a fixed seed, so the same
+size always gives the same corpus. The harness then times, in a scratch directory (the repository's
+data/index.bin is not touched):
+
+    preprocess      preprocessor() over the whole XML file                 docs/s, tokens/s
+    index           create_inverted_index() including the txt and binary output     docs/s, index size
+    load            load_index() into memory and open_index() memory mapped
+    boolean, phrase, proximity, ranked      the fixed query workloads below against the memory mapped index,
+                    every query repeated, throughput and p50/p90/p99/max latency. After the warm up round the
+                    postings LRU holds the workload's terms; the *_cold stages run the workloads again on an
+                    index opened with cache_size=0, which decodes the postings of every query again
+    ranked_vectorized       the ranked workload on a TermDocMatrix, when NumPy is installed
+    codecs          the index rewritten with each postings codec forced and with the per term choice ("auto"):
+                    file size, bytes of the doc and position blocks and decode throughput of the postings lists
+                    of CODEC_MIN_LENGTH docs and more (the shorter ones are varbyte whatever the codec)
+
+Peak memory of preprocess, index and load is measured with tracemalloc in a second, untimed run of the
+stage, so tracing does not slow down the timed run. The preprocess run reads the doc stream without keeping
+the docs, as the indexer consumes it. The results are written as JSON together with the
+git commit, and --compare prints the time ratios against an earlier results file.
+'''
+
+BENCHMARK_SIZES=(1000, 5000, 20000)
+BENCHMARK_SEED=42
+BENCHMARK_REPEAT=5
+BENCHMARK_OUTPUT="data/benchmark.json"
+BENCHMARK_WORK_DIR="data/benchmark"
+
+#the topic words of the sample collection, every query of the workloads is built from them
+TOPIC_WORDS=("sadness", "union", "market", "middle", "bskyb", "minister", "scotland", "inflation", "europe",
+             "tax", "vote", "israel", "stock", "labour", "deal", "interest", "article", "jones", "party",
+             "election", "unemployment", "dollar", "dow", "income", "energy", "price", "economy", "government",
+             "conservative", "corporate", "shares", "times", "organisations", "loss", "rate", "street", "growth",
+             "glasgow", "east", "yen", "trade", "profit", "pound", "financial", "taxes", "company", "policy",
+             "bank", "wall", "bbc", "palestinian", "oil", "oil-price")
+STOP_WORDS=("with", "the", "that", "in", "be", "have", "was", "not", "a", "to", "by", "or", "of", "on", "for",
+            "is", "but", "and", "as", "from", "at", "an", "this", "it", "are")
+#made up words of the long tail are strung together from these
+SYLLABLES=("ba", "ke", "li", "mo", "nu", "ra", "se", "ti", "vo", "zu", "da", "fe", "gi", "ho", "ju", "pa")
+#share of the tokens drawn from the topic words, stop words and the Zipf distributed tail
+TOPIC_SHARE=0.45
+STOP_SHARE=0.25
+DOC_LENGTH=(60, 160)
+HEADLINE_LENGTH=(4, 8)
+
+BOOLEAN_QUERIES=["sadness", "glasgow and scotland", "corporate and taxes", '"middle east" and israel',
+                 '"wall street" and "dow jones"', "income and not tax", "not market and oil",
+                 "oil or not bank and dollar", "bbc or bskyb or deal or article", "labour and not conservative"]
+PHRASE_QUERIES=['"corporate taxes"', '"middle east"', '"wall street"', '"dow jones"', '"financial times bank"',
+                '"income tax"', '"stock market"', '"oil price"']
+PROXIMITY_QUERIES=["#30(corporate,taxes)", "#5(palestinian,organisations)", "#10(income,taxes)", "#3(wall,street)",
+                   "#od2(middle,east)", "#uw20(stock,market,europe)", "#15(bank,dollar)", "#8(labour,vote)"]
+RANKED_QUERIES=["income tax", "stock market in europe", "Israel and the middle east election",
+                "corporate taxes on oil company", "the bbc deal with bskyb", "glasgow market",
+                "unemployment rate and inflation", "government policy on energy prices"]
+
+
+def tail_word(rank):
+    #made up word for a rank of the long tail, distinct ranks give distinct words
+    word=""
+    rank+=len(SYLLABLES)
+    while rank:
+        rank, digit=divmod(rank, len(SYLLABLES))
+        word+=SYLLABLES[digit]
+    return word+"x"
+
+def generate_corpus(path, num_docs, seed=BENCHMARK_SEED):
+    '''
+    Writes a synthetic TREC style collection of num_docs DOCs to path and returns the number of words written.
+    Words are topic words, stop words and a long tail of made up words with Zipf distributed frequencies,
+    the tail vocabulary growing with the square root of the collection size like real vocabularies do.
+    '''
+    rand=random.Random(seed)
+    tail_size=int(40*math.sqrt(num_docs*sum(DOC_LENGTH)/2))
+    tail_words=[tail_word(rank) for rank in range(tail_size)]
+    tail_weights=list(itertools.accumulate(1/(rank+1) for rank in range(tail_size)))
+
+    def words(count):
+        out=[]
+        for _ in range(count):
+            draw=rand.random()
+            if draw<TOPIC_SHARE:
+                word=rand.choice(TOPIC_WORDS)
+            elif draw<TOPIC_SHARE+STOP_SHARE:
+                word=rand.choice(STOP_WORDS)
+            else:
+                word=rand.choices(tail_words, cum_weights=tail_weights)[0]
+            #some capitals so case folding has work to do
+            out.append(word.capitalize() if rand.random()<0.1 else word)
+        return out
+
+    num_words=0
+    with open(path, 'w') as file:
+        file.write("<document>\n")
+        for doc_id in range(num_docs):
+            headline=words(rand.randint(*HEADLINE_LENGTH))
+            text=words(rand.randint(*DOC_LENGTH))
+            num_words+=len(headline)+len(text)
+            file.write("<DOC>\n<DOCNO>{}</DOCNO>\n<HEADLINE>{}</HEADLINE>\n<TEXT>\n{}.\n</TEXT>\n</DOC>\n".format(
+                doc_id+1, escape(" ".join(headline)), escape(" ".join(text))))
+        file.write("</document>\n")
+    return num_words
+
+def peak_memory(function, *args):
+    '''
+    Runs function(*args) under tracemalloc and returns the peak of traced memory in bytes.
+    '''
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def consume(docs):
+    #reads a doc stream to the end without keeping the docs
+    for _ in docs:
+        pass
+
+def latency_report(latencies, elapsed):
+    latencies=sorted(latencies)
+    return {"queries": len(latencies),
+            "seconds": elapsed,
+            "qps": len(latencies)/elapsed if elapsed else 0.0,
+            "latency_ms": {"p50": percentile(latencies, 50)*1000,
+                           "p90": percentile(latencies, 90)*1000,
+                           "p99": percentile(latencies, 99)*1000,
+                           "max": latencies[-1]*1000 if latencies else 0.0}}
+
+def time_queries(run, queries, repeat=BENCHMARK_REPEAT):
+    '''
+    Runs every query repeat times after one untimed warm up round. Returns the throughput and latency report,
+    with the number of results of each query so runs on different commits can be checked to agree.
+    '''
+    results=[run(query) for query in queries]
+    latencies=[]
+    start=time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            query_start=time.perf_counter()
+            run(query)
+            latencies.append(time.perf_counter()-query_start)
+    report=latency_report(latencies, time.perf_counter()-start)
+    report["results"]=[len(result) for result in results]
+    return report
+
+def time_workloads(index, analyzer, repeat=BENCHMARK_REPEAT):
+    '''
+    Times the boolean, phrase, proximity and ranked workloads against index. Returns {workload: report}.
+    '''
+    return {"boolean": time_queries(lambda query: boolean_doc_ids(query, index), BOOLEAN_QUERIES, repeat),
+            "phrase": time_queries(lambda query: phrase_doc_ids(query, index), PHRASE_QUERIES, repeat),
+            "proximity": time_queries(lambda query: proximity_doc_ids(query, index), PROXIMITY_QUERIES, repeat),
+            "ranked": time_queries(lambda query: rank_query(analyzer.analyze(query), index, RESULTS_PER_QUERY),
+                                   RANKED_QUERIES, repeat)}
+
+def benchmark_size(num_docs, seed=BENCHMARK_SEED, repeat=BENCHMARK_REPEAT, memory=True):
+    '''
+    Benchmarks one corpus size, writing the corpus and index below the current directory. Returns the stage reports.
+    '''
+    corpus_path="data/trec.{}.xml".format(num_docs)
+    num_words=generate_corpus(corpus_path, num_docs, seed)
+    report={"docs": num_docs, "words": num_words, "corpus_bytes": os.path.getsize(corpus_path)}
+    logger.info("Benchmarking {} docs, {} words".format(num_docs, num_words))
+
+    start=time.perf_counter()
+    doc_list=list(preprocessor(corpus_path))
+    elapsed=time.perf_counter()-start
+    tokens=sum(len(doc['headline'])+len(doc['text']) for doc in doc_list)
+    report["preprocess"]={"seconds": elapsed, "docs_per_second": num_docs/elapsed, "tokens": tokens,
+                          "tokens_per_second": tokens/elapsed}
+    if memory:
+        report["preprocess"]["peak_memory_bytes"]=peak_memory(lambda: consume(preprocessor(corpus_path)))
+
+    start=time.perf_counter()
+    index=create_inverted_index(doc_list)
+    elapsed=time.perf_counter()-start
+    report["index"]={"seconds": elapsed, "docs_per_second": num_docs/elapsed, "terms": len(index),
+                     "index_bytes": os.path.getsize(INDEX_PATH)}
+    if memory:
+        report["index"]["peak_memory_bytes"]=peak_memory(create_inverted_index, doc_list)
+    del index, doc_list
+
+    start=time.perf_counter()
+    load_index(INDEX_PATH)
+    report["load"]={"seconds": time.perf_counter()-start}
+    start=time.perf_counter()
+    open_index(INDEX_PATH).close()
+    report["load"]["mmap_seconds"]=time.perf_counter()-start
+    if memory:
+        report["load"]["peak_memory_bytes"]=peak_memory(load_index, INDEX_PATH)
+
+    index=open_index(INDEX_PATH)
+    analyzer=get_analyzer()
+    report.update(time_workloads(index, analyzer, repeat))
+    if np is not None:
+        matrix=TermDocMatrix.from_index(index)
+        report["ranked_vectorized"]=time_queries(lambda query: matrix.score(analyzer.analyze(query), RESULTS_PER_QUERY),
+                                                 RANKED_QUERIES, repeat)
+    index.close()
+    #cache_size=0 decodes the postings of every query again
+    index=open_index(INDEX_PATH, cache_size=0)
+    for workload, workload_report in time_workloads(index, analyzer, repeat).items():
+        report[workload+"_cold"]=workload_report
+    index.close()
+    report["codecs"]=codec_report(INDEX_PATH, repeat)
+    return report
+
+def codec_report(index_path=INDEX_PATH, repeat=BENCHMARK_REPEAT):
+    '''
+    Rewrites the index at index_path once per postings codec, next to it. Returns {codec: report}, decode
+    times from the fastest of repeat rounds.
+    '''
+    source=open_index(index_path, cache_size=0)
+    index={}
+    for i in range(source.num_terms):
+        entry=source.decode_term(i)
+        index[source.term(i)]=[entry["doc_freq"], dict(zip(entry["doc_ids"], entry["positions"]))]
+    all_docs=source["__docnos__"]
+    source.close()
+    codecs=list(CODEC_NAMES) if np is not None else ["varbyte"]
+    report={}
+    for codec in [None]+codecs:
+        name=codec or "auto"
+        path="{}.{}.bin".format(os.path.splitext(index_path)[0], name)
+        write_binary_index(index, all_docs, path, codec=codec)
+        mapped=open_index(path, cache_size=0)
+        term_infos=[mapped.term_info(i) for i in range(mapped.num_terms)]
+        long_terms=[i for i, info in enumerate(term_infos) if info[0]>=CODEC_MIN_LENGTH]
+        #one untimed round pages the file in, like the warm up round of the query workloads
+        for i in long_terms:
+            mapped.decode_term(i)
+        #the fastest of repeat rounds, the slower ones measure other load on the machine
+        elapsed=None
+        for _ in range(repeat):
+            start=time.perf_counter()
+            for i in long_terms:
+                mapped.decode_term(i)
+            round_seconds=time.perf_counter()-start
+            elapsed=round_seconds if elapsed is None else min(elapsed, round_seconds)
+        mapped.close()
+        postings=sum(term_infos[i][0] for i in long_terms)
+        report[name]={"index_bytes": os.path.getsize(path),
+                      "doc_bytes": sum(info[2] for info in term_infos),
+                      "position_bytes": sum(info[3] for info in term_infos),
+                      "long_lists": len(long_terms),
+                      "decode_seconds": elapsed,
+                      "postings_per_second": postings/elapsed if elapsed else 0.0,
+                      #long doc id lists written with each codec, for auto the codecs it picked
+                      "doc_codecs": {codec_name: sum(1 for i in long_terms if term_infos[i][6]==CODEC_NAMES[codec_name].codec_id)
+                                     for codec_name in CODEC_NAMES}}
+    return report
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(sizes=BENCHMARK_SIZES, work_dir=BENCHMARK_WORK_DIR, seed=BENCHMARK_SEED, repeat=BENCHMARK_REPEAT, memory=True):
+    '''
+    Benchmarks every corpus size and returns the results dict that gets written as JSON.
+    The stages run with work_dir as the current directory, where the corpora and indexes are written.
+    '''
+    work_dir=os.path.abspath(work_dir)
+    os.makedirs(os.path.join(work_dir, "data", "test_set", "result"), exist_ok=True)
+    shutil.copy(STOP_WORDS_PATH, os.path.join(work_dir, STOP_WORDS_PATH))
+    results={"commit": git_commit(),
+             "date": datetime.datetime.now().isoformat(timespec="seconds"),
+             "python": platform.python_version(),
+             "platform": platform.platform(),
+             "numpy": np.__version__ if np is not None else None,
+             "seed": seed,
+             "repeat": repeat,
+             "sizes": {}}
+    cwd=os.getcwd()
+    os.chdir(work_dir)
+    #preprocessor, create_inverted_index, load_index and TermDocMatrix.from_index log their progress at INFO,
+    #keep that output out of the timed stages
+    level=logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        for num_docs in sizes:
+            results["sizes"][str(num_docs)]=benchmark_size(num_docs, seed, repeat, memory)
+    finally:
+        logger.setLevel(level)
+        os.chdir(cwd)
+    #kilobytes on Linux
+    results["max_rss_bytes"]=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform=="darwin" else 1024)
+    return results
+
+def stage_seconds(results):
+    #(size, stage) -> seconds of every timed stage
+    return {(size, stage): report["seconds"]
+            for size, stages in results["sizes"].items()
+            for stage, report in stages.items() if isinstance(report, dict) and "seconds" in report}
+
+def compare_results(old, new):
+    '''
+    Returns lines of the time ratio new/old of every stage both results have, below 1 is faster.
+    '''
+    old_seconds=stage_seconds(old)
+    lines=["{} -> {}".format(old.get("commit"), new.get("commit"))]
+    for (size, stage), seconds in stage_seconds(new).items():
+        if (size, stage) in old_seconds and old_seconds[(size, stage)]:
+            lines.append("{:>7} docs  {:<18} {:9.4f}s -> {:9.4f}s  x{:.3f}".format(
+                size, stage, old_seconds[(size, stage)], seconds, seconds/old_seconds[(size, stage)]))
+    return lines
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Benchmark indexing and search on synthetic corpora")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES), help="corpus sizes in docs")
+    parser.add_argument("--seed", type=int, default=BENCHMARK_SEED)
+    parser.add_argument("--repeat", type=int, default=BENCHMARK_REPEAT, help="rounds of every query workload")
+    parser.add_argument("--work-dir", default=BENCHMARK_WORK_DIR, help="scratch directory for corpora and indexes")
+    parser.add_argument("--output", default=BENCHMARK_OUTPUT)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak memory runs")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args=parser.parse_args()
+
+    results=run_benchmark(args.sizes, args.work_dir, args.seed, args.repeat, not args.no_memory)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=4)
+    logger.info("Benchmark results written to {}".format(args.output))
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            print("\n".join(compare_results(json.load(file), results)))
@@ -7,6 +7,17 @@ import json
 from collections import OrderedDict
 import logging
 import math
+import heapq
+import itertools
+import multiprocessing
+from array import array
+from index_store import write_binary_index, open_index
+from postings import gallop, find_doc, intersect, resolve, phrase_positions, unordered_window, ordered_window, doc_positions, to_docnos
+from query_planner import parse_query, plan_query, execute_plan, describe_plan
+from scoring import SCORE_EPSILON, RESULTS_PER_QUERY, RESULT_DIGITS, check_k
+from vectorized_scoring import np, TermDocMatrix, vectorized_ranked_retrieval
+from batch_search import read_query_file, batch_boolean_search, batch_ranked_search, write_boolean_results, write_ranked_results
+from metrics import span, count, enabled as metrics_enabled, export as export_metrics, summary as metrics_summary
 
 # Configure logging to display messages in the console (stdout)
 logging.basicConfig(
@@ -19,20 +30,34 @@ logger=logging.getLogger()
 
 
 
+def iter_xml(file_path):
+    """
+    Streams an XML file one DOC at a time. Each DOC element is cleared once its record is yielded,
+    so memory stays flat regardless of collection size
+
+    Args:
+        file_path (str): The file path to the input XML file
+
+    Yields:
+        dict: document with "id", "headline" and "text" keys
+    """
+    context=ET.iterparse(file_path, events=("start", "end"))
+    _, root=next(context)
+    for event, elem in context:
+        if event=="end" and elem.tag=="DOC":
+            yield {
+                "id":elem.find('DOCNO').text.strip(),
+                "headline":elem.find('HEADLINE').text.strip(),
+                "text":elem.find('TEXT').text.strip()}
+            elem.clear()
+            # drop the cleared DOC from the root as well, otherwise the empty shells accumulate
+            root.clear()
+
 def read_xml(file_path):
     '''
     Reads and parses an XML file
     '''
-    tree=ET.parse(file_path)
-    root=tree.getroot()
-    doc_list=[]
-    for doc in root:
-        doc_list.append({
-            "id":doc.find('DOCNO').text.strip(),
-            "headline":doc.find('HEADLINE').text.strip(),
-            "text":doc.find('TEXT').text.strip()}
-        )
-    return doc_list
+    return list(iter_xml(file_path))
 
 
     
@@ -51,6 +76,14 @@ def print_xml(xml):
         pp.plogging.info(doc)
 
 
+STOP_WORDS_PATH="data/english_stop_list.txt"
+
+CLEAN_RE=re.compile(r"[^a-zA-Z0-9\s-]")
+SPACE_RE=re.compile(' +')
+QUERY_TOKEN_RE=re.compile(r'\"[^\"]+\"|\S+')
+
+STEM_CACHE_SIZE=50000
+
 def text_cleaner(text):
     """
     Cleans the input text by removing all special characters, performing case folding and replacing - with space. Also removes extra spaces
@@ -62,8 +95,8 @@ def text_cleaner(text):
         str: The cleaned text
     """
     # cleaned_text=re.sub(r"[^a-zA-Z0-9\s-]", '',text).lower().replace("\n",' ').replace("  "," ")
-    cleaned_text=re.sub(r"[^a-zA-Z0-9\s-]", '',text).lower().replace("\n",' ').replace("  "," ").replace('-',' ')
-    cleaned_text=re.sub(' +', ' ',cleaned_text)
+    cleaned_text=CLEAN_RE.sub('',text).lower().replace("\n",' ').replace("  "," ").replace('-',' ')
+    cleaned_text=SPACE_RE.sub(' ',cleaned_text)
     return cleaned_text
 
 def text_tokenizer(text):
@@ -78,6 +111,129 @@ def text_tokenizer(text):
     """
     return text.split()
 
+
+class StemCache:
+    """
+    Bounded LRU memo in front of a stemmer. Most tokens in a news collection are repeats of a
+    small vocabulary, so only the misses reach stemWord. Hit and miss counters are kept so the
+    bound can be sized against a collection
+
+    Args:
+        stemmer (Stemmer.Stemmer): stemmer used on a cache miss
+        maxsize (int, optional): maximum number of words kept before the least recently used is evicted
+    """
+    def __init__(self, stemmer, maxsize=STEM_CACHE_SIZE):
+        self.stemmer=stemmer
+        self.maxsize=maxsize
+        self.cache=OrderedDict()
+        self.hits=0
+        self.misses=0
+
+    def stem(self, words):
+        cache=self.cache
+        stemmed_words=[]
+        for word in words:
+            stemmed=cache.get(word)
+            if stemmed is None:
+                self.misses+=1
+                stemmed=self.stemmer.stemWord(word)
+                cache[word]=stemmed
+                if len(cache)>self.maxsize:
+                    cache.popitem(last=False)
+            else:
+                self.hits+=1
+                cache.move_to_end(word)
+            stemmed_words.append(stemmed)
+        return stemmed_words
+
+    def stats(self):
+        lookups=self.hits+self.misses
+        return {"size":len(self.cache),
+                "maxsize":self.maxsize,
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":self.hits/lookups if lookups else 0.0}
+
+    def clear(self):
+        self.cache.clear()
+        self.hits=0
+        self.misses=0
+
+
+class Analyzer:
+    """
+    Text analysis pipeline (cleaning, tokenizing, stop word removal and stemming) shared by indexing and search.
+    The stop list is read and the stemmer built once when the object is created
+
+    Args:
+        stop_word_path (str, optional): stopwords file path
+        lang (str, optional): The stemming algorithm to use (porter default)
+        stem_cache_size (int, optional): bound of the LRU stem cache
+    """
+    operators=("and", "or", "not")
+
+    def __init__(self, stop_word_path=STOP_WORDS_PATH, lang='porter', stem_cache_size=STEM_CACHE_SIZE):
+        with open(stop_word_path,'r') as file:
+            self.stop_word_set=set(file.read().split())
+        self.stemmer=Stemmer.Stemmer(lang)
+        #StemCache does the memoizing, PyStemmer's own cache would only hold the same words twice
+        self.stemmer.maxCacheSize=0
+        self.stem_cache=StemCache(self.stemmer, stem_cache_size)
+
+    def clean(self, text):
+        return text_cleaner(text)
+
+    def tokenize(self, text):
+        return text_tokenizer(text)
+
+    def tokenize_query(self, query):
+        """
+        Splits a boolean query on whitespace but keeps "quoted phrases" intact as a single token
+        """
+        return QUERY_TOKEN_RE.findall(query)
+
+    def remove_stopwords(self, words, keep=()):
+        """
+        Removes stopwords from a list of words, except the ones listed in keep
+        """
+        stop_word_set=self.stop_word_set
+        return [word for word in words if word not in stop_word_set or word in keep]
+
+    def stem(self, words):
+        return self.stem_cache.stem(words)
+
+    def analyze(self, text):
+        """
+        Runs the full pipeline on a piece of text
+
+        Args:
+            text (str): raw document or query text
+
+        Returns:
+            list of str: cleaned, stopped and stemmed terms
+        """
+        with span("analyze"):
+            return self.stem(self.remove_stopwords(self.tokenize(self.clean(text))))
+
+
+_analyzers={}
+
+def get_analyzer(stop_word_path=STOP_WORDS_PATH, lang='porter'):
+    """
+    Returns the shared Analyzer for a stop list and stemmer, creating it on first use
+
+    Args:
+        stop_word_path (str, optional): stopwords file path
+        lang (str, optional): The stemming algorithm to use (porter default)
+
+    Returns:
+        Analyzer: the shared analyzer
+    """
+    key=(stop_word_path, lang)
+    if key not in _analyzers:
+        _analyzers[key]=Analyzer(stop_word_path, lang)
+    return _analyzers[key]
+
 def stopword_remover(text,stop_word_path):
     """
         Removes stopwords from the given text
@@ -89,10 +245,7 @@ def stopword_remover(text,stop_word_path):
         Returns:
             list of str: The text with stopwords removed
     """
-    file=open(stop_word_path,'r')
-    stop_word_set=set(file.read().split())
-    file.close()
-    return [word for word in text if word not in stop_word_set]
+    return get_analyzer(stop_word_path).remove_stopwords(text)
 
 def text_stemmer(text,lang='porter'):
     """
@@ -105,8 +258,7 @@ def text_stemmer(text,lang='porter'):
         Returns:
             list of str list of stemmed text
     """
-    ps=Stemmer.Stemmer(lang)
-    return [ps.stemWord(word) for word in text]
+    return get_analyzer(lang=lang).stem(text)
 
 def preprocessor(input_file_path):
     """
@@ -115,72 +267,37 @@ def preprocessor(input_file_path):
     and applies stemming to the text
     Args:
         input_file_path (str): The file path to the input XML file
-    Returns:
-        list list of dictionaries, where each dictionary represents a document with preprocessed text
+    Yields:
+        dict: one document at a time with preprocessed headline and text
     """
     logging.info("Starting text pre-processing")
     start_time=datetime.datetime.now()
     logging.info("Start time: {}".format(start_time))
 
-    doc_list=read_xml(input_file_path)
+    analyzer=get_analyzer()
 
-    pp=pprint.PrettyPrinter(indent=4)
-    stop_words_path="data/english_stop_list.txt"
+    # tokenize, case fold, clean punctuation, remove stop words and stem
+    # documents are streamed from the XML and handed on one at a time
+    for doc in iter_xml(input_file_path):
+        doc['headline']=analyzer.analyze(doc['headline'])
+        doc['text']=analyzer.analyze(doc['text'])
 
-
-    # tokenize, case fold, clean punctuation
-    for doc in doc_list:
-        #Cleanup and case folding
-        #remove punctuation and replace with ' '
-        
-        doc['headline']=text_cleaner(doc['headline'])
-        doc['text']=text_cleaner(doc['text'])
-   
-        #tokenize()
-        doc['headline']=text_tokenizer(doc['headline'])
-        doc['text']=text_tokenizer(doc['text'])
-        
-        #remove stop words
-        doc['headline']=stopword_remover(doc['headline'],stop_words_path)
-        doc['text']=stopword_remover(doc['text'],stop_words_path)
-
-        #stemmer
-        doc['headline']=text_stemmer(doc['headline'])
-        doc['text']=text_stemmer(doc['text'])
+        yield doc
 
     logging.info("Preprocessing completed")
+    logging.info("Stem cache: {}".format(analyzer.stem_cache.stats()))
     logging.info("Time Taken: {}".format(datetime.datetime.now()-start_time))
-    
-    return doc_list
 
-def create_inverted_index(doc_list):
+def build_index(doc_list):
     """
-    Creates an inverted index from a list of documents
-    The inverted index is a dictionary where each key is a term, and the value is a tuple containing the document frequency 
-    and a dictionary of document IDs with their respective positions of the term
+    Builds the in-memory inverted index from preprocessed documents without writing anything to disk
+
     Args:
-        doc_list (list) list of documents
+        doc_list (iterable) preprocessed documents
     Returns:
-        dict: The inverted index
-    Example:
-        Input:
-            doc_list=[
-                {'id': 1, 'headline': ['Lorem', 'ipsum'], 'text': ['dolor', 'sit', 'amet']},
-                {'id': 2, 'headline': ['ipsum', 'Lorem'], 'text': ['amet', 'sit', 'dolor']}
-            ]
-        Output:
-                "Lorem": [2, {1: [1], 2: [2]}],
-                "ipsum": [2, {1: [2], 2: [1]}],
-                "dolor": [2, {1: [3], 2: [6]}],
-                "sit": [2, {1: [4], 2: [5]}],
-                "amet": [2, {1: [5], 2: [4]}]
-            ]
-    The function also writes the index to a text file and a JSON file
+        tuple: (index, all_docs) where index maps term -> [doc_freq, {doc_id: array of positions}] with dense integer doc ids
+            and all_docs lists the DOCNOs in stream order (doc id i is all_docs[i])
     """
-    #Creating an index:
-    logging.info("Starting Index creation")
-    start_time=datetime.datetime.now()
-    logging.info("Start time: {}".format(start_time))
     '''
     For all terms in ascensding order, index contains -
     term: document freq
@@ -193,6 +310,7 @@ def create_inverted_index(doc_list):
     #format= 
     '''
     {"string=term":(df,{doc 1:[],doc2:[]})}
+    doc ids are dense integers assigned in stream order, all_docs maps them back to DOCNOs
 
     example:
     {
@@ -211,31 +329,69 @@ def create_inverted_index(doc_list):
     }
     '''
     index={}
-    all_docs=set()
+    #DOCNOs in stream order, a doc's dense integer id is its position in this list
+    all_docs=[]
     for doc in doc_list:
-        doc_id=doc['id']
-        all_docs.add(doc_id)
+        doc_id=len(all_docs)
+        all_docs.append(doc['id'])
         pos=1
         for word in doc['headline']+doc['text']:
             if word not in index:
-                index[word]=[1,{doc['id']:[pos]}]
+                index[word]=[1,{doc_id:array('I',[pos])}]
             else: #word already in index
                 #doc id in child dict
-                if doc['id'] in index[word][1].keys():
-                    index[word][1][doc['id']].append(pos)
+                if doc_id in index[word][1].keys():
+                    index[word][1][doc_id].append(pos)
                 else:#doc id not in child dict
                     index[word][0]+=1
-                    index[word][1][doc['id']]=[pos]
+                    index[word][1][doc_id]=array('I',[pos])
             pos=pos+1
+    return index, all_docs
+
+def merge_indexes(partial_indexes):
+    """
+    Merges partial indexes built over consecutive shards of the document stream.
+    Shards have to arrive in stream order so every postings dict keeps the same doc order as a serial build
+
+    Args:
+        partial_indexes (iterable) (index, all_docs) tuples as returned by build_index
+    Returns:
+        tuple: merged (index, all_docs)
+    """
+    index={}
+    all_docs=[]
+    for partial_index, partial_docs in partial_indexes:
+        #every shard numbers its docs from 0, shift them past the docs merged so far
+        base=len(all_docs)
+        all_docs.extend(partial_docs)
+        for word, (doc_freq, postings) in partial_index.items():
+            if base:
+                postings={base+doc_id: positions for doc_id, positions in postings.items()}
+            if word not in index:
+                index[word]=[doc_freq, postings]
+            else:
+                index[word][0]+=doc_freq
+                index[word][1].update(postings)
+    return index, all_docs
 
+def write_index(index, all_docs, json_output=False, impact_ordered=False):
+    """
+    Writes the index to data/test_set/result/index.txt and the binary data/index.bin.
+    data/index.json is only written as a debug dump when json_output is set
 
+    Args:
+        index (dict): index as returned by build_index
+        all_docs (list): DOCNOs of all indexed documents, indexed by doc id
+        json_output (bool, optional): also write the indent=4 JSON export
+        impact_ordered (bool, optional): flag the file so readers serve every term's postings by descending weight
+    """
     with open("data/test_set/result/index.txt",'w') as file:
         for k in sorted(index.keys()):
             file.write(str(k)+":"+str(index[k][0]))
             file.write("\n")
 
             for doc in index[k][1].keys():
-                file.write("        "+doc+": ")
+                file.write("        "+all_docs[doc]+": ")
                 # logging.info(",".join(index[k][1][doc]))
                 # logging.info(" ")
                 file.write(','.join(str(pos) for pos in index[k][1][doc]))
@@ -243,127 +399,252 @@ def create_inverted_index(doc_list):
                 file.write("\n")
             file.write("\n")
         logging.info("Index file written to txt")
-        
+
+    write_binary_index(index, all_docs, impact_ordered=impact_ordered)
+    logging.info("Index file written to binary")
+
+    #the JSON export is only kept as a readable debug dump
+    if json_output:
         json_index={"__all_docs__": list(all_docs)}
 
         for term, (doc_freq, postings) in sorted(index.items()):
             json_index[term]={
                 "doc_freq": doc_freq,
                 "postings_list": {
-                     str(doc_id): positions for doc_id, positions in postings.items()
+                     str(all_docs[doc_id]): list(positions) for doc_id, positions in postings.items()
                     }
                 }
             
         with open("data/index.json", 'w') as json_file:
             json.dump(json_index, json_file, indent=4)
         logging.info("Index file written to json")
-        
+
+def create_inverted_index(doc_list, json_output=False, impact_ordered=False):
+    """
+    Creates an inverted index from a list of documents
+    The inverted index is a dictionary where each key is a term, and the value is a tuple containing the document frequency 
+    and a dictionary of document IDs with their respective positions of the term
+    Args:
+        doc_list (iterable) documents, e.g. the generator returned by preprocessor
+    Returns:
+        dict: The inverted index
+    Example:
+        Input:
+            doc_list=[
+                {'id': 1, 'headline': ['Lorem', 'ipsum'], 'text': ['dolor', 'sit', 'amet']},
+                {'id': 2, 'headline': ['ipsum', 'Lorem'], 'text': ['amet', 'sit', 'dolor']}
+            ]
+        Output:
+                "Lorem": [2, {0: [1], 1: [2]}],
+                "ipsum": [2, {0: [2], 1: [1]}],
+                "dolor": [2, {0: [3], 1: [6]}],
+                "sit": [2, {0: [4], 1: [5]}],
+                "amet": [2, {0: [5], 1: [4]}]
+            ]
+        (doc ids are dense integers, doc 1 gets id 0 and doc 2 id 1; positions are array('I'))
+    The function also writes the index to a text file and the binary index file (JSON only with json_output,
+    flagged impact ordered only with impact_ordered)
+    """
+    #Creating an index:
+    logging.info("Starting Index creation")
+    start_time=datetime.datetime.now()
+    logging.info("Start time: {}".format(start_time))
+
+    index, all_docs=build_index(doc_list)
+    write_index(index, all_docs, json_output, impact_ordered)
+
     logging.info("Time Taken: {}".format(datetime.datetime.now()-start_time))
     logging.info(" ")
     return index
 
+def chunk_docs(doc_list, chunk_size):
+    """
+    Splits a document stream into lists of at most chunk_size documents
+    """
+    doc_iter=iter(doc_list)
+    while True:
+        chunk=list(itertools.islice(doc_iter, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def index_chunk(docs):
+    """
+    Worker side of the parallel build: preprocesses a shard of raw documents and builds its partial index
 
+    Args:
+        docs (list) raw documents as yielded by iter_xml
+    Returns:
+        tuple: (index, all_docs) for the shard
+    """
+    analyzer=get_analyzer()
+    for doc in docs:
+        doc['headline']=analyzer.analyze(doc['headline'])
+        doc['text']=analyzer.analyze(doc['text'])
+    return build_index(docs)
 
-def boolean_search(query_list, index):
+def parallel_create_inverted_index(input_file_path, processes=None, chunk_size=500, json_output=False, impact_ordered=False):
+    """
+    Preprocesses and indexes the collection on a process pool.
+    The XML stream is sharded into chunks of chunk_size documents, each worker returns a partial index
+    and the partials are merged in stream order into the same structure create_inverted_index builds
+    Args:
+        input_file_path (str): The file path to the input XML file
+        processes (int, optional): number of worker processes (defaults to the number of cores)
+        chunk_size (int, optional): documents per shard
+        json_output (bool, optional): also write the debug JSON export
+        impact_ordered (bool, optional): flag the file so readers serve every term's postings by descending weight
+    Returns:
+        dict: The inverted index
+    """
+    logging.info("Starting parallel Index creation")
+    start_time=datetime.datetime.now()
+    logging.info("Start time: {}".format(start_time))
+
+    with multiprocessing.Pool(processes) as pool:
+        #imap hands partials back in submission order, so merging keeps docs in stream order
+        partial_indexes=pool.imap(index_chunk, chunk_docs(iter_xml(input_file_path), chunk_size))
+        index, all_docs=merge_indexes(partial_indexes)
+    write_index(index, all_docs, json_output, impact_ordered)
+
+    logging.info("Time Taken: {}".format(datetime.datetime.now()-start_time))
+    logging.info(" ")
+    return index
+
+
+
+def analyze_boolean_query(query):
+    """
+    Analyzes a boolean query: tokenizes it with quoted phrases intact, removes stop words but keeps the
+    operators, stems and lower cases the terms
+    Args:
+        query (str): boolean query string
+    Returns:
+        list: analyzed query terms
+    """
+    analyzer=get_analyzer()
+    #pre-process query
+    # query_terms=query.lower().split()
+    #Cleanup and case folding
+    #remove punctuation and replace with ' '
+
+    # query=text_cleaner(query)
+    #TOkenize but keep phrases intact
+    # query_terms=text_tokenizer(query)
+    query_terms=analyzer.tokenize_query(query)
+    
+    #remove stop words, operators are kept
+    query_terms=analyzer.remove_stopwords(query_terms, keep=analyzer.operators)
+
+    #stemmer
+    query_terms=analyzer.stem(query_terms)
+
+    return [term.lower() for term in query_terms]
+
+def evaluate_boolean(query_terms, index, query=None, cache=None):
+    """
+    Evaluates an analyzed boolean query
+    Args:
+        query_terms (list of str): terms as returned by analyze_boolean_query
+        index (dict): search index
+        query (str, optional): original query, only used in the plan log
+        cache (QueryCache, optional): keeps the result under the analyzed terms and the results of its subexpressions
+    Returns:
+        array: sorted integer doc ids that match the query
+    """
+    if cache is not None:
+        key=("boolean", tuple(query_terms))
+        doc_ids=cache.get(key, index)
+        if doc_ids is not None:
+            return doc_ids
+
+    #parse into an AST, order operands by doc freq and turn "and not" into a difference
+    plan=plan_query(parse_query(query_terms), index)
+    logger.debug("Boolean plan for {}: {}".format(query or " ".join(query_terms), describe_plan(plan)))
+
+    doc_ids=resolve(execute_plan(plan, index, phrase_doc_ids, cache), index["__all_docs__"])
+    if cache is not None:
+        cache.put(key, doc_ids, index)
+    return doc_ids
+
+def boolean_doc_ids(query, index, cache=None):
+    """
+    Evaluates a single boolean query
+    Args:
+        query (str): boolean query string
+        index (dict): search index
+        cache (QueryCache, optional): result cache
+    Returns:
+        array: sorted integer doc ids that match the query
+    """
+    with span("boolean_query"):
+        return evaluate_boolean(analyze_boolean_query(query), index, query, cache)
+
+def boolean_search(query_list, index, cache=None):
     """
     Perform a boolean search on the given index using the provided list of queries.
     Args:
         query_list (list of str): list of query strings
         index (dict): search index
+        cache (QueryCache, optional): result cache, its stats are logged at the end
     Returns:
         dict dictionary where each key is a query and the value is another dictionary with:
             - "matches" (int): The number of documents that match the query
             - "documents" (list of int) list of document IDs that match the query
     """
-    start_time=datetime.datetime.now()
-    logging.info("Boolean Search Start time: {}".format(start_time))
     query_results=OrderedDict()
-    for query in query_list:
-        #pre-process query
-        # query_terms=query.lower().split()
-        #Cleanup and case folding
-        #remove punctuation and replace with ' '
-        q=query
-
-        # query=text_cleaner(query)
-        #TOkenize but keep phrases intact
-        # query_terms=text_tokenizer(query)
-        query_terms=re.findall(r'\"[^\"]+\"|\S+', query)
-        
-        #remove stop words
-        stop_words_path="data/english_stop_list.txt"
-        with open(stop_words_path,'r') as file:
-            stop_word_set=set(file.read().split())
-
-        query_terms=[word for word in query_terms if word not in stop_word_set or word in ["and", "or", "not"]]
-
-        
-        #stemmer
-        query_terms=text_stemmer(query_terms)
-
-        operand_stack=[]
-        operator_stack=[]
-        operator_precedence={"or":1,"and":2,"not":3}
-
-        # print(query_terms)
-        #Create operator and operand stacks
-        for term in query_terms:
-            term=term.lower()
-
-            if term in operator_precedence.keys():
-                #precedence wise operator search
-                #check if top precedence > curr op
-                while len(operator_stack)>0 and operator_precedence[operator_stack[-1]] >= operator_precedence[term]:
-                    op=operator_stack.pop()
-                    if op=="not":
-                        operand_doc_ids= operand_stack.pop()
-                        all_doc_ids=set(index["__all_docs__"])
-                        operand_stack.append(all_doc_ids - operand_doc_ids)
-                    else: #and and or
-                        right_doc_ids=operand_stack.pop()
-                        left_doc_ids=operand_stack.pop()
-
-                        if op=="and":
-                            operand_stack.append(left_doc_ids & right_doc_ids)
-                        elif op=="or":
-                            operand_stack.append(left_doc_ids | right_doc_ids)
-
-                operator_stack.append(term)
-            else:
-                # Process phrase operand by using phrase search function
-                if term[0]=='"' and term[-1]=='"':
-                    phrase=term.strip('"')
-                    phrase_result=phrase_search([phrase], index)
-                    doc_ids=set(phrase_result)
-                else:
-                    if term in index:
-                        doc_ids=set(index[term]["postings_list"].keys())
-                    else:
-                        doc_ids=set()
-                operand_stack.append(doc_ids)
-                # print("doc ids pushed in stack for"+term)
-        
-
-        while operator_stack:
-            op=operator_stack.pop()
-
-            if op=="not":
-                operand_doc_ids= operand_stack.pop()
-                all_doc_ids=set(index["__all_docs__"])
-                operand_stack.append(all_doc_ids - operand_doc_ids)
-            else: #and and or
-                right_doc_ids=operand_stack.pop()
-                left_doc_ids=operand_stack.pop()
-
-                if op=="and":
-                    operand_stack.append(left_doc_ids & right_doc_ids)
-                elif op=="or":
-                    operand_stack.append(left_doc_ids | right_doc_ids)
-        res_docs=list(operand_stack.pop())
-        query_results[query] ={"matches":len(res_docs) ,"documents":res_docs}
-    logging.info("Time taken: {}".format(datetime.datetime.now()-start_time))
+    with span("boolean_search"):
+        for query in query_list:
+            res_docs=to_docnos(boolean_doc_ids(query, index, cache), index)
+            query_results[query] ={"matches":len(res_docs) ,"documents":res_docs}
+    if cache is not None:
+        #hits and misses are counted in the metrics (query_cache_hits, query_cache_misses)
+        logger.debug("Query cache: {}".format(cache.stats()))
     return query_results    
 
+def phrase_matches(query, index):
+    """
+    Positional phrase match: the phrase terms' sorted position lists are joined with one forward-moving
+    cursor per term at offsets 0, 1, 2, ..., so phrases of any length are checked at every offset
+    Args:
+        query (str): phrase to search for
+        index (dict): search index
+    Returns:
+        OrderedDict: doc id -> array of positions where the phrase starts, for every doc containing it
+    """
+    #clean, tokenize, remove stop words and stem
+    #positions in the index are counted after stop word removal, so the offset of a term is its place in this list
+    query_terms=get_analyzer().analyze(query)
+    matches=OrderedDict()
+    if not query_terms or any(term not in index for term in query_terms):
+        return matches
+    entries=[index[term] for term in query_terms]
+    offsets=list(range(len(query_terms)))
+
+    #docs containing every term, rarest term first
+    with span("merge"):
+        common_docs=entries[0]["doc_ids"]
+        for entry in sorted(entries, key=lambda entry: entry["doc_freq"]):
+            common_docs=intersect(common_docs, entry["doc_ids"])
+
+    for doc in common_docs:
+        positions=phrase_positions([doc_positions(entry, doc) for entry in entries], offsets)
+        if positions:
+            matches[doc]=positions
+    return matches
+
+def phrase_doc_ids(query, index):
+    """
+    Finds the documents containing a phrase
+    Args:
+        query (str): phrase to search for
+        index (dict): search index
+    Returns:
+        array: sorted integer doc ids that contain the phrase
+    """
+    with span("phrase_query"):
+        return array('I', phrase_matches(query, index).keys())
+
 def phrase_search(query_list,index):
     """
     Perform a phrase search on the given index using the provided list of queries.
@@ -373,284 +654,373 @@ def phrase_search(query_list,index):
     Returns:
         list list of document IDs that contain the query phrases.
     """
-    start_time=datetime.datetime.now()
-    logger.info("Phrase search started {}".format(start_time))
-    for query in query_list:
-        q=query
-
-        query=text_cleaner(query)
-        query_terms=text_tokenizer(query)
-        
-        #remove stop words
-        stop_words_path="data/english_stop_list.txt"
-        with open(stop_words_path,'r') as file:
-            stop_word_set=set(file.read().split())
-        query_terms=[word for word in query_terms if word not in stop_word_set or word in ["and", "or", "not"]]
-        
-        #stemmer
-        
-        # query_terms=text_stemmer(query_terms)
-        #concatenate AND between all query terms and do boolean search
-        query_terms_bool=" and ".join(query_terms)
-
-        # print(query_terms_bool)
-        
-        bool_search_res=boolean_search([query_terms_bool],index)
-        # print(bool_search_res[query_terms_bool]["documents"])
-
-        #for all docs in bool search result,see pos diff for each term if more than 1; break;
-        common_docs=bool_search_res[query_terms_bool]["documents"]
-        query_terms=text_stemmer(query_terms)
-        # print(common_docs)
-        doc_list=[]
-
-        for doc in common_docs:
-            first_term_pos_list=index[query_terms[0]]["postings_list"][doc]
-            
-
-            for pos in first_term_pos_list:
-                phrase_match=1
-                for i in range(1,len(query_terms)):
-                    posting_list_n=index[query_terms[i]]["postings_list"][doc]
-                    if pos+1 not in posting_list_n:
-                        phrase_match=0
-                        break
-                if phrase_match>0:
-                    doc_list.append(doc)
-                    break
-    logger.info("Phrase search complete. Time: {}".format(datetime.datetime.now()-start_time))
+    doc_list=[]
+    with span("phrase_search"):
+        for query in query_list:
+            doc_list.extend(to_docnos(phrase_doc_ids(query, index), index))
     return doc_list
     
-def proximity_search(query_list,index):
+PROXIMITY_RE=re.compile(r"#\s*(od|uw)?(\d+)\s*\((.*)\)")
+
+def parse_proximity(query):
     """
-    Perform a proximity search on the given index using the provided query list.
+    Splits a proximity query into its window width, stemmed terms and ordering.
+    #N(a,b,...) and #uwN(a,b,...) match the terms in any order within N positions,
+    #odN(a,b,...) only in the given order
+    Args:
+        query (str): proximity query
+    Returns:
+        tuple: (width, list of stemmed terms, ordered)
+    """
+    match=PROXIMITY_RE.match(query.strip())
+    if match is None:
+        raise ValueError("not a proximity query: {}".format(query))
+    ordered=match.group(1)=="od"
+    pos_diff=int(match.group(2))
+    query_terms=[word.strip() for word in match.group(3).lower().split(',')]
+    query_terms=get_analyzer().stem([word for word in query_terms if word])
+    return pos_diff, query_terms, ordered
+
+def proximity_doc_ids(query, index, entries=None, cache=None):
+    """
+    Finds the documents matching one proximity query with a linear window scan over the terms' sorted positions
     Args:
-        query_list (list of str) list of proximity queries. Each query should be in the format '#N(term1,term2)' 
-                                  where N is the maximum allowed distance between term1 and term2.
+        query (str): proximity query such as '#15(income,taxes)'
         index (dict): search index
+        entries (dict, optional): term -> index entry lookups shared between queries of a batch
+        cache (QueryCache, optional): result cache
     Returns:
-        list of int sorted list of document IDs that satisfy the proximity search criteria.
+        array: sorted integer doc ids that satisfy the proximity constraint
     """
-    start_time=datetime.datetime.now()
-    logger.info("Proximity search started {}".format(start_time))
-    for query in query_list:
-        q=query
-
-        query=query.split('(')
-        pos_diff=int(query[0].replace('#',''))
-        query_terms=query[1].lower().replace(")",'').split(',')
-
-        # query=text_cleaner(query)
-        # query_terms=text_tokenizer(query)
-        
-        #remove stop words
-        # stop_words_path="data/english_stop_list.txt"
-        # with open(stop_words_path,'r') as file:
-            # stop_word_set=set(file.read().split())
-        # query_terms=[word for word in query_terms if word not in stop_word_set or word in ["and", "or", "not"]]
-        
-        #stemmer
-        
-
-        #concatenate AND between all query terms and do boolean search
-        query_terms_bool=" and ".join(query_terms)
-
-        # print(query_terms_bool)
-
-        
-        bool_search_res=boolean_search([query_terms_bool],index)
-        # print(bool_search_res[query_terms_bool]["documents"])
-
-        #for all docs in bool search result,see pos diff for each term if more than 1; break;
-        common_docs=bool_search_res[query_terms_bool]["documents"]
-        query_terms=text_stemmer(query_terms)
-
-        query_terms=[word.strip() for word in query_terms]
+    with span("proximity_query"):
+        pos_diff, query_terms, ordered=parse_proximity(query)
+        if cache is not None:
+            key=("proximity", pos_diff, tuple(query_terms), ordered)
+            doc_list=cache.get(key, index)
+            if doc_list is not None:
+                return doc_list
+            return cache.put(key, proximity_doc_ids(query, index, entries), index)
+        if entries is None:
+            entries={}
+        for term in query_terms:
+            if term not in entries:
+                entries[term]=index[term] if term in index else None
+        term_entries=[entries[term] for term in query_terms]
+        if not term_entries or None in term_entries:
+            return array('I')
+
+        #docs containing every term, rarest term first
+        with span("merge"):
+            common_docs=term_entries[0]["doc_ids"]
+            for entry in sorted(term_entries, key=lambda entry: entry["doc_freq"]):
+                common_docs=intersect(common_docs, entry["doc_ids"])
+
+        window_match=ordered_window if ordered else unordered_window
+        doc_list=array('I')
+        for doc in common_docs:
+            if window_match([doc_positions(entry, doc) for entry in term_entries], pos_diff):
+                doc_list.append(doc)
+        return doc_list
 
-        # print(common_docs)
-        doc_list=[]
+def proximity_search_batch(query_list,index,cache=None):
+    """
+    Evaluates many proximity queries, fetching each distinct term's postings once for the whole batch
+    Args:
+        query_list (list of str) list of proximity queries
+        index (dict): search index
+        cache (QueryCache, optional): result cache
+    Returns:
+        OrderedDict: query -> sorted list of document IDs (as int) matching that query
+    """
+    entries={}
+    query_results=OrderedDict()
+    with span("proximity_search"):
+        for query in query_list:
+            query_results[query]=sorted(int(docno) for docno in to_docnos(proximity_doc_ids(query, index, entries, cache), index))
+    return query_results
 
-        for doc in common_docs:
-            first_term_pos_list=index[query_terms[0]]["postings_list"][doc]
-
-            for pos in first_term_pos_list:
-                posting_list_2=index[query_terms[1]]["postings_list"][doc]
-                found_match=0
-                for next_pos in posting_list_2:
-                    # if (pos < next_pos) and (next_pos <= pos + pos_diff): #if order matters -> incom should come bfore tax
-                    if abs(pos-next_pos)<=pos_diff:
-                        found_match=1
-                        break
-
-                if found_match>0:
-                    doc_list.append(int(doc))
-                    break
-
-        logger.info("Proximity search complete. Time: {}".format(datetime.datetime.now()-start_time))
+def proximity_search(query_list,index,cache=None):
+    #docs matching any of the queries
+    """
+    Perform a proximity search on the given index using the provided query list.
+    Args:
+        query_list (list of str) list of proximity queries. Each query should be in the format '#N(term1,term2,...)' 
+                                  where N is the maximum allowed distance between the terms (any order),
+                                  or '#odN(term1,term2,...)' for the terms in that order within N positions.
+        index (dict): search index
+        cache (QueryCache, optional): result cache
+    Returns:
+        list of int sorted list of document IDs that satisfy the proximity search criteria of any of the queries.
+    """
+    doc_list=set()
+    for docs in proximity_search_batch(query_list, index, cache).values():
+        doc_list.update(docs)
     return sorted(doc_list)
 
-def ranked_retrieval(query_list,index):
+def score_top_k(query_terms, index, k=RESULTS_PER_QUERY):
     """
-    Perform ranked retrieval on a list of queries using a given index.
-    This function calculates the TF-IDF score for each document in the index
-    based on the terms in the query list.
+    Scores the docs matching any of the analyzed query terms by TF-IDF, document at a time with MaxScore pruning.
+    Terms are ordered by their max score bound. Once the size-k min-heap of (score, -doc id) is full, the
+    cheapest terms whose bounds together cannot beat its lowest score become non-essential: candidate docs
+    only come from the essential terms, and the non-essential lists are only galloped to a doc while it can
+    still make the top k. The result is the same as scoring every doc.
     Args:
-        query_list (list of str) list of query strings to be processed.
-        index (dict): search index
+        query_terms (list of str): analyzed query terms, repeated terms count once per occurrence
+        index (dict or MappedIndex): search index, entries carry the "max_score" the index stores for the term
+        k (int or None): number of docs to keep, None keeps every matching doc
     Returns:
-        dict: result dict
+        list: (score, doc id) tuples best first, equal scores by ascending doc id
     """
-    start_time= datetime.datetime.now()
-    logger.info("Starting Ranked Retrieval at {}".format(start_time))
-    
     #tfidf
     '''
     tf=term freq -> no of times term appeard in doc
-    for any doc; tf=index.term.postings_list.doc_id.size of list()
     idf= N/doc freq
-    N=no of docs=index.term.postings_list.size()
-    doc_freq= index.term.doc_freq
-    score=1+log(tf)+log(N/df)
+    N=no of docs
+    weight=(1+log(tf))*log(N/df), computed from the tfs and the stored idf when a term is decoded
+    score=sum of the weights of the query terms
     '''
-    res={}
-    q_num=1
-    for query in query_list:
-
-        query=text_cleaner(query)
-        query_terms=text_tokenizer(query)
-        
-        #remove stop words
-        stop_words_path="data/english_stop_list.txt"
-        with open(stop_words_path,'r') as file:
-            stop_word_set=set(file.read().split())
-        query_terms=[word for word in query_terms if word not in stop_word_set]
-        
-        #stemmer
-        
-        query_terms=text_stemmer(query_terms)
-        #concatenate AND between all query terms and do boolean search
-        query_terms_bool=" or ".join(query_terms)
-
-
-        # print(query_terms_bool)
-        
-        bool_search_res=boolean_search([query_terms_bool],index)
-        # print(bool_search_res[query_terms_bool]["documents"])
-
-        #for all docs in bool search result,see pos diff for each term if more than 1; break;
-        all_docs=bool_search_res[query_terms_bool]["documents"]
-        '''
-        tf=term freq -> no of times term appeard in doc
-        for term in query; tf=index.term.postings_list.doc_id.size of list()
-        idf= N/doc freq
-        N=no of docs=index.term.postings_list.size()
-        doc_freq= index.term.doc_freq
-        score=1+log(tf)+log(N/df)
-        '''
-        #calculate weight
-        for doc in all_docs:
-            N=len(index["__all_docs__"])
+    check_k(k)
+    #one list per distinct term, a term repeated in the query adds its weight once per occurrence
+    terms=[]
+    for term in query_terms:
+        if term not in terms:
+            terms.append(term)
+    term_order=[terms.index(term) for term in query_terms]
+    lists=[]
+    for t, term in enumerate(terms):
+        entry=index[term] if term in index else None
+        if entry is None or entry["doc_freq"]==0:
+            continue
+        occurrences=query_terms.count(term)
+        lists.append({"term":t, "count":occurrences, "entry":entry, "bound":entry["max_score"]*occurrences, "cursor":0})
+    lists.sort(key=lambda posting_list: posting_list["bound"])
+    #upper[i]: best score a doc can get from lists[0..i]
+    upper=list(itertools.accumulate(posting_list["bound"] for posting_list in lists))
+
+    top_k=[]
+    threshold=-math.inf
+    non_essential=0
+    scored=0
+    wtds=[0]*len(terms)
+    while non_essential<len(lists):
+        #next doc of the essential lists
+        doc=None
+        for posting_list in lists[non_essential:]:
+            doc_ids=posting_list["entry"]["doc_ids"]
+            if posting_list["cursor"]<len(doc_ids) and (doc is None or doc_ids[posting_list["cursor"]]<doc):
+                doc=doc_ids[posting_list["cursor"]]
+        if doc is None:
+            break
+
+        bound=upper[non_essential-1] if non_essential else 0
+        for posting_list in lists[non_essential:]:
+            entry=posting_list["entry"]
+            cursor=posting_list["cursor"]
+            if cursor<len(entry["doc_ids"]) and entry["doc_ids"][cursor]==doc:
+                wtd=entry["weights"][cursor]
+                wtds[posting_list["term"]]=wtd
+                bound+=wtd*posting_list["count"]
+                posting_list["cursor"]=cursor+1
+        #a doc coming later than every doc in the heap has to beat the lowest score strictly
+        competitive=True
+        for i in range(non_essential-1, -1, -1):
+            if bound+SCORE_EPSILON<=threshold:
+                competitive=False
+                break
+            posting_list=lists[i]
+            entry=posting_list["entry"]
+            bound-=posting_list["bound"]
+            cursor=gallop(entry["doc_ids"], doc, posting_list["cursor"])
+            posting_list["cursor"]=cursor
+            if cursor<len(entry["doc_ids"]) and entry["doc_ids"][cursor]==doc:
+                wtd=entry["weights"][cursor]
+                wtds[posting_list["term"]]=wtd
+                bound+=wtd*posting_list["count"]
+
+        if competitive:
+            scored+=1
+            #add up in query order, so scores come out exactly as a term by term loop would give them
+            w=0
+            for t in term_order:
+                w=w+wtds[t] #doc level weight
+            candidate=(w, -doc)
+            if k is None or len(top_k)<k:
+                heapq.heappush(top_k, candidate)
+            elif candidate>top_k[0]:
+                heapq.heapreplace(top_k, candidate)
+            if k is not None and len(top_k)==k and top_k[0][0]>threshold:
+                threshold=top_k[0][0]
+                while non_essential<len(lists) and upper[non_essential]+SCORE_EPSILON<=threshold:
+                    non_essential+=1
+        for t in range(len(terms)):
+            wtds[t]=0
+    count("docs_scored", scored)
+    return [(score, -neg_doc) for score, neg_doc in sorted(top_k, reverse=True)]
+
+def score_top_k_impact(query_terms, index, k=RESULTS_PER_QUERY):
+    """
+    Scores the top k docs of analyzed query terms with the threshold algorithm over impact ordered postings.
+    Every round reads the next best posting of each term and scores the docs not seen yet by looking them up
+    in the other terms' doc id lists. The weights at the current depth bound the score of every unseen doc,
+    so the scan stops as soon as that bound falls below the lowest score of a full top k.
+    Args:
+        query_terms (list of str): analyzed query terms, repeated terms count once per occurrence
+        index (dict or MappedIndex): search index written with impact_ordered=True
+        k (int or None): number of docs to keep, None scores every matching doc with score_top_k
+    Returns:
+        list: (score, doc id) tuples best first, equal scores by ascending doc id, the same as score_top_k
+    """
+    check_k(k)
+    if k is None:
+        #nothing can be cut from an unbounded result
+        return score_top_k(query_terms, index, k)
+    terms=[]
+    for term in query_terms:
+        if term not in terms:
+            terms.append(term)
+    term_order=[terms.index(term) for term in query_terms]
+    lists=[]
+    for t, term in enumerate(terms):
+        entry=index[term] if term in index else None
+        if entry is None or entry["doc_freq"]==0:
+            continue
+        if "impact_order" not in entry:
+            raise ValueError("the index has no impact ordered postings, build it with impact_ordered=True")
+        lists.append({"term":t, "count":query_terms.count(term), "entry":entry})
+
+    top_k=[]
+    seen=set()
+    wtds=[0]*len(terms)
+    depth=0
+    while True:
+        exhausted=True
+        for posting_list in lists:
+            entry=posting_list["entry"]
+            if depth>=entry["doc_freq"]:
+                continue
+            exhausted=False
+            doc=entry["doc_ids"][entry["impact_order"][depth]]
+            if doc in seen:
+                continue
+            seen.add(doc)
+            for other in lists:
+                i=find_doc(other["entry"]["doc_ids"], doc)
+                wtds[other["term"]]=other["entry"]["weights"][i] if i>=0 else 0
+            #add up in query order, so scores come out exactly as a term by term loop would give them
             w=0
-            for term in query_terms:
-                wtd=0
-                if doc in index[term]["postings_list"]:
-                    tf=len(index[term]["postings_list"][doc])
-                    df=index[term]["doc_freq"]
-                else:
-                    tf=0
-                    df=0
-                if tf==0 or df==0:
-                    wtd=0
-                else:
-                    wtd=(1+math.log10(tf))*(math.log10(N/df))
-                # idf= N/df if df!=0 else 0
-                # print("tf of {} in {} is {}".format(term,doc,tf))
-                # print("N/df of {} in {} is {}".format(term,doc,idf))
-                w=w+wtd #doc level weight
-            if " ".join(query_terms) not in res:
-                res[" ".join(query_terms)]=[]
-
-            res[" ".join(query_terms)].append({
-                "term":" ".join(query_terms),
-                "doc":doc,
-                "qnum":q_num,
-                "score":w
-                })
-        q_num=q_num+1
-    logger.info("Ranked Retrieval done. Time: {}".format(datetime.datetime.now()-start_time))
+            for t in term_order:
+                w=w+wtds[t] #doc level weight
+            candidate=(w, -doc)
+            if len(top_k)<k:
+                heapq.heappush(top_k, candidate)
+            elif candidate>top_k[0]:
+                heapq.heapreplace(top_k, candidate)
+        if exhausted:
+            break
+        depth+=1
+        #best score a doc none of the lists has reached yet can still get
+        bound=0
+        for posting_list in lists:
+            entry=posting_list["entry"]
+            if depth<entry["doc_freq"]:
+                bound+=entry["weights"][entry["impact_order"][depth]]*posting_list["count"]
+        #an unseen doc with an equal score may still win the tie on doc id, so the bound has to be strictly lower
+        if len(top_k)==k and bound+SCORE_EPSILON<top_k[0][0]:
+            break
+    count("docs_scored", len(seen))
+    return [(score, -neg_doc) for score, neg_doc in sorted(top_k, reverse=True)]
+
+def rank_query(query_terms, index, k=RESULTS_PER_QUERY, scorer=score_top_k, cache=None):
+    """
+    Ranks analyzed query terms, looking the ranking up in a QueryCache first when one is given
+    Args:
+        query_terms (list of str): analyzed query terms
+        index (dict): search index
+        k (int or None): number of docs to keep, None keeps every matching doc
+        scorer (function): score_top_k or score_top_k_impact
+        cache (QueryCache, optional): result cache
+    Returns:
+        list: (score, doc id) tuples best first
+    """
+    check_k(k)
+    with span("ranked_query"):
+        if cache is not None:
+            key=("ranked", tuple(query_terms), k)
+            ranked=cache.get(key, index)
+            if ranked is not None:
+                return ranked
+        with span("score"):
+            ranked=scorer(query_terms, index, k)
+        if cache is not None:
+            cache.put(key, ranked, index)
+        return ranked
+
+def ranked_retrieval(query_list,index,k=RESULTS_PER_QUERY,impact_ordered=False,cache=None):
+    """
+    Perform ranked retrieval on a list of queries using a given index.
+    Every query is analyzed and its top k docs are scored with score_top_k, or with score_top_k_impact
+    when impact_ordered is set.
+    Args:
+        query_list (list of str) list of query strings to be processed.
+        index (dict): search index
+        k (int or None): results kept per query, None keeps every matching doc
+        impact_ordered (bool): use the impact ordered postings and stop early
+        cache (QueryCache, optional): keeps the ranking of each analyzed query, its stats are logged at the end
+    Returns:
+        OrderedDict: query number (from 1, in query_list order) -> list of (DOCNO, score) best first
+    """
+    res=OrderedDict()
+    analyzer=get_analyzer()
+    docnos=index["__docnos__"]
+    scorer=score_top_k_impact if impact_ordered else score_top_k
+    with span("ranked_retrieval"):
+        for q_num, query in enumerate(query_list, 1):
+            #clean, tokenize, remove stop words and stem
+            query_terms=analyzer.analyze(query)
+            res[q_num]=[(docnos[doc], score) for score, doc in rank_query(query_terms, index, k, scorer, cache)]
+    if cache is not None:
+        #hits and misses are counted in the metrics (query_cache_hits, query_cache_misses)
+        logger.debug("Query cache: {}".format(cache.stats()))
     return res
 
 
 
 if __name__ == "__main__":
     # processed_text=preprocessor("data/trec.sample.xml")
-    processed_text=preprocessor("data/trec.5000.xml")
-    index_dict=create_inverted_index(processed_text)
-    json_index={}
-    with open("data/index.json", 'r') as json_file:
-        json_index=json.load(json_file)
-    logging.info("JSON index loaded")  
+    # processed_text=preprocessor("data/trec.5000.xml")
+    # index_dict=create_inverted_index(processed_text)
+    index_dict=parallel_create_inverted_index("data/trec.5000.xml")
+    index=open_index("data/index.bin")
 
-    # print(boolean_search(["Sadness"],json_index))
+    # print(boolean_search(["Sadness"],index))
 
     # logging.info(type(json_index))  
     
     # Search
-    queries=[]
-    with open("data/test_set/queries.boolean.txt",'r') as file:
-        for line in file:
-            queries.append(line.strip())
-
-    res={}
-    q_num=1
-    for query in queries:
-        q=" ".join(query.split()[1:])
-        res[q_num]={"q_num":q_num,
-                    "query": q,
-                    "matches":0,
-                    "result":[]}
-        
-        if '#' in q:
-            res[q_num]["result"]=proximity_search([q],json_index)
-        else:
-            res[q_num]["result"]=boolean_search([q],json_index)[q]["documents"]
-        res[q_num]["matches"]=len(res[q_num]["result"])
-        q_num+=1
-
-
-    # pprint.pprint(res)
-
-    with open("data/test_set/result/results.boolean.txt",'w') as file:
-        for q in res.keys():
-            for doc in res[q]["result"]:
-                file.write("{},{}\n".format(q,doc))
-                
+    #all queries of a file are analyzed first and every postings list is fetched once for the batch
+    boolean_res=batch_boolean_search(read_query_file("data/test_set/queries.boolean.txt"),index)
+
+    # pprint.pprint(boolean_res)
+
+    write_boolean_results(boolean_res,"data/test_set/result/results.boolean.txt")
     logger.info("Result file written for boolean search")
     
-    query_list=[]
-
-    with open("data/test_set/queries.ranked.txt",'r') as file:
-        for line in file:
-            line=line.replace('\n','').split()
-            line=" ".join(line[1:])
-            query_list.append(line)
+    query_list=read_query_file("data/test_set/queries.ranked.txt")
     # print(query_list)
     
-    ranked_res=ranked_retrieval(query_list,json_index)
+    if np is not None:
+        #one batch of array operations instead of a python loop per doc
+        ranked_res=vectorized_ranked_retrieval(query_list,TermDocMatrix.from_index(index))
+    else:
+        ranked_res=batch_ranked_search(query_list,index)
     
     # pp=pprint.PrettyPrinter(indent=4)
     # pp.pprint(ranked_res)
 
-
-
-
-    with open("data/test_set/result/results.ranked.txt",'w') as file:
-        for query in ranked_res:
-            count=0
-            sorted_results=sorted(ranked_res[query], key=lambda x: x['score'], reverse=True)
-            for res in sorted_results:
-                file.write(f"{res['qnum']},{res['doc']},{round(res['score'],4)}\n")
-                count+=1
-                if count>=150:
-                    break
+    write_ranked_results(ranked_res,"data/test_set/result/results.ranked.txt",digits=RESULT_DIGITS)
     logger.info("Ranked retrieval results written to txt file")
+
+    #per stage timings and counters, recorded when SEARCH_METRICS is set
+    if metrics_enabled():
+        for line in metrics_summary(export_metrics()):
+            logger.info(line)
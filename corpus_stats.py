@@ -0,0 +1,183 @@
+import heapq
+import itertools
+import logging
+from collections import OrderedDict
+
+from indexing import get_analyzer
+from query_planner import term_doc_freq
+from query_cache import index_generation, next_generation
+from ranked_retrieval import rank_query, score_top_k, score_top_k_impact
+from scoring import idf, posting_weights, impact_order, RESULTS_PER_QUERY
+from metrics import span, count
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Collection wide TF-IDF statistics for a collection split over several indexes.
+
+The weights an index serves (or a SegmentedIndex computes) use that index's own N and doc freqs, so the same
+doc scores differently depending on how the collection was split and the top k lists of two indexes cannot be
+merged. A CorpusStatistics adds doc freqs and N up over all the indexes (MappedIndex files, loaded dicts,
+SegmentedIndexes or their snapshots), caches the doc freqs per term and answers a whole query's terms with one
+batched lookup. A GlobalStatsIndex view of one of the indexes recomputes its postings' weights against those
+statistics, with the same scoring functions the index writer uses, so every score is bit for bit the one an
+index of the whole collection gives and merged top k lists are directly comparable.
+
+The statistics are dropped and recomputed as soon as the generation of any of the indexes changes.
+A StatsSnapshot is the plain, picklable form of the statistics for a set of terms, for scorers in other processes.
+'''
+
+STATS_CACHE_SIZE=100_000
+
+
+class StatsSnapshot:
+    '''
+    N and the doc freqs of a set of terms, frozen. Serves the lookups of GlobalStatsIndex like CorpusStatistics.
+    '''
+    def __init__(self, num_docs, doc_freqs):
+        self.num_docs=num_docs
+        self.doc_freqs=doc_freqs
+        self.generation=next_generation()
+
+    def doc_freq(self, term):
+        #only the terms the snapshot was taken for
+        return self.doc_freqs[term]
+
+class CorpusStatistics:
+    '''
+    N and per term doc freqs summed over indexes, doc freqs cached in an LRU of cache_size terms.
+    '''
+    def __init__(self, indexes, cache_size=STATS_CACHE_SIZE):
+        self.indexes=list(indexes)
+        self.cache_size=cache_size
+        self.cache=OrderedDict()
+        self.generations=None
+        self._num_docs=0
+        self.hits=0
+        self.misses=0
+
+    def validate(self):
+        generations=tuple(index_generation(index) for index in self.indexes)
+        if generations!=self.generations:
+            self.generations=generations
+            self.cache.clear()
+            self._num_docs=sum(len(index["__all_docs__"]) for index in self.indexes)
+
+    @property
+    def num_docs(self):
+        self.validate()
+        return self._num_docs
+
+    @property
+    def generation(self):
+        self.validate()
+        return self.generations
+
+    def doc_freqs(self, terms):
+        '''
+        {term: collection wide doc freq} of every term, the ones not cached fetched from each index once.
+        '''
+        self.validate()
+        cache=self.cache
+        res={}
+        missing=[]
+        for term in terms:
+            if term in res:
+                continue
+            if term in cache:
+                self.hits+=1
+                cache.move_to_end(term)
+                res[term]=cache[term]
+            else:
+                res[term]=None
+                missing.append(term)
+        if missing:
+            self.misses+=len(missing)
+            count("stats_lookups", len(missing))
+            for term in missing:
+                res[term]=sum(term_doc_freq(index, term) for index in self.indexes)
+                cache[term]=res[term]
+            while len(cache)>self.cache_size:
+                cache.popitem(last=False)
+        return res
+
+    def doc_freq(self, term):
+        return self.doc_freqs([term])[term]
+
+    def idf(self, term):
+        doc_freq=self.doc_freq(term)
+        return idf(self.num_docs, doc_freq) if doc_freq else 0.0
+
+    def snapshot(self, terms):
+        return StatsSnapshot(self.num_docs, self.doc_freqs(terms))
+
+    def stats(self):
+        return {"terms": len(self.cache), "hits": self.hits, "misses": self.misses, "num_docs": self._num_docs}
+
+class GlobalStatsIndex:
+    '''
+    View of one index whose entries carry idf, weights, max score (and impact order, when the index has one)
+    computed against collection statistics (CorpusStatistics or StatsSnapshot) instead of the index's own.
+    doc_freq, doc ids and positions stay the index's own, so boolean planning is unchanged.
+    '''
+    def __init__(self, index, stats):
+        self.index=index
+        self.stats=stats
+        self.entries={}
+        self.generation=(index_generation(index), stats.generation)
+
+    def get(self, term, default=None):
+        if term in ("__all_docs__", "__docnos__"):
+            return self.index[term]
+        if term not in self.entries:
+            entry=self.index.get(term)
+            if entry is not None:
+                num_docs, doc_freq=self.stats.num_docs, self.stats.doc_freq(term)
+                weights=posting_weights(entry["positions"], num_docs, doc_freq)
+                entry=dict(entry, idf=idf(num_docs, doc_freq), weights=weights, max_score=max(weights))
+                if "impact_order" in entry:
+                    entry["impact_order"]=impact_order(weights)
+            self.entries[term]=entry
+        entry=self.entries[term]
+        return default if entry is None else entry
+
+    def __getitem__(self, term):
+        entry=self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def doc_freq(self, term):
+        return term_doc_freq(self.index, term)
+
+    def keys(self):
+        return self.index.keys()
+
+def federated_ranked_retrieval(query_list, indexes, k=RESULTS_PER_QUERY, stats=None, impact_ordered=False):
+    '''
+    Ranks the top k docs of every query over several indexes holding consecutive parts of one collection.
+    Every index is scored against the collection statistics (a CorpusStatistics over indexes unless one is
+    given) and the top k lists are merged by score, ties going to the earlier index and then the lower doc id,
+    which is the order of the docs in the whole collection.
+    Returns {query number: [(DOCNO, score)]} best first, like ranked_retrieval on one index of the collection.
+    '''
+    if stats is None:
+        stats=CorpusStatistics(indexes)
+    analyzer=get_analyzer()
+    scorer=score_top_k_impact if impact_ordered else score_top_k
+    res=OrderedDict()
+    with span("federated_ranked_retrieval"):
+        analyzed=[analyzer.analyze(query) for query in query_list]
+        #one batched lookup for the doc freqs of the whole query list
+        snapshot=stats.snapshot(term for query_terms in analyzed for term in query_terms)
+        views=[GlobalStatsIndex(index, snapshot) for index in indexes]
+        for q_num, query_terms in enumerate(analyzed, 1):
+            ranked_lists=[[(score, part, doc) for score, doc in rank_query(query_terms, view, k, scorer)]
+                          for part, view in enumerate(views)]
+            merged=heapq.merge(*ranked_lists, key=lambda result: (-result[0], result[1], result[2]))
+            res[q_num]=[(views[part]["__docnos__"][doc], score) for score, part, doc in itertools.islice(merged, k)]
+    return res
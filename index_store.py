@@ -0,0 +1,356 @@
+import os
+import struct
+import json
+import mmap
+import datetime
+import logging
+from array import array
+from collections import OrderedDict
+
+from scoring import idf, tf_weights, posting_weights, impact_order
+from metrics import span, count
+from query_cache import next_generation
+from postings_codecs import CODECS, encode_postings, tfs_of
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Binary on-disk index format (all fixed width numbers little endian)
+
+    header:        magic "TFIX", format version (u16), flags (u16), N = number of docs (u32), number of terms (u32),
+                   followed by the absolute offsets (u64) of the six sections below
+    doc offsets:   N+1 x u64, DOCNO i is doc_strings[doc_offsets[i]:doc_offsets[i+1]]
+    doc strings:   utf-8 DOCNOs back to back; DOCNO i belongs to the dense integer doc id i
+    term offsets:  T+1 x u64, same scheme for the terms, which are in ascending order
+    term strings:  utf-8 terms back to back
+    term info:     T x (doc_freq u32, postings offset u64, doc block length u32, position block length u32,
+                        idf f64, max score f64, doc codec u8, position codec u8)
+    postings:      per term a doc block and a position block
+                       doc block:      the doc_freq doc ids in the term's doc codec
+                       position block: the tf of every doc, then the gaps between the positions of every doc,
+                                       in the term's position codec
+
+The codecs (variable-byte, PForDelta, Elias-Fano) and how one is picked per term are described in postings_codecs.
+The fixed width tables let a reader binary search the term dictionary straight from a memory map.
+idf and the max score (the highest weight of the term in any doc) are computed at build time. The weights are
+not stored: a reader computes them from the tfs of the position block and the stored idf when it decodes a term,
+through the same scoring functions, so they are bit for bit the weights of the build. Ranked retrieval adds them
+up and uses the max score to skip docs that cannot reach the top k. A file with the IMPACT_ORDERED flag also
+serves every term's postings numbers by descending weight (ties by doc id), sorted when the term is decoded, so
+ranked retrieval can walk a term's postings best weight first and stop early.
+'''
+
+MAGIC=b"TFIX"
+FORMAT_VERSION=6
+HEADER=struct.Struct("<4sHHII6Q")
+OFFSET=struct.Struct("<Q")
+TERM_INFO=struct.Struct("<IQIIddBB")
+
+#header flags
+IMPACT_ORDERED=1
+
+INDEX_PATH="data/index.bin"
+POSTINGS_CACHE_SIZE=1024
+
+
+def write_atomic(path, *chunks):
+    #readers either see the old file or the new one, never a partial write
+    tmp_path=path+".tmp"
+    with open(tmp_path, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(tmp_path, path)
+
+def pack_strings(strings):
+    '''
+    Returns the offset table and the concatenated utf-8 bytes for a list of strings.
+    '''
+    offsets=bytearray()
+    data=bytearray()
+    for text in strings:
+        offsets+=OFFSET.pack(len(data))
+        data+=text.encode("utf-8")
+    offsets+=OFFSET.pack(len(data))
+    return offsets, data
+
+
+def write_binary_index(index, all_docs, path=INDEX_PATH, impact_ordered=False, collection_stats=None, codec=None):
+    '''
+    Writes an index as returned by build_index ({term: [doc_freq, {doc_id: positions}]}, all_docs[doc_id] = DOCNO)
+    in the binary format. impact_ordered flags the file for impact ordered retrieval.
+    collection_stats=(N, {term: doc_freq}) computes idf, weights and max scores against the statistics of a whole
+    collection this index is one part of, as the shards of a sharded index are. Doc freqs stored per term stay
+    the index's own.
+    '''
+    terms=sorted(index.keys())
+    num_docs=len(all_docs)
+    doc_freqs=None
+    if collection_stats is not None:
+        num_docs, doc_freqs=collection_stats
+
+    doc_offsets, doc_strings=pack_strings([str(docno) for docno in all_docs])
+    term_offsets, term_strings=pack_strings(terms)
+
+    postings_at=HEADER.size+len(doc_offsets)+len(doc_strings)+len(term_offsets)+len(term_strings)+TERM_INFO.size*len(terms)
+    term_info=bytearray()
+    postings=bytearray()
+    for term in terms:
+        doc_freq, postings_list=index[term]
+        doc_ids=sorted(postings_list.keys())
+        positions=[postings_list[doc_id] for doc_id in doc_ids]
+        doc_codec, doc_block, position_codec, position_block=encode_postings(doc_ids, positions, codec)
+
+        weighted_doc_freq=doc_freqs[term] if doc_freqs is not None else doc_freq
+        weights=posting_weights(positions, num_docs, weighted_doc_freq)
+        term_info+=TERM_INFO.pack(doc_freq, postings_at+len(postings), len(doc_block), len(position_block),
+                                  idf(num_docs, weighted_doc_freq), max(weights), doc_codec.codec_id, position_codec.codec_id)
+        postings+=doc_block
+        postings+=position_block
+
+    sections=[doc_offsets, doc_strings, term_offsets, term_strings, term_info, postings]
+    section_offsets=[]
+    offset=HEADER.size
+    for section in sections:
+        section_offsets.append(offset)
+        offset+=len(section)
+
+    flags=IMPACT_ORDERED if impact_ordered else 0
+    #a MappedIndex of the old file keeps reading its own inode, rewriting the file in place would fault it
+    write_atomic(path, HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(all_docs), len(terms), *section_offsets), *sections)
+
+
+class MappedIndex:
+    '''
+    Read-only view of a binary index file through mmap.
+    Only the header is read when the index is opened; a term's postings are decoded the first time
+    a query touches it and kept in a small LRU. Since the file is mapped read-only, every search
+    process opening the same file shares its page cache.
+
+    index[term] returns the same {"doc_freq": df, "doc_ids": array, "positions": [array, ...], "idf": idf,
+    "weights": array, "max_score": bound} entry (plus "impact_order" for an impact ordered file)
+    the search functions get from load_index. index["__all_docs__"] is the range of all doc ids and
+    index["__docnos__"] maps a doc id back to its DOCNO. Long postings lists decode their positions to a
+    PositionLists, which reads like the list of arrays.
+    '''
+    def __init__(self, path=INDEX_PATH, cache_size=POSTINGS_CACHE_SIZE):
+        self.path=path
+        with open(path, 'rb') as file:
+            self.buf=mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            stat=os.fstat(file.fileno())
+        #a rebuilt index file is a new generation, caches of query results compare it
+        self.generation=(os.path.abspath(path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        (magic, version, flags, self.num_docs, self.num_terms,
+         self.doc_offsets_at, self.doc_strings_at, self.term_offsets_at,
+         self.term_strings_at, self.term_info_at, self.postings_at)=HEADER.unpack_from(self.buf, 0)
+        if magic!=MAGIC:
+            raise ValueError("{} is not a binary index file".format(path))
+        if version!=FORMAT_VERSION:
+            raise ValueError("index format version {} is not supported (expected {}), rebuild the index".format(version, FORMAT_VERSION))
+        self.impact_ordered=bool(flags & IMPACT_ORDERED)
+        self.cache_size=cache_size
+        self.cache=OrderedDict()
+        self.docnos=None
+
+    def close(self):
+        self.buf.close()
+
+    def _string(self, offsets_at, strings_at, i):
+        start=OFFSET.unpack_from(self.buf, offsets_at+i*OFFSET.size)[0]
+        end=OFFSET.unpack_from(self.buf, offsets_at+(i+1)*OFFSET.size)[0]
+        return self.buf[strings_at+start:strings_at+end]
+
+    def docno(self, doc_id):
+        return self._string(self.doc_offsets_at, self.doc_strings_at, doc_id).decode("utf-8")
+
+    def term(self, i):
+        return self._string(self.term_offsets_at, self.term_strings_at, i).decode("utf-8")
+
+    def find(self, term):
+        '''
+        Binary search of the term dictionary, returns the term number or -1.
+        utf-8 byte order is code point order, so comparing raw bytes matches the sorted() order of the writer.
+        '''
+        target=term.encode("utf-8")
+        lo, hi=0, self.num_terms
+        while lo<hi:
+            mid=(lo+hi)//2
+            if self._string(self.term_offsets_at, self.term_strings_at, mid)<target:
+                lo=mid+1
+            else:
+                hi=mid
+        if lo<self.num_terms and self._string(self.term_offsets_at, self.term_strings_at, lo)==target:
+            return lo
+        return -1
+
+    def term_info(self, i):
+        return TERM_INFO.unpack_from(self.buf, self.term_info_at+i*TERM_INFO.size)
+
+    def doc_freq(self, term):
+        i=self.find(term)
+        return self.term_info(i)[0] if i>=0 else 0
+
+    def max_score(self, term):
+        i=self.find(term)
+        return self.term_info(i)[5] if i>=0 else 0.0
+
+    def decode_term(self, i):
+        with span("fetch_postings"):
+            doc_freq, offset, doc_len, position_len, term_idf, bound, doc_codec, position_codec=self.term_info(i)
+            buf=memoryview(self.buf)[offset:offset+doc_len+position_len]
+            doc_ids=CODECS[doc_codec].decode_doc_ids(buf[:doc_len], doc_freq)
+            positions=CODECS[position_codec].decode_positions(buf[doc_len:], doc_freq)
+            #the weights of the build, from the decoded tfs and the stored idf
+            weights=tf_weights(tfs_of(positions), term_idf)
+            entry={"doc_freq": doc_freq, "doc_ids": doc_ids, "positions": positions,
+                   "idf": term_idf, "weights": weights, "max_score": bound}
+            if self.impact_ordered:
+                entry["impact_order"]=impact_order(weights)
+        count("postings_decoded", doc_freq)
+        return entry
+
+    def get(self, term, default=None):
+        if term=="__all_docs__":
+            #ids are dense, a range stands in for the whole collection without storing it
+            return range(self.num_docs)
+        if term=="__docnos__":
+            if self.docnos is None:
+                self.docnos=[self.docno(doc_id) for doc_id in range(self.num_docs)]
+            return self.docnos
+        cache=self.cache
+        if term in cache:
+            count("postings_cache_hits")
+            cache.move_to_end(term)
+            return cache[term]
+        i=self.find(term)
+        if i<0:
+            return default
+        entry=self.decode_term(i)
+        cache[term]=entry
+        if len(cache)>self.cache_size:
+            cache.popitem(last=False)
+        return entry
+
+    def __getitem__(self, term):
+        entry=self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return term in ("__all_docs__", "__docnos__") or term in self.cache or self.find(term)>=0
+
+    def __len__(self):
+        return self.num_terms+2
+
+    def keys(self):
+        yield "__all_docs__"
+        yield "__docnos__"
+        for i in range(self.num_terms):
+            yield self.term(i)
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        for term in self.keys():
+            yield term, self[term]
+
+
+def open_index(path=INDEX_PATH, cache_size=POSTINGS_CACHE_SIZE):
+    '''
+    Opens a binary index for lazy, memory-mapped access.
+    '''
+    return MappedIndex(path, cache_size)
+
+class VersionedIndex(dict):
+    '''
+    Dict index with a generation for the query result caches. Adding, replacing or removing a term starts a new
+    generation; code that changes an entry in place calls changed() itself.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.generation=next_generation()
+
+    def changed(self):
+        self.generation=next_generation()
+
+    def __setitem__(self, term, entry):
+        super().__setitem__(term, entry)
+        self.changed()
+
+    def __delitem__(self, term):
+        super().__delitem__(term)
+        self.changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, *args):
+        entry=super().pop(*args)
+        self.changed()
+        return entry
+
+    def popitem(self):
+        item=super().popitem()
+        self.changed()
+        return item
+
+    def setdefault(self, term, default=None):
+        entry=super().setdefault(term, default)
+        self.changed()
+        return entry
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.changed()
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+def index_from_json(json_index):
+    '''
+    Converts the DOCNO keyed debug JSON export into the integer doc id structure.
+    '''
+    docnos=json_index["__all_docs__"]
+    doc_ids={docno: doc_id for doc_id, docno in enumerate(docnos)}
+    index=VersionedIndex({"__all_docs__": range(len(docnos)), "__docnos__": docnos})
+    for term, entry in json_index.items():
+        if term=="__all_docs__":
+            continue
+        postings=sorted((doc_ids[docno], positions) for docno, positions in entry["postings_list"].items())
+        positions=[array('I', positions) for _, positions in postings]
+        weights=posting_weights(positions, len(docnos))
+        index[term]={
+            "doc_freq": entry["doc_freq"],
+            "doc_ids": array('I', [doc_id for doc_id, _ in postings]),
+            "positions": positions,
+            "idf": idf(len(docnos), entry["doc_freq"]),
+            "weights": weights,
+            "max_score": max(weights)
+            }
+    return index
+
+def load_index(path=INDEX_PATH):
+    '''
+    Loads a whole index into a VersionedIndex dict with the same entries MappedIndex serves:
+    term -> {"doc_freq": df, "doc_ids": sorted array of doc ids, "positions": one array of positions per doc id,
+    "idf": log10(N/df), "weights": TF-IDF weight per doc id, "max_score": highest weight,
+    "impact_order": postings numbers by descending weight, only for impact ordered files},
+    "__all_docs__" -> range of all doc ids and "__docnos__" -> DOCNO of each doc id.
+    A .json path is read as the debug JSON export instead.
+    '''
+    start_time=datetime.datetime.now()
+    if path.endswith(".json"):
+        with open(path, 'r') as json_file:
+            index=index_from_json(json.load(json_file))
+    else:
+        mapped_index=open_index(path, cache_size=0)
+        index=VersionedIndex({"__all_docs__": mapped_index["__all_docs__"], "__docnos__": mapped_index["__docnos__"]})
+        for i in range(mapped_index.num_terms):
+            index[mapped_index.term(i)]=mapped_index.decode_term(i)
+        mapped_index.close()
+    logger.info("Index loaded from {}. Time: {}".format(path, datetime.datetime.now()-start_time))
+    return index
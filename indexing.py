@@ -7,6 +7,11 @@ import json
 from collections import OrderedDict
 import logging
 import math
+import itertools
+import multiprocessing
+from array import array
+from index_store import write_binary_index
+from metrics import span
 
 # Configure logging to display messages in the console (stdout)
 logging.basicConfig(
@@ -19,20 +24,28 @@ logger = logging.getLogger()
 
 
 
+def iter_xml(file_path):
+    '''
+    Streams an XML file one DOC at a time.
+    Each DOC element is cleared once its record is yielded so memory stays flat regardless of collection size.
+    '''
+    context = ET.iterparse(file_path, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag == "DOC":
+            yield {
+                "id":elem.find('DOCNO').text.strip(),
+                "headline":elem.find('HEADLINE').text.strip(),
+                "text":elem.find('TEXT').text.strip()}
+            elem.clear()
+            # drop the cleared DOC from the root as well, otherwise the empty shells accumulate
+            root.clear()
+
 def read_xml(file_path):
     '''
     Reads and parses an XML file.
     '''
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    doc_list=[]
-    for doc in root:
-        doc_list.append({
-            "id":doc.find('DOCNO').text.strip(),
-            "headline":doc.find('HEADLINE').text.strip(),
-            "text":doc.find('TEXT').text.strip()}
-        )
-    return doc_list
+    return list(iter_xml(file_path))
 
 
     
@@ -42,66 +55,143 @@ def print_xml(xml):
         pp.plogging.info(doc)
 
 
+STOP_WORDS_PATH="data/english_stop_list.txt"
+
+CLEAN_RE=re.compile(r"[^a-zA-Z0-9\s-]")
+SPACE_RE=re.compile(' +')
+QUERY_TOKEN_RE=re.compile(r'\"[^\"]+\"|\S+')
+
+STEM_CACHE_SIZE=50000
+
 def text_cleaner(text):
     # cleaned_text=re.sub(r"[^a-zA-Z0-9\s-]", '',text).lower().replace("\n",' ').replace("  "," ")
-    cleaned_text=re.sub(r"[^a-zA-Z0-9\s-]", '',text).lower().replace("\n",' ').replace("  "," ").replace('-',' ')
-    cleaned_text=re.sub(' +', ' ',cleaned_text)
+    cleaned_text=CLEAN_RE.sub('',text).lower().replace("\n",' ').replace("  "," ").replace('-',' ')
+    cleaned_text=SPACE_RE.sub(' ',cleaned_text)
     return cleaned_text
 
 def text_tokenizer(text):
     return text.split()
 
+
+class StemCache:
+    '''
+    Bounded LRU memo in front of a stemmer.
+    Most tokens in a news collection are repeats of a small vocabulary, so only the misses reach stemWord.
+    Hit and miss counters are kept so the bound can be sized against a collection.
+    '''
+    def __init__(self, stemmer, maxsize=STEM_CACHE_SIZE):
+        self.stemmer=stemmer
+        self.maxsize=maxsize
+        self.cache=OrderedDict()
+        self.hits=0
+        self.misses=0
+
+    def stem(self, words):
+        cache=self.cache
+        stemmed_words=[]
+        for word in words:
+            stemmed=cache.get(word)
+            if stemmed is None:
+                self.misses+=1
+                stemmed=self.stemmer.stemWord(word)
+                cache[word]=stemmed
+                if len(cache)>self.maxsize:
+                    cache.popitem(last=False)
+            else:
+                self.hits+=1
+                cache.move_to_end(word)
+            stemmed_words.append(stemmed)
+        return stemmed_words
+
+    def stats(self):
+        lookups=self.hits+self.misses
+        return {"size":len(self.cache),
+                "maxsize":self.maxsize,
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":self.hits/lookups if lookups else 0.0}
+
+    def clear(self):
+        self.cache.clear()
+        self.hits=0
+        self.misses=0
+
+
+class Analyzer:
+    '''
+    Cleaning, tokenizing, stop word removal and stemming in one reusable object.
+    The stop list is read and the stemmer built once, so documents and queries only pay for the tokenizing itself.
+    '''
+    operators=("and", "or", "not")
+
+    def __init__(self, stop_word_path=STOP_WORDS_PATH, lang='porter', stem_cache_size=STEM_CACHE_SIZE):
+        with open(stop_word_path,'r') as file:
+            self.stop_word_set=set(file.read().split())
+        self.stemmer=Stemmer.Stemmer(lang)
+        #StemCache does the memoizing, PyStemmer's own cache would only hold the same words twice
+        self.stemmer.maxCacheSize=0
+        self.stem_cache=StemCache(self.stemmer, stem_cache_size)
+
+    def clean(self, text):
+        return text_cleaner(text)
+
+    def tokenize(self, text):
+        return text_tokenizer(text)
+
+    def tokenize_query(self, query):
+        #keeps "quoted phrases" intact as a single token
+        return QUERY_TOKEN_RE.findall(query)
+
+    def remove_stopwords(self, words, keep=()):
+        stop_word_set=self.stop_word_set
+        return [word for word in words if word not in stop_word_set or word in keep]
+
+    def stem(self, words):
+        return self.stem_cache.stem(words)
+
+    def analyze(self, text):
+        with span("analyze"):
+            return self.stem(self.remove_stopwords(self.tokenize(self.clean(text))))
+
+
+_analyzers={}
+
+def get_analyzer(stop_word_path=STOP_WORDS_PATH, lang='porter'):
+    '''
+    Returns the shared Analyzer for a stop list and stemmer, creating it on first use.
+    '''
+    key=(stop_word_path, lang)
+    if key not in _analyzers:
+        _analyzers[key]=Analyzer(stop_word_path, lang)
+    return _analyzers[key]
+
+
 def stopword_remover(text,stop_word_path):
-    file=open(stop_word_path,'r')
-    stop_word_set=set(file.read().split())
-    file.close()
-    return [word for word in text if word not in stop_word_set]
+    return get_analyzer(stop_word_path).remove_stopwords(text)
 
 def text_stemmer(text,lang='porter'):
-    ps = Stemmer.Stemmer(lang)
-    return [ps.stemWord(word) for word in text]
+    return get_analyzer(lang=lang).stem(text)
 
 def preprocessor(input_file_path):
     logging.info("Starting text pre-processing")
     start_time=datetime.datetime.now()
     logging.info("Start time: {}".format(start_time))
 
-    doc_list=read_xml(input_file_path)
-
-    pp = pprint.PrettyPrinter(indent=4)
-    stop_words_path="data/english_stop_list.txt"
+    analyzer=get_analyzer()
 
+    # tokenize, case fold, clean punctuation, remove stop words and stem
+    # documents are streamed from the XML and handed on one at a time
+    for doc in iter_xml(input_file_path):
+        doc['headline']=analyzer.analyze(doc['headline'])
+        doc['text']=analyzer.analyze(doc['text'])
 
-    # tokenize, case fold, clean punctuation
-    for doc in doc_list:
-        #Cleanup and case folding
-        #remove punctuation and replace with ' '
-        
-        doc['headline']=text_cleaner(doc['headline'])
-        doc['text']=text_cleaner(doc['text'])
-   
-        #tokenize()
-        doc['headline']=text_tokenizer(doc['headline'])
-        doc['text']=text_tokenizer(doc['text'])
-        
-        #remove stop words
-        doc['headline']=stopword_remover(doc['headline'],stop_words_path)
-        doc['text']=stopword_remover(doc['text'],stop_words_path)
-
-        #stemmer
-        doc['headline']=text_stemmer(doc['headline'])
-        doc['text']=text_stemmer(doc['text'])
+        yield doc
 
     logging.info("Preprocessing completed")
+    logging.info("Stem cache: {}".format(analyzer.stem_cache.stats()))
     logging.info("Time Taken: {}".format(datetime.datetime.now()-start_time))
-    
-    return doc_list
 
-def create_inverted_index(doc_list):
-    #Creating an index:
-    logging.info("Starting Index creation")
-    start_time=datetime.datetime.now()
-    logging.info("Start time: {}".format(start_time))
+def build_index(doc_list):
     '''
     For all terms in ascensding order, index contains -
     term: document freq
@@ -114,6 +204,7 @@ def create_inverted_index(doc_list):
     #format= 
     '''
     {"string=term":(df,{doc 1:[],doc2:[]})}
+    doc ids are dense integers assigned in stream order, all_docs maps them back to DOCNOs
 
     example:
     {
@@ -132,31 +223,54 @@ def create_inverted_index(doc_list):
     }
     '''
     index={}
-    all_docs = set()
+    #DOCNOs in stream order, a doc's dense integer id is its position in this list
+    all_docs=[]
     for doc in doc_list:
-        doc_id = doc['id']
-        all_docs.add(doc_id)
+        doc_id=len(all_docs)
+        all_docs.append(doc['id'])
         pos=1
         for word in doc['headline']+doc['text']:
             if word not in index:
-                index[word]=[1,{doc['id']:[pos]}]
+                index[word]=[1,{doc_id:array('I',[pos])}]
             else: #word already in index
                 #doc id in child dict
-                if doc['id'] in index[word][1].keys():
-                    index[word][1][doc['id']].append(pos)
+                if doc_id in index[word][1].keys():
+                    index[word][1][doc_id].append(pos)
                 else:#doc id not in child dict
                     index[word][0]+=1
-                    index[word][1][doc['id']]=[pos]
+                    index[word][1][doc_id]=array('I',[pos])
             pos=pos+1
+    return index, all_docs
 
+def merge_indexes(partial_indexes):
+    '''
+    Merges partial indexes built over consecutive shards of the document stream.
+    Shards have to arrive in stream order so every postings dict keeps the same doc order as a serial build.
+    '''
+    index={}
+    all_docs=[]
+    for partial_index, partial_docs in partial_indexes:
+        #every shard numbers its docs from 0, shift them past the docs merged so far
+        base=len(all_docs)
+        all_docs.extend(partial_docs)
+        for word, (doc_freq, postings) in partial_index.items():
+            if base:
+                postings={base+doc_id: positions for doc_id, positions in postings.items()}
+            if word not in index:
+                index[word]=[doc_freq, postings]
+            else:
+                index[word][0]+=doc_freq
+                index[word][1].update(postings)
+    return index, all_docs
 
+def write_index(index, all_docs, json_output=False, impact_ordered=False):
     with open("data/test_set/result/index.txt",'w') as file:
         for k in sorted(index.keys()):
             file.write(str(k)+":"+str(index[k][0]))
             file.write("\n")
 
             for doc in index[k][1].keys():
-                file.write("        "+doc+": ")
+                file.write("        "+all_docs[doc]+": ")
                 # logging.info(",".join(index[k][1][doc]))
                 # logging.info(" ")
                 file.write(','.join(str(pos) for pos in index[k][1][doc]))
@@ -164,21 +278,73 @@ def create_inverted_index(doc_list):
                 file.write("\n")
             file.write("\n")
         logging.info("Index file written to txt")
-        
+
+    write_binary_index(index, all_docs, impact_ordered=impact_ordered)
+    logging.info("Index file written to binary")
+
+    #the JSON export is only kept as a readable debug dump
+    if json_output:
         json_index = {"__all_docs__": list(all_docs)}
 
         for term, (doc_freq, postings) in sorted(index.items()):
             json_index[term] = {
                 "doc_freq": doc_freq,
                 "postings_list": {
-                     str(doc_id): positions for doc_id, positions in postings.items()
+                     str(all_docs[doc_id]): list(positions) for doc_id, positions in postings.items()
                     }
                 }
             
         with open("data/index.json", 'w') as json_file:
             json.dump(json_index, json_file, indent=4)
         logging.info("Index file written to json")
-        
+
+def create_inverted_index(doc_list, json_output=False, impact_ordered=False):
+    #Creating an index:
+    logging.info("Starting Index creation")
+    start_time=datetime.datetime.now()
+    logging.info("Start time: {}".format(start_time))
+
+    index, all_docs=build_index(doc_list)
+    write_index(index, all_docs, json_output, impact_ordered)
+
+    logging.info("Time Taken: {}".format(datetime.datetime.now()-start_time))
+    logging.info(" ")
+    return index
+
+def chunk_docs(doc_list, chunk_size):
+    doc_iter=iter(doc_list)
+    while True:
+        chunk=list(itertools.islice(doc_iter, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def index_chunk(docs):
+    #runs in a worker process: preprocess a shard of raw documents and build its partial index
+    analyzer=get_analyzer()
+    for doc in docs:
+        doc['headline']=analyzer.analyze(doc['headline'])
+        doc['text']=analyzer.analyze(doc['text'])
+    return build_index(docs)
+
+def parallel_create_inverted_index(input_file_path, processes=None, chunk_size=500, json_output=False, impact_ordered=False):
+    '''
+    Preprocesses and indexes the collection on a process pool.
+    The XML stream is sharded into chunks of chunk_size documents, each worker returns a partial index
+    and the partials are merged in stream order into the same structure create_inverted_index builds.
+    impact_ordered flags the file so readers serve every term's postings by descending weight, for ranked
+    queries that stop early.
+    '''
+    logging.info("Starting parallel Index creation")
+    start_time=datetime.datetime.now()
+    logging.info("Start time: {}".format(start_time))
+
+    with multiprocessing.Pool(processes) as pool:
+        #imap hands partials back in submission order, so merging keeps docs in stream order
+        partial_indexes=pool.imap(index_chunk, chunk_docs(iter_xml(input_file_path), chunk_size))
+        index, all_docs=merge_indexes(partial_indexes)
+    write_index(index, all_docs, json_output, impact_ordered)
+
     logging.info("Time Taken: {}".format(datetime.datetime.now()-start_time))
     logging.info(" ")
     return index
@@ -190,7 +356,8 @@ def create_inverted_index(doc_list):
 
 if __name__ == "__main__":
 
-    processed_text=preprocessor("data/trec.5000.xml")
+    # processed_text=preprocessor("data/trec.5000.xml")
     # processed_text=preprocessor("data/trec.sample.xml")
-    index_dict=create_inverted_index(processed_text)
+    # index_dict=create_inverted_index(processed_text)
+    index_dict=parallel_create_inverted_index("data/trec.5000.xml")
     # pass
\ No newline at end of file
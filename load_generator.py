@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import itertools
+from urllib.parse import quote
+
+# Add the directory containing your module to the Python path (wants absolute paths)
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from batch_search import read_query_file
+
+'''
+Closed loop load generator for search_server.py.
+
+concurrency clients each keep one keep-alive connection and send the next query as soon as the previous
+answer is in, cycling through the queries of a query file. Reports throughput and latency percentiles as JSON.
+'''
+
+
+def percentile(sorted_values, pct):
+    '''
+    Nearest rank percentile of an ascending list.
+    '''
+    if not sorted_values:
+        return 0.0
+    rank=math.ceil(pct/100*len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values))-1]
+
+def query_path(query, endpoint=None, k=None):
+    '''
+    Request path of a query; without an endpoint #... queries go to /proximity and the others to /boolean.
+    '''
+    if endpoint is None:
+        endpoint="proximity" if query.lstrip().startswith('#') else "boolean"
+    path="/{}?q={}".format(endpoint, quote(query))
+    if k is not None:
+        path+="&k={}".format(k)
+    return path
+
+async def client(host, port, paths, deadline, latencies, errors):
+    reader, writer=await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter()<deadline:
+            path=next(paths)
+            start=time.perf_counter()
+            try:
+                writer.write("GET {} HTTP/1.1\r\nHost: {}\r\n\r\n".format(path, host).encode("latin-1"))
+                await writer.drain()
+                status_line=await reader.readline()
+                if len(status_line.split())<2:
+                    raise ConnectionError("connection closed without a response")
+                length=0
+                while True:
+                    line=await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value=line.decode("latin-1").partition(":")
+                    if name.lower()=="content-length":
+                        length=int(value)
+                await reader.readexactly(length)
+            except (ConnectionError, asyncio.IncompleteReadError) as error:
+                #a dropped connection fails this request only, the client goes on over a new one
+                errors.append("{}: {}".format(type(error).__name__, error))
+                writer.close()
+                reader, writer=await asyncio.open_connection(host, port)
+                continue
+            latencies.append(time.perf_counter()-start)
+            if status_line.split()[1]!=b"200":
+                errors.append(status_line.decode("latin-1").strip())
+    finally:
+        writer.close()
+
+async def run_load(host, port, paths, concurrency=8, duration=10.0):
+    '''
+    Sends requests for duration seconds from concurrency connections. Returns the report dict.
+    '''
+    latencies=[]
+    errors=[]
+    paths=itertools.cycle(paths)
+    start=time.perf_counter()
+    await asyncio.gather(*(client(host, port, paths, start+duration, latencies, errors) for _ in range(concurrency)))
+    elapsed=time.perf_counter()-start
+    latencies.sort()
+    return {"requests": len(latencies),
+            "errors": len(errors),
+            "concurrency": concurrency,
+            "seconds": elapsed,
+            "qps": len(latencies)/elapsed if elapsed else 0.0,
+            "latency_ms": {"p50": percentile(latencies, 50)*1000,
+                           "p90": percentile(latencies, 90)*1000,
+                           "p99": percentile(latencies, 99)*1000,
+                           "max": latencies[-1]*1000 if latencies else 0.0}}
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Load generator for search_server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--queries", default="data/test_set/queries.boolean.txt", help="query file of '<number> <query>' lines")
+    parser.add_argument("--endpoint", choices=("boolean", "phrase", "proximity", "ranked"), default=None,
+                        help="defaults to /proximity for #... queries and /boolean for the rest")
+    parser.add_argument("--k", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args=parser.parse_args()
+
+    paths=[query_path(query, args.endpoint, args.k) for query in read_query_file(args.queries)]
+    report=asyncio.run(run_load(args.host, args.port, paths, args.concurrency, args.duration))
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,157 @@
+import os
+import datetime
+import logging
+import threading
+from array import array
+
+from index_store import write_binary_index
+from segments import is_deleted, live_count
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Background merging of the segments of a SegmentedIndex.
+
+Every flush adds a segment and every query has to read all of them, so a MergeScheduler thread keeps the count
+down. It asks a TieredMergePolicy which adjacent segments to merge and rewrites their live docs into one new
+segment without holding the index lock. It then swaps the new segment in with SegmentedIndex.commit_merge.
+Queries that started before the swap finish on the snapshot they hold. Only merging adjacent segments keeps
+docs in the order they were added, so doc ids and ranking ties stay as they were.
+'''
+
+MERGE_FACTOR=10
+MERGE_FLOOR_DOCS=1000
+MERGE_DELETES_PCT=30
+MERGE_INTERVAL=5.0
+
+
+class TieredMergePolicy:
+    '''
+    Puts segments in tiers by live doc count: tier t holds segments of up to floor_docs*merge_factor**t docs.
+    merge_factor adjacent segments of one tier are merged into a segment of the next tier, so a doc gets
+    rewritten about log(N/floor_docs) times. A segment with more than deletes_pct percent of its docs deleted
+    is rewritten on its own to drop them.
+    '''
+    def __init__(self, merge_factor=MERGE_FACTOR, floor_docs=MERGE_FLOOR_DOCS, deletes_pct=MERGE_DELETES_PCT):
+        self.merge_factor=merge_factor
+        self.floor_docs=floor_docs
+        self.deletes_pct=deletes_pct
+
+    def tier(self, live_docs):
+        tier=0
+        size=self.floor_docs
+        while live_docs>size:
+            size*=self.merge_factor
+            tier+=1
+        return tier
+
+    def find_merge(self, segments):
+        '''
+        segments: [(live docs, docs)] in index order. Returns the positions of the segments to merge, or None.
+        '''
+        tiers=[self.tier(live_docs) for live_docs, _ in segments]
+        run_start=0
+        for i in range(1, len(segments)+1):
+            if i==len(segments) or tiers[i]!=tiers[run_start]:
+                if i-run_start>=self.merge_factor:
+                    return list(range(run_start, run_start+self.merge_factor))
+                run_start=i
+        for i, (live_docs, num_docs) in enumerate(segments):
+            if num_docs and (num_docs-live_docs)*100>self.deletes_pct*num_docs:
+                return [i]
+        return None
+
+def merge_segments(run, path):
+    '''
+    Writes the live docs of run ([(segment, tombstones)], adjacent segments in index order) as one segment at path.
+    Returns the doc id map of each segment: new doc id per old doc id, -1 for deleted docs.
+    '''
+    index={}
+    docnos=[]
+    doc_maps=[]
+    for segment, deleted in run:
+        doc_map=array('i', [-1])*segment.num_docs
+        for doc_id in range(segment.num_docs):
+            if not is_deleted(deleted, doc_id):
+                doc_map[doc_id]=len(docnos)
+                docnos.append(segment.docnos[doc_id])
+        doc_maps.append(doc_map)
+        for term, doc_ids, positions in segment.iter_postings():
+            for doc_id, doc_positions in zip(doc_ids, positions):
+                new_doc_id=doc_map[doc_id]
+                if new_doc_id<0:
+                    continue
+                if term not in index:
+                    index[term]=[1,{new_doc_id:doc_positions}]
+                else:
+                    index[term][0]+=1
+                    index[term][1][new_doc_id]=doc_positions
+    write_binary_index(index, docnos, path)
+    return doc_maps
+
+class MergeScheduler:
+    '''
+    Runs merges of a SegmentedIndex on a daemon thread. The thread wakes up after every flush of the index
+    and at least every interval seconds, and merges until the policy finds nothing to merge.
+    '''
+    def __init__(self, index, policy=None, interval=MERGE_INTERVAL):
+        self.index=index
+        self.policy=policy if policy is not None else TieredMergePolicy()
+        self.interval=interval
+        self.wakeup=threading.Event()
+        self.stopped=threading.Event()
+        self.thread=None
+        self.merges=0
+
+    def start(self):
+        self.index.merge_scheduler=self
+        self.thread=threading.Thread(target=self.run, name="segment-merge", daemon=True)
+        self.thread.start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.index.merge_scheduler=None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                while not self.stopped.is_set() and self.maybe_merge():
+                    pass
+            except Exception:
+                logger.exception("Segment merge failed")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def maybe_merge(self):
+        '''
+        Runs one merge if the policy finds one. Returns True if segments were merged.
+        '''
+        index=self.index
+        with index.lock:
+            segments=list(index.segments)
+            #tombstones as of now, deletes after this point are carried over by commit_merge
+            tombstones=[bytes(segment.deleted) for segment in segments]
+            positions=self.policy.find_merge([(live_count(segment.num_docs, deleted), segment.num_docs)
+                                              for segment, deleted in zip(segments, tombstones)])
+            if positions is None:
+                return False
+            name=index.reserve_segment_name()
+        run=[(segments[i], tombstones[i]) for i in positions]
+
+        start_time=datetime.datetime.now()
+        path=os.path.join(index.directory, name+".bin")
+        doc_maps=merge_segments(run, path)
+        if not index.commit_merge(run, name, doc_maps):
+            os.remove(path)
+            return False
+        self.merges+=1
+        logger.info("Merged {} into {}. Time: {}".format(", ".join(segment.name for segment, _ in run), name,
+                                                        datetime.datetime.now()-start_time))
+        return True
@@ -0,0 +1,226 @@
+import os
+import time
+import random
+import bisect
+import threading
+import contextvars
+
+'''
+Low overhead instrumentation of the indexing and search paths.
+
+    with span("score"):             times a named stage
+        ...
+    count("docs_scored", n)         adds to a named counter
+
+Instrumented stages: analyze (Analyzer.analyze), fetch_postings (decoding one postings list from a binary
+index), merge (boolean and/or of doc id lists and the candidate intersections of phrase and proximity
+queries) and score (ranking one query), inside the per query spans boolean_query, phrase_query,
+proximity_query and ranked_query. Counters: postings_decoded, docs_scored, query_cache_hits,
+query_cache_misses, postings_cache_hits and stats_lookups (doc freqs a CorpusStatistics had to fetch).
+
+Metrics are off by default and then cost one check per call. configure(sample_rate) turns them on: the
+outermost span of a call tree decides whether the whole tree is recorded, so a sampled query keeps all of its
+stages and counters together and an unsampled one records nothing. Counters outside any span are only kept
+at sample_rate 1. The SEARCH_METRICS environment variable sets the sample rate at import and
+SEARCH_METRICS_FILE adds a PrometheusExporter writing to that file.
+
+Each process has its own registry; export() hands a snapshot of it to every configured exporter.
+'''
+
+#upper bounds in seconds of the span duration histogram buckets
+SPAN_BUCKETS=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PREFIX="search"
+
+#whether the current call tree is sampled, None outside any span
+_sampled=contextvars.ContextVar("metrics_sampled", default=None)
+
+
+class Registry:
+    '''
+    Span durations (count, total, max and a SPAN_BUCKETS histogram) and counters, safe to update from threads.
+    '''
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.spans={}
+        self.counters={}
+
+    def observe(self, name, seconds):
+        with self.lock:
+            stats=self.spans.get(name)
+            if stats is None:
+                stats=self.spans[name]={"count": 0, "seconds": 0.0, "max": 0.0, "buckets": [0]*(len(SPAN_BUCKETS)+1)}
+            stats["count"]+=1
+            stats["seconds"]+=seconds
+            if seconds>stats["max"]:
+                stats["max"]=seconds
+            stats["buckets"][bisect.bisect_left(SPAN_BUCKETS, seconds)]+=1
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counters[name]=self.counters.get(name, 0)+amount
+
+    def snapshot(self):
+        '''
+        Copy of the current values: {"spans": {name: {"count", "seconds", "max", "buckets"}}, "counters": {name: value}}.
+        buckets[i] counts the spans of at most SPAN_BUCKETS[i] seconds (and more than the bound before), the last
+        one the spans above every bound.
+        '''
+        with self.lock:
+            return {"spans": {name: dict(stats, buckets=list(stats["buckets"])) for name, stats in self.spans.items()},
+                    "counters": dict(self.counters)}
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+
+REGISTRY=Registry()
+SAMPLE_RATE=0.0
+EXPORTERS=[]
+
+
+class Span:
+    __slots__=("name", "sampled", "start", "token")
+
+    def __init__(self, name):
+        self.name=name
+
+    def __enter__(self):
+        sampled=_sampled.get()
+        self.token=None
+        if sampled is None:
+            #outermost span, decides for everything below it
+            sampled=SAMPLE_RATE>=1 or random.random()<SAMPLE_RATE
+            self.token=_sampled.set(sampled)
+        self.sampled=sampled
+        if sampled:
+            self.start=time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.sampled:
+            REGISTRY.observe(self.name, time.perf_counter()-self.start)
+        if self.token is not None:
+            _sampled.reset(self.token)
+        return False
+
+class NullSpan:
+    __slots__=()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN=NullSpan()
+
+def span(name):
+    '''
+    Context manager timing the named stage, a shared no-op while metrics are off.
+    '''
+    if not SAMPLE_RATE:
+        return NULL_SPAN
+    return Span(name)
+
+def count(name, amount=1):
+    if not SAMPLE_RATE:
+        return
+    sampled=_sampled.get()
+    if sampled or (sampled is None and SAMPLE_RATE>=1):
+        REGISTRY.add(name, amount)
+
+def enabled():
+    return SAMPLE_RATE>0
+
+def configure(sample_rate=1.0, exporters=None):
+    '''
+    Sets the share of call trees that get recorded (0 turns metrics off, 1 records everything) and,
+    when given, replaces the exporters.
+    '''
+    global SAMPLE_RATE
+    if not 0<=sample_rate<=1:
+        raise ValueError("sample_rate has to be between 0 and 1: {}".format(sample_rate))
+    SAMPLE_RATE=sample_rate
+    if exporters is not None:
+        EXPORTERS[:]=exporters
+
+def export():
+    '''
+    Hands a snapshot of the registry to every exporter and returns it.
+    '''
+    snapshot=REGISTRY.snapshot()
+    for exporter in EXPORTERS:
+        exporter.export(snapshot)
+    return snapshot
+
+def summary(snapshot=None):
+    '''
+    One readable line per span and counter, for logging.
+    '''
+    if snapshot is None:
+        snapshot=REGISTRY.snapshot()
+    lines=[]
+    for name, stats in sorted(snapshot["spans"].items()):
+        lines.append("{}: {} calls, {:.6f}s total, {:.6f}s mean, {:.6f}s max".format(
+            name, stats["count"], stats["seconds"], stats["seconds"]/stats["count"], stats["max"]))
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append("{}: {}".format(name, value))
+    return lines
+
+
+class InMemoryExporter:
+    '''
+    Keeps every exported snapshot, the latest in .last.
+    '''
+    def __init__(self):
+        self.snapshots=[]
+
+    def export(self, snapshot):
+        self.snapshots.append(snapshot)
+
+    @property
+    def last(self):
+        return self.snapshots[-1] if self.snapshots else None
+
+class PrometheusExporter:
+    '''
+    Writes snapshots in the Prometheus text exposition format to a file, e.g. for the node exporter's
+    textfile collector. Spans become a <prefix>_span_seconds histogram labelled by span, counters
+    <prefix>_<name>_total. The file is replaced atomically, so a scrape never sees half of it.
+    '''
+    def __init__(self, path, prefix=METRICS_PREFIX):
+        self.path=path
+        self.prefix=prefix
+
+    def render(self, snapshot):
+        prefix=self.prefix
+        lines=["# HELP {}_metrics_sample_rate Share of call trees recorded.".format(prefix),
+               "# TYPE {}_metrics_sample_rate gauge".format(prefix),
+               "{}_metrics_sample_rate {}".format(prefix, SAMPLE_RATE)]
+        if snapshot["spans"]:
+            lines.append("# HELP {}_span_seconds Time spent in instrumented stages.".format(prefix))
+            lines.append("# TYPE {}_span_seconds histogram".format(prefix))
+        for name, stats in sorted(snapshot["spans"].items()):
+            cumulative=0
+            for bound, bucket in zip(SPAN_BUCKETS+("+Inf",), stats["buckets"]):
+                cumulative+=bucket
+                lines.append('{}_span_seconds_bucket{{span="{}",le="{}"}} {}'.format(prefix, name, bound, cumulative))
+            lines.append('{}_span_seconds_sum{{span="{}"}} {}'.format(prefix, name, stats["seconds"]))
+            lines.append('{}_span_seconds_count{{span="{}"}} {}'.format(prefix, name, stats["count"]))
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+            lines.append("{}_{}_total {}".format(prefix, name, value))
+        return "\n".join(lines)+"\n"
+
+    def export(self, snapshot):
+        temp_path=self.path+".tmp"
+        with open(temp_path, 'w') as file:
+            file.write(self.render(snapshot))
+        os.replace(temp_path, self.path)
+
+
+if os.environ.get("SEARCH_METRICS"):
+    configure(float(os.environ["SEARCH_METRICS"]))
+if os.environ.get("SEARCH_METRICS_FILE"):
+    EXPORTERS.append(PrometheusExporter(os.environ["SEARCH_METRICS_FILE"]))
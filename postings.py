@@ -0,0 +1,246 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import heapq
+
+from metrics import span
+
+'''
+Operations on postings stored as sorted array('I') of integer doc ids.
+Boolean operators become merges over the sorted lists instead of python set algebra: intersection and
+difference gallop through the longer list, union is a linear merge and NOT is kept as a lazy Complement.
+'''
+
+
+def gallop(doc_ids, target, lo=0):
+    '''
+    First position at or after lo whose doc id is >= target.
+    Probes lo+1, lo+2, lo+4, ... until it overshoots, then bisects inside the last step, so skipping
+    k entries costs O(log k) instead of k comparisons.
+    '''
+    size=len(doc_ids)
+    step=1
+    hi=lo
+    while hi<size and doc_ids[hi]<target:
+        lo=hi+1
+        hi=lo+step
+        step*=2
+    return bisect_left(doc_ids, target, lo, min(hi, size))
+
+def intersect(left, right):
+    #walk the shorter list and gallop through the longer one, so the cost follows the rare term
+    if len(left)>len(right):
+        left, right=right, left
+    result=array('I')
+    j=0
+    len_right=len(right)
+    for doc_id in left:
+        j=gallop(right, doc_id, j)
+        if j==len_right:
+            break
+        if right[j]==doc_id:
+            result.append(doc_id)
+            j+=1
+    return result
+
+def union(left, right):
+    if not left:
+        return array('I', right)
+    if not right:
+        return array('I', left)
+    result=array('I')
+    i, j=0, 0
+    len_left, len_right=len(left), len(right)
+    while i<len_left and j<len_right:
+        a, b=left[i], right[j]
+        if a==b:
+            result.append(a)
+            i+=1
+            j+=1
+        elif a<b:
+            result.append(a)
+            i+=1
+        else:
+            result.append(b)
+            j+=1
+    result.extend(left[i:])
+    result.extend(right[j:])
+    return result
+
+def difference(left, right):
+    '''
+    Doc ids in left that are not in right.
+    '''
+    result=array('I')
+    j=0
+    len_right=len(right)
+    for doc_id in left:
+        if j<len_right:
+            j=gallop(right, doc_id, j)
+        if j==len_right or right[j]!=doc_id:
+            result.append(doc_id)
+    return result
+
+
+class Complement:
+    '''
+    Lazy NOT: every doc in the collection except doc_ids.
+    It stays symbolic through AND/OR, where it turns into a difference or an intersection,
+    so the collection is only walked when the final result of a query is itself a complement.
+    '''
+    __slots__=("doc_ids",)
+
+    def __init__(self, doc_ids):
+        self.doc_ids=doc_ids
+
+def iter_complement(all_docs, doc_ids):
+    '''
+    Yields the doc ids of all_docs that are not in doc_ids, both sorted.
+    '''
+    j=0
+    len_doc_ids=len(doc_ids)
+    for doc_id in all_docs:
+        while j<len_doc_ids and doc_ids[j]<doc_id:
+            j+=1
+        if j<len_doc_ids and doc_ids[j]==doc_id:
+            continue
+        yield doc_id
+
+def boolean_not(operand):
+    if isinstance(operand, Complement):
+        return operand.doc_ids
+    return Complement(operand)
+
+def boolean_and(left, right):
+    left_not, right_not=isinstance(left, Complement), isinstance(right, Complement)
+    with span("merge"):
+        if left_not and right_not:
+            # not a and not b = not (a or b)
+            return Complement(union(left.doc_ids, right.doc_ids))
+        if left_not:
+            return difference(right, left.doc_ids)
+        if right_not:
+            return difference(left, right.doc_ids)
+        return intersect(left, right)
+
+def boolean_or(left, right):
+    left_not, right_not=isinstance(left, Complement), isinstance(right, Complement)
+    with span("merge"):
+        if left_not and right_not:
+            # not a or not b = not (a and b)
+            return Complement(intersect(left.doc_ids, right.doc_ids))
+        if left_not:
+            # not a or b = not (a and not b)
+            return Complement(difference(left.doc_ids, right))
+        if right_not:
+            return Complement(difference(right.doc_ids, left))
+        return union(left, right)
+
+def resolve(operand, all_docs):
+    '''
+    Turns an operator result into a sorted doc id array, walking all_docs only for a complement.
+    '''
+    if isinstance(operand, Complement):
+        return array('I', iter_complement(all_docs, operand.doc_ids))
+    return operand
+
+def phrase_positions(position_lists, offsets):
+    '''
+    Positions p of the first phrase term such that p+offsets[i]-offsets[0] is in position_lists[i] for every term i.
+    One cursor per sorted position list only ever moves forward, so a doc costs about the length of
+    its position lists rather than their product.
+    '''
+    matches=array('I')
+    num_terms=len(position_lists)
+    if not num_terms or not all(position_lists):
+        return matches
+    offsets=[offset-offsets[0] for offset in offsets]
+    cursors=[0]*num_terms
+    candidate=position_lists[0][0]-offsets[0]
+    while True:
+        matched=True
+        for i in range(num_terms):
+            positions=position_lists[i]
+            j=gallop(positions, candidate+offsets[i], cursors[i])
+            if j==len(positions):
+                return matches
+            cursors[i]=j
+            start=positions[j]-offsets[i]
+            if start>candidate:
+                #this term cannot line up at candidate, retry all terms from its next possible start
+                candidate=start
+                matched=False
+                break
+        if matched:
+            matches.append(candidate)
+            candidate+=1
+
+def unordered_window(position_lists, width):
+    '''
+    True if some choice of one position per list spans at most width (max - min <= width), in any order.
+    A min-heap holds one cursor per list: the smallest position is the only one that can be advanced
+    to shrink the window, so every position is visited once.
+    '''
+    if not position_lists or not all(position_lists):
+        return False
+    heap=[(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    current_max=max(position for position, _, _ in heap)
+    while True:
+        position, i, j=heap[0]
+        if current_max-position<=width:
+            return True
+        j+=1
+        if j==len(position_lists[i]):
+            return False
+        next_position=position_lists[i][j]
+        heapq.heapreplace(heap, (next_position, i, j))
+        if next_position>current_max:
+            current_max=next_position
+
+def ordered_window(position_lists, width):
+    '''
+    True if there are positions p1 < p2 < ... < pk, one from each list in order, with pk - p1 <= width.
+    For each start p1 the earliest following position of every later term is the best choice, and those
+    cursors only move forward as p1 grows.
+    '''
+    if not position_lists or not all(position_lists):
+        return False
+    num_terms=len(position_lists)
+    cursors=[0]*num_terms
+    for first in position_lists[0]:
+        previous=first
+        for i in range(1, num_terms):
+            positions=position_lists[i]
+            j=bisect_right(positions, previous, cursors[i])
+            if j==len(positions):
+                #no later occurrence for this term, later starts cannot do better
+                return False
+            cursors[i]=j
+            previous=positions[j]
+            if previous-first>width:
+                break
+        else:
+            return True
+    return False
+
+def find_doc(doc_ids, doc_id):
+    '''
+    Position of doc_id in a sorted doc id array, or -1 when the term does not occur in that doc.
+    '''
+    i=bisect_left(doc_ids, doc_id)
+    if i<len(doc_ids) and doc_ids[i]==doc_id:
+        return i
+    return -1
+
+def doc_positions(entry, doc_id):
+    '''
+    Positions of a term in a doc, from an index entry {"doc_ids": ..., "positions": ...}. None if it does not occur.
+    '''
+    i=find_doc(entry["doc_ids"], doc_id)
+    if i<0:
+        return None
+    return entry["positions"][i]
+
+def to_docnos(doc_ids, index):
+    docnos=index["__docnos__"]
+    return [docnos[doc_id] for doc_id in doc_ids]
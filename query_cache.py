@@ -0,0 +1,132 @@
+import os
+import sys
+import itertools
+from array import array
+from collections import OrderedDict
+
+from postings import Complement
+from metrics import count
+
+'''
+Result cache for repeated queries.
+
+Keys are built from the analyzed query (after stop word removal and stemming), so queries that only differ in
+case, punctuation or stop words share an entry:
+    ("boolean", terms)                whole boolean query
+    ("proximity", width, terms, ordered)
+    ("ranked", terms, k)
+    ("plan", plan_key(plan))          a boolean subexpression, e.g. the operand of a NOT
+Every entry belongs to the index generation it was computed on. A lookup against an index of another
+generation (a rebuilt, reopened or changed index) drops the whole cache first.
+'''
+
+QUERY_CACHE_BYTES=64*1024*1024
+
+GENERATIONS=itertools.count(1)
+
+
+def next_generation():
+    '''
+    A generation no other index of any process has had. Indexes take a new one on every change,
+    an id() would come back for a new index allocated where a collected one was.
+    '''
+    return (os.getpid(), next(GENERATIONS))
+
+def index_generation(index):
+    '''
+    Generation of the index contents. Every index exposes a generation attribute: MappedIndex the identity of
+    its file, SegmentedIndex and VersionedIndex (what load_index returns) a next_generation() taken on every change.
+    '''
+    generation=getattr(index, "generation", None)
+    if generation is None:
+        raise TypeError("{} has no generation, wrap a dict index in index_store.VersionedIndex".format(type(index).__name__))
+    return generation
+
+def size_of(value):
+    '''
+    Approximate memory held by a cached result.
+    '''
+    if isinstance(value, array):
+        return sys.getsizeof(value)
+    if isinstance(value, Complement):
+        return sys.getsizeof(value)+size_of(value.doc_ids)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value)+sum(size_of(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value)+sum(size_of(key)+size_of(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+class QueryCache:
+    '''
+    LRU of query results bounded by their approximate size in bytes.
+    Hit, miss, eviction and invalidation counters are kept so the bound can be sized against the traffic.
+    '''
+    def __init__(self, max_bytes=QUERY_CACHE_BYTES):
+        self.max_bytes=max_bytes
+        self.cache=OrderedDict()
+        self.bytes=0
+        self.generation=None
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.invalidations=0
+
+    def validate(self, index):
+        generation=index_generation(index)
+        if generation!=self.generation:
+            if self.cache:
+                self.invalidations+=1
+            self.cache.clear()
+            self.bytes=0
+            self.generation=generation
+
+    def get(self, key, index):
+        '''
+        Cached result for key on this index, None on a miss.
+        '''
+        self.validate(index)
+        cache=self.cache
+        if key not in cache:
+            self.misses+=1
+            count("query_cache_misses")
+            return None
+        self.hits+=1
+        count("query_cache_hits")
+        cache.move_to_end(key)
+        return cache[key][0]
+
+    def put(self, key, value, index):
+        self.validate(index)
+        size=size_of(key)+size_of(value)
+        if size>self.max_bytes:
+            #would evict everything else and still not fit
+            return value
+        cache=self.cache
+        if key in cache:
+            self.bytes-=cache.pop(key)[1]
+        cache[key]=(value, size)
+        self.bytes+=size
+        while self.bytes>self.max_bytes:
+            _, (_, evicted_size)=cache.popitem(last=False)
+            self.bytes-=evicted_size
+            self.evictions+=1
+        return value
+
+    def stats(self):
+        lookups=self.hits+self.misses
+        return {"size":len(self.cache),
+                "bytes":self.bytes,
+                "max_bytes":self.max_bytes,
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":self.hits/lookups if lookups else 0.0,
+                "evictions":self.evictions,
+                "invalidations":self.invalidations}
+
+    def clear(self):
+        self.cache.clear()
+        self.bytes=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.invalidations=0
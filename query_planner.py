@@ -0,0 +1,193 @@
+from array import array
+
+from indexing import get_analyzer
+from postings import boolean_and, boolean_or, boolean_not
+
+'''
+Cost based planning of boolean queries.
+
+The analyzed query terms are parsed into an AST of dict nodes
+    {"op": "term", "term": t}, {"op": "phrase", "phrase": p}, {"op": "not", "child": n},
+    {"op": "and", "children": [...]}, {"op": "or", "children": [...]}
+with the precedence the shunting-yard evaluator used (not > and > or, left to right).
+
+The planner flattens nested and/or chains, estimates every node's result size from the doc_freq in the index,
+orders and/or children from the smallest estimate up and rewrites "a and not b" into
+    {"op": "diff", "base": a, "minus": [b]}
+so NOT operands are subtracted from the positive result instead of being complemented.
+Execution stops an AND or DIFF as soon as its running result is empty.
+Given a QueryCache, execution reuses the results of subexpressions seen in earlier queries.
+'''
+
+OPERATOR_PRECEDENCE={"or":1,"and":2,"not":3}
+
+
+def parse_query(query_terms):
+    '''
+    Parses analyzed, lower cased query tokens into an AST.
+    Operands next to each other without an operator are combined with AND.
+    '''
+    pos=0
+
+    def parse_or():
+        nonlocal pos
+        children=[parse_and()]
+        while pos<len(query_terms) and query_terms[pos]=="or":
+            pos+=1
+            children.append(parse_and())
+        return children[0] if len(children)==1 else {"op":"or", "children":children}
+
+    def parse_and():
+        nonlocal pos
+        children=[parse_not()]
+        while pos<len(query_terms) and query_terms[pos]!="or":
+            if query_terms[pos]=="and":
+                pos+=1
+            children.append(parse_not())
+        return children[0] if len(children)==1 else {"op":"and", "children":children}
+
+    def parse_not():
+        nonlocal pos
+        if pos>=len(query_terms):
+            raise ValueError("boolean query ends with an operator: {}".format(" ".join(query_terms)))
+        term=query_terms[pos]
+        pos+=1
+        if term=="not":
+            return {"op":"not", "child":parse_not()}
+        if term in OPERATOR_PRECEDENCE:
+            raise ValueError("operator {} without a left operand: {}".format(term, " ".join(query_terms)))
+        if term[0]=='"' and term[-1]=='"':
+            return {"op":"phrase", "phrase":term.strip('"')}
+        return {"op":"term", "term":term}
+
+    return parse_or()
+
+def term_doc_freq(index, term):
+    if hasattr(index, "doc_freq"):
+        #MappedIndex answers from the dictionary without decoding postings
+        return index.doc_freq(term)
+    return index[term]["doc_freq"] if term in index else 0
+
+def plan_query(node, index):
+    '''
+    Returns the execution plan for an AST: the same node dicts with an estimated result size ("cost")
+    on each, commutative children sorted by it and AND NOT rewritten to DIFF.
+    '''
+    num_docs=len(index["__all_docs__"])
+    op=node["op"]
+
+    if op=="term":
+        return dict(node, cost=term_doc_freq(index, node["term"]))
+    if op=="phrase":
+        #a phrase cannot match more docs than its rarest word
+        words=get_analyzer().analyze(node["phrase"])
+        cost=min((term_doc_freq(index, word) for word in words), default=0)
+        return dict(node, cost=cost)
+    if op=="not":
+        child=plan_query(node["child"], index)
+        if child["op"]=="not":
+            return child["child"]
+        return {"op":"not", "child":child, "cost":num_docs-child["cost"]}
+
+    #flatten a and (b and c) into one and with three children
+    children=[]
+    for child in node["children"]:
+        child=plan_query(child, index)
+        if child["op"]==op:
+            children.extend(child["children"])
+        else:
+            children.append(child)
+    children.sort(key=lambda child: child["cost"])
+
+    if op=="or":
+        return {"op":"or", "children":children, "cost":min(num_docs, sum(child["cost"] for child in children))}
+
+    positives=[child for child in children if child["op"]!="not"]
+    negatives=[child["child"] for child in children if child["op"]=="not"]
+    if not positives or not negatives:
+        return {"op":"and", "children":children, "cost":children[0]["cost"]}
+    base=positives[0] if len(positives)==1 else {"op":"and", "children":positives, "cost":positives[0]["cost"]}
+    return {"op":"diff", "base":base, "minus":negatives, "cost":base["cost"]}
+
+def is_empty(result):
+    return isinstance(result, array) and len(result)==0
+
+def plan_key(plan):
+    '''
+    Canonical form of a plan without its costs, the same for any order of commutative children.
+    '''
+    op=plan["op"]
+    if op=="term":
+        return ("term", plan["term"])
+    if op=="phrase":
+        return ("phrase", plan["phrase"])
+    if op=="not":
+        return ("not", plan_key(plan["child"]))
+    if op=="diff":
+        return ("diff", plan_key(plan["base"]), tuple(sorted(plan_key(child) for child in plan["minus"])))
+    return (op, tuple(sorted(plan_key(child) for child in plan["children"])))
+
+def execute_plan(plan, index, phrase_doc_ids, cache=None):
+    '''
+    Evaluates a plan to a sorted doc id array, or a lazy Complement when the whole plan is a NOT.
+    phrase_doc_ids(phrase, index) evaluates phrase operands.
+    With a QueryCache every phrase and and/or/diff subexpression is looked up by its plan_key first, so an
+    operand shared between queries, like a common NOT operand, is only evaluated once.
+    '''
+    if cache is None or plan["op"] in ("term", "not"):
+        #terms are index lookups already, a NOT only wraps its (cached) child
+        return evaluate_plan(plan, index, phrase_doc_ids, cache)
+    key=("plan", plan_key(plan))
+    result=cache.get(key, index)
+    if result is None:
+        result=cache.put(key, evaluate_plan(plan, index, phrase_doc_ids, cache), index)
+    return result
+
+def evaluate_plan(plan, index, phrase_doc_ids, cache=None):
+    op=plan["op"]
+    if op=="term":
+        term=plan["term"]
+        if plan["cost"]==0:
+            return array('I')
+        return index[term]["doc_ids"]
+    if op=="phrase":
+        if plan["cost"]==0:
+            return array('I')
+        return phrase_doc_ids(plan["phrase"], index)
+    if op=="not":
+        return boolean_not(execute_plan(plan["child"], index, phrase_doc_ids, cache))
+    if op=="diff":
+        result=execute_plan(plan["base"], index, phrase_doc_ids, cache)
+        for child in plan["minus"]:
+            if is_empty(result):
+                break
+            #and with a complement is a difference for a doc id array
+            result=boolean_and(result, boolean_not(execute_plan(child, index, phrase_doc_ids, cache)))
+        return result
+    if op=="and":
+        result=execute_plan(plan["children"][0], index, phrase_doc_ids, cache)
+        for child in plan["children"][1:]:
+            #children are in ascending cost, an empty running result ends the AND
+            if is_empty(result):
+                break
+            result=boolean_and(result, execute_plan(child, index, phrase_doc_ids, cache))
+        return result
+    result=array('I')
+    for child in plan["children"]:
+        result=boolean_or(result, execute_plan(child, index, phrase_doc_ids, cache))
+    return result
+
+def describe_plan(plan):
+    '''
+    One line rendering of a plan for the query log, e.g. DIFF(AND(glasgow[12], scotland[40]) - market[300]).
+    '''
+    op=plan["op"]
+    if op=="term":
+        return "{}[{}]".format(plan["term"], plan["cost"])
+    if op=="phrase":
+        return '"{}"[{}]'.format(plan["phrase"], plan["cost"])
+    if op=="not":
+        return "NOT({})".format(describe_plan(plan["child"]))
+    if op=="diff":
+        return "DIFF({} - {})".format(describe_plan(plan["base"]), ", ".join(describe_plan(child) for child in plan["minus"]))
+    return "{}({})".format(op.upper(), ", ".join(describe_plan(child) for child in plan["children"]))
@@ -1,15 +1,21 @@
 import os
 import sys
-import datetime
 import logging
 from collections import OrderedDict
 import math
+import heapq
+import itertools
 
 # Add the directory containing your module to the Python path (wants absolute paths)
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
 from indexing import *
 from search import *
+from index_store import open_index
+from postings import gallop, find_doc
+from scoring import SCORE_EPSILON, RESULTS_PER_QUERY, RESULT_DIGITS, check_k
+from metrics import span, count, enabled as metrics_enabled, export as export_metrics, summary as metrics_summary
+from vectorized_scoring import np, TermDocMatrix, vectorized_ranked_retrieval
 import pprint
 
 logging.basicConfig(
@@ -21,85 +27,205 @@ logging.basicConfig(
 logger = logging.getLogger()
 
 
-def ranked_retrieval(query_list,index):
-    start_time= datetime.datetime.now()
-    logger.info("Starting Ranked Retrieval at {}".format(start_time))
-    
+def score_top_k(query_terms, index, k=RESULTS_PER_QUERY):
+    '''
+    Document-at-a-time TF-IDF scoring of analyzed query terms with MaxScore pruning.
+    Terms are ordered by their max score bound. Once the size-k min-heap of (score, -doc) is full, the
+    cheapest terms whose bounds together cannot beat its lowest score become non-essential: docs are only
+    taken from the essential terms' lists, and non-essential lists are galloped to a doc only while the
+    doc can still make the top k. Returns [(score, doc id)] best first, ties by ascending doc id, the same
+    result as scoring every doc. k=None keeps every matching doc.
+    '''
     #tfidf
     '''
     tf=term freq -> no of times term appeard in doc
-    for any doc; tf=index.term.postings_list.doc_id.size of list()
     idf= N/doc freq
-    N=no of docs=index.term.postings_list.size()
-    doc_freq= index.term.doc_freq
-    score=1+log(tf)+log(N/df)
+    N=no of docs
+    weight=(1+log(tf))*log(N/df), computed from the tfs and the stored idf when a term is decoded
+    score=sum of the weights of the query terms
+    '''
+    check_k(k)
+    #one list per distinct term, a term repeated in the query adds its weight once per occurrence
+    terms=[]
+    for term in query_terms:
+        if term not in terms:
+            terms.append(term)
+    term_order=[terms.index(term) for term in query_terms]
+    lists=[]
+    for t, term in enumerate(terms):
+        entry=index[term] if term in index else None
+        if entry is None or entry["doc_freq"]==0:
+            continue
+        occurrences=query_terms.count(term)
+        lists.append({"term":t, "count":occurrences, "entry":entry, "bound":entry["max_score"]*occurrences, "cursor":0})
+    lists.sort(key=lambda posting_list: posting_list["bound"])
+    #upper[i]: best score a doc can get from lists[0..i]
+    upper=list(itertools.accumulate(posting_list["bound"] for posting_list in lists))
+
+    top_k=[]
+    threshold=-math.inf
+    non_essential=0
+    scored=0
+    wtds=[0]*len(terms)
+    while non_essential<len(lists):
+        #next doc of the essential lists
+        doc=None
+        for posting_list in lists[non_essential:]:
+            doc_ids=posting_list["entry"]["doc_ids"]
+            if posting_list["cursor"]<len(doc_ids) and (doc is None or doc_ids[posting_list["cursor"]]<doc):
+                doc=doc_ids[posting_list["cursor"]]
+        if doc is None:
+            break
+
+        bound=upper[non_essential-1] if non_essential else 0
+        for posting_list in lists[non_essential:]:
+            entry=posting_list["entry"]
+            cursor=posting_list["cursor"]
+            if cursor<len(entry["doc_ids"]) and entry["doc_ids"][cursor]==doc:
+                wtd=entry["weights"][cursor]
+                wtds[posting_list["term"]]=wtd
+                bound+=wtd*posting_list["count"]
+                posting_list["cursor"]=cursor+1
+        #a doc coming later than every doc in the heap has to beat the lowest score strictly
+        competitive=True
+        for i in range(non_essential-1, -1, -1):
+            if bound+SCORE_EPSILON<=threshold:
+                competitive=False
+                break
+            posting_list=lists[i]
+            entry=posting_list["entry"]
+            bound-=posting_list["bound"]
+            cursor=gallop(entry["doc_ids"], doc, posting_list["cursor"])
+            posting_list["cursor"]=cursor
+            if cursor<len(entry["doc_ids"]) and entry["doc_ids"][cursor]==doc:
+                wtd=entry["weights"][cursor]
+                wtds[posting_list["term"]]=wtd
+                bound+=wtd*posting_list["count"]
+
+        if competitive:
+            scored+=1
+            #add up in query order, so scores come out exactly as a term by term loop would give them
+            w=0
+            for t in term_order:
+                w=w+wtds[t] #doc level weight
+            candidate=(w, -doc)
+            if k is None or len(top_k)<k:
+                heapq.heappush(top_k, candidate)
+            elif candidate>top_k[0]:
+                heapq.heapreplace(top_k, candidate)
+            if k is not None and len(top_k)==k and top_k[0][0]>threshold:
+                threshold=top_k[0][0]
+                while non_essential<len(lists) and upper[non_essential]+SCORE_EPSILON<=threshold:
+                    non_essential+=1
+        for t in range(len(terms)):
+            wtds[t]=0
+    count("docs_scored", scored)
+    return [(score, -neg_doc) for score, neg_doc in sorted(top_k, reverse=True)]
+
+def score_top_k_impact(query_terms, index, k=RESULTS_PER_QUERY):
     '''
-    res={}
-    q_num=1
-    for query in query_list:
-
-        query=text_cleaner(query)
-        query_terms=text_tokenizer(query)
-        
-        #remove stop words
-        stop_words_path="data/english_stop_list.txt"
-        with open(stop_words_path,'r') as file:
-            stop_word_set=set(file.read().split())
-        query_terms=[word for word in query_terms if word not in stop_word_set]
-        
-        #stemmer
-        
-        query_terms=text_stemmer(query_terms)
-        #concatenate AND between all query terms and do boolean search
-        query_terms_bool=" or ".join(query_terms)
-
-
-        print(query_terms_bool)
-        
-        bool_search_res=boolean_search([query_terms_bool],index)
-        # print(bool_search_res[query_terms_bool]["documents"])
-
-        #for all docs in bool search result,see pos diff for each term if more than 1; break;
-        all_docs=bool_search_res[query_terms_bool]["documents"]
-        '''
-        tf=term freq -> no of times term appeard in doc
-        for term in query; tf=index.term.postings_list.doc_id.size of list()
-        idf= N/doc freq
-        N=no of docs=index.term.postings_list.size()
-        doc_freq= index.term.doc_freq
-        score=1+log(tf)+log(N/df)
-        '''
-        #calculate weight
-        for doc in all_docs:
-            N=len(index["__all_docs__"])
+    Threshold algorithm over impact ordered postings (an index written with impact_ordered=True).
+    Every round reads the next best posting of each term and scores the docs it has not seen yet with a
+    lookup in the other terms' doc id lists. The weights at the current depth bound every unseen doc, so
+    the scan stops as soon as that bound falls below the lowest score of a full top k.
+    Returns the same [(score, doc id)] as score_top_k.
+    '''
+    check_k(k)
+    if k is None:
+        #nothing can be cut from an unbounded result
+        return score_top_k(query_terms, index, k)
+    terms=[]
+    for term in query_terms:
+        if term not in terms:
+            terms.append(term)
+    term_order=[terms.index(term) for term in query_terms]
+    lists=[]
+    for t, term in enumerate(terms):
+        entry=index[term] if term in index else None
+        if entry is None or entry["doc_freq"]==0:
+            continue
+        if "impact_order" not in entry:
+            raise ValueError("the index has no impact ordered postings, build it with impact_ordered=True")
+        lists.append({"term":t, "count":query_terms.count(term), "entry":entry})
+
+    top_k=[]
+    seen=set()
+    wtds=[0]*len(terms)
+    depth=0
+    while True:
+        exhausted=True
+        for posting_list in lists:
+            entry=posting_list["entry"]
+            if depth>=entry["doc_freq"]:
+                continue
+            exhausted=False
+            doc=entry["doc_ids"][entry["impact_order"][depth]]
+            if doc in seen:
+                continue
+            seen.add(doc)
+            for other in lists:
+                i=find_doc(other["entry"]["doc_ids"], doc)
+                wtds[other["term"]]=other["entry"]["weights"][i] if i>=0 else 0
+            #add up in query order, so scores come out exactly as a term by term loop would give them
             w=0
-            for term in query_terms:
-                wtd=0
-                if doc in index[term]["postings_list"]:
-                    tf=len(index[term]["postings_list"][doc])
-                    df=index[term]["doc_freq"]
-                else:
-                    tf=0
-                    df=0
-                if tf==0 or df==0:
-                    wtd=0
-                else:
-                    wtd=(1+math.log10(tf))*(math.log10(N/df))
-                # idf= N/df if df!=0 else 0
-                # print("tf of {} in {} is {}".format(term,doc,tf))
-                # print("N/df of {} in {} is {}".format(term,doc,idf))
-                w=w+wtd #doc level weight
-            if " ".join(query_terms) not in res:
-                res[" ".join(query_terms)]=[]
-
-            res[" ".join(query_terms)].append({
-                "term":" ".join(query_terms),
-                "doc":doc,
-                "qnum":q_num,
-                "score":w
-                })
-        q_num=q_num+1
-    logger.info("Ranked Retrieval done. Time: {}".format(datetime.datetime.now()-start_time))
+            for t in term_order:
+                w=w+wtds[t] #doc level weight
+            candidate=(w, -doc)
+            if len(top_k)<k:
+                heapq.heappush(top_k, candidate)
+            elif candidate>top_k[0]:
+                heapq.heapreplace(top_k, candidate)
+        if exhausted:
+            break
+        depth+=1
+        #best score a doc none of the lists has reached yet can still get
+        bound=0
+        for posting_list in lists:
+            entry=posting_list["entry"]
+            if depth<entry["doc_freq"]:
+                bound+=entry["weights"][entry["impact_order"][depth]]*posting_list["count"]
+        #an unseen doc with an equal score may still win the tie on doc id, so the bound has to be strictly lower
+        if len(top_k)==k and bound+SCORE_EPSILON<top_k[0][0]:
+            break
+    count("docs_scored", len(seen))
+    return [(score, -neg_doc) for score, neg_doc in sorted(top_k, reverse=True)]
+
+def rank_query(query_terms, index, k=RESULTS_PER_QUERY, scorer=score_top_k, cache=None):
+    '''
+    Top k [(score, doc id)] of analyzed query terms, looked up in a QueryCache first when one is given.
+    '''
+    check_k(k)
+    with span("ranked_query"):
+        if cache is not None:
+            key=("ranked", tuple(query_terms), k)
+            ranked=cache.get(key, index)
+            if ranked is not None:
+                return ranked
+        with span("score"):
+            ranked=scorer(query_terms, index, k)
+        if cache is not None:
+            cache.put(key, ranked, index)
+        return ranked
+
+def ranked_retrieval(query_list,index,k=RESULTS_PER_QUERY,impact_ordered=False,cache=None):
+    '''
+    Ranks the top k docs of every query by TF-IDF.
+    impact_ordered scores with the threshold algorithm over impact ordered postings instead of MaxScore.
+    A QueryCache keeps the ranking of each analyzed query.
+    Returns {query number: [(DOCNO, score)]} best first, query numbers counting from 1 in query_list order.
+    '''
+    res=OrderedDict()
+    analyzer=get_analyzer()
+    docnos=index["__docnos__"]
+    scorer=score_top_k_impact if impact_ordered else score_top_k
+    with span("ranked_retrieval"):
+        for q_num, query in enumerate(query_list, 1):
+            #clean, tokenize, remove stop words and stem
+            query_terms=analyzer.analyze(query)
+            res[q_num]=[(docnos[doc], score) for score, doc in rank_query(query_terms, index, k, scorer, cache)]
+    if cache is not None:
+        #hits and misses are counted in the metrics (query_cache_hits, query_cache_misses)
+        logger.debug("Query cache: {}".format(cache.stats()))
     return res
 
 
@@ -111,10 +237,7 @@ if __name__ == "__main__":
     # processed_text=preprocessor("data/trec.sample.xml")
     # processed_text=preprocessor("data/trec.5000.xml")
     # index_dict=create_inverted_index(processed_text)
-    json_index={}
-    with open("data/index.json", 'r') as json_file:
-        json_index = json.load(json_file)
-    logging.info("JSON index loaded")  
+    index=open_index("data/index.bin")
 
     query_list=[]
 
@@ -125,7 +248,12 @@ if __name__ == "__main__":
             query_list.append(line)
     # print(query_list)
     
-    ranked_res=ranked_retrieval(query_list,json_index)
+    #the top RESULTS_PER_QUERY of every query, like batch_search writes them
+    if np is not None:
+        #one batch of array operations instead of a python loop per doc
+        ranked_res=vectorized_ranked_retrieval(query_list,TermDocMatrix.from_index(index))
+    else:
+        ranked_res=ranked_retrieval(query_list,index)
     
     # pp = pprint.PrettyPrinter(indent=4)
     # pp.pprint(ranked_res)
@@ -134,8 +262,12 @@ if __name__ == "__main__":
 
 
     with open("data/test_set/result/results.ranked.txt",'w') as file:
-        for query in ranked_res:
-            sorted_results = sorted(ranked_res[query], key=lambda x: x['score'], reverse=True)
-            for res in sorted_results:
-                file.write(f"{res['qnum']},{res['doc']},{res['score']}\n")
-    logger.info("Ranked retrieval results written to txt file")
\ No newline at end of file
+        for q_num in ranked_res:
+            for doc, score in ranked_res[q_num]:
+                file.write(f"{q_num},{doc},{round(score,RESULT_DIGITS)}\n")
+    logger.info("Ranked retrieval results written to txt file")
+
+    #per stage timings and counters, recorded when SEARCH_METRICS is set
+    if metrics_enabled():
+        for line in metrics_summary(export_metrics()):
+            logger.info(line)
\ No newline at end of file
@@ -0,0 +1,75 @@
+import math
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np=None
+
+'''
+TF-IDF weights shared by the index writer and the ranked retrieval engines.
+
+    weight of a term in a doc = (1+log10(tf)) * log10(N/df)
+
+tf is the number of positions of the term in the doc, N the number of docs and df the term's doc freq.
+Every engine has to compute the weights through these functions so their scores stay bit for bit equal.
+'''
+
+#docs ranked per query unless a caller asks for another k
+RESULTS_PER_QUERY=150
+#results.ranked.txt rounds the scores to this many digits
+RESULT_DIGITS=4
+
+#postings lists this long are weighted and impact ordered with numpy when it is installed
+NUMPY_MIN_LENGTH=128
+
+#scores within this much of the top k threshold are never pruned, bound sums are added up in a different order than scores
+SCORE_EPSILON=1e-9
+
+
+def check_k(k):
+    #a top k has room for at least one doc, k=None keeps every doc
+    if k is not None and k<1:
+        raise ValueError("k has to be at least 1: {}".format(k))
+
+def idf(num_docs, doc_freq):
+    return math.log10(num_docs/doc_freq)
+
+def tf_weight(tf):
+    return 1+math.log10(tf)
+
+def tf_weights(tfs, term_idf):
+    '''
+    Weight of a term with idf term_idf in docs with the given tfs, as an array of doubles.
+    Long lists weigh every distinct tf once through tf_weight and gather the results, so the weights are bit for
+    bit the ones of the plain loop.
+    '''
+    if np is not None and len(tfs)>=NUMPY_MIN_LENGTH:
+        distinct, inverse=np.unique(np.asarray(tfs), return_inverse=True)
+        table=np.array([tf_weight(int(tf))*term_idf for tf in distinct], np.float64)
+        weights=array('d')
+        weights.frombytes(table[inverse].tobytes())
+        return weights
+    return array('d', [tf_weight(tf)*term_idf for tf in tfs])
+
+def posting_weights(position_lists, num_docs, doc_freq=None):
+    '''
+    Weight of a term in each of its docs, in postings order, as an array of doubles.
+    doc_freq defaults to the number of position lists; an index holding part of a collection passes the
+    collection wide doc freq (and num_docs) so its weights are the ones of the whole collection.
+    '''
+    if doc_freq is None:
+        doc_freq=len(position_lists)
+    term_idf=idf(num_docs, doc_freq) if position_lists else 0.0
+    return tf_weights([len(positions) for positions in position_lists], term_idf)
+
+def impact_order(weights):
+    '''
+    Postings numbers sorted by descending weight, equal weights by ascending doc id.
+    '''
+    if np is not None and len(weights)>=NUMPY_MIN_LENGTH:
+        #a stable sort keeps equal weights in postings order
+        order=array('I')
+        order.frombytes(np.argsort(-np.frombuffer(weights, np.float64), kind="stable").astype(np.uint32).tobytes())
+        return order
+    return array('I', sorted(range(len(weights)), key=lambda i: (-weights[i], i)))
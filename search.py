@@ -1,12 +1,15 @@
 import os
 import sys
-import datetime
 import logging
 from collections import OrderedDict
 
 # Add the directory containing your module to the Python path (wants absolute paths)
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from indexing import *
+from index_store import open_index
+from postings import intersect, resolve, phrase_positions, unordered_window, ordered_window, doc_positions, to_docnos
+from query_planner import parse_query, plan_query, execute_plan, describe_plan
+from metrics import span
 import pprint
 
 # Configure logging to display messages in the console (stdout)
@@ -18,202 +21,175 @@ logging.basicConfig(
 # Create a logger instance
 logger = logging.getLogger()
 
-def boolean_search(query_list, index):
-    start_time=datetime.datetime.now()
-    logging.info("Boolean Search Start time: {}".format(start_time))
+def analyze_boolean_query(query):
+    '''
+    Analyzes a boolean query into lower cased, stemmed terms with the operators and quoted phrases kept.
+    '''
+    analyzer=get_analyzer()
+    #pre-process query
+    # query_terms=query.lower().split()
+    #Cleanup and case folding
+    #remove punctuation and replace with ' '
+
+    # query=text_cleaner(query)
+    #TOkenize but keep phrases intact
+    # query_terms=text_tokenizer(query)
+    query_terms=analyzer.tokenize_query(query)
+    
+    #remove stop words, operators are kept
+    query_terms=analyzer.remove_stopwords(query_terms, keep=analyzer.operators)
+
+    #stemmer
+    query_terms=analyzer.stem(query_terms)
+
+    return [term.lower() for term in query_terms]
+
+def evaluate_boolean(query_terms, index, query=None, cache=None):
+    '''
+    Evaluates an analyzed boolean query and returns the matching integer doc ids as a sorted array.
+    A QueryCache keeps the result under the analyzed terms and the results of its subexpressions.
+    '''
+    if cache is not None:
+        key=("boolean", tuple(query_terms))
+        doc_ids=cache.get(key, index)
+        if doc_ids is not None:
+            return doc_ids
+
+    #parse into an AST, order operands by doc freq and turn "and not" into a difference
+    plan=plan_query(parse_query(query_terms), index)
+    logger.debug("Boolean plan for {}: {}".format(query or " ".join(query_terms), describe_plan(plan)))
+
+    doc_ids=resolve(execute_plan(plan, index, phrase_doc_ids, cache), index["__all_docs__"])
+    if cache is not None:
+        cache.put(key, doc_ids, index)
+    return doc_ids
+
+def boolean_doc_ids(query, index, cache=None):
+    '''
+    Evaluates a single boolean query and returns the matching integer doc ids as a sorted array.
+    '''
+    with span("boolean_query"):
+        return evaluate_boolean(analyze_boolean_query(query), index, query, cache)
+
+def boolean_search(query_list, index, cache=None):
     query_results=OrderedDict()
-    for query in query_list:
-        #pre-process query
-        # query_terms=query.lower().split()
-        #Cleanup and case folding
-        #remove punctuation and replace with ' '
-        q=query
-
-        # query=text_cleaner(query)
-        #TOkenize but keep phrases intact
-        # query_terms=text_tokenizer(query)
-        query_terms = re.findall(r'\"[^\"]+\"|\S+', query)
-        
-        #remove stop words
-        stop_words_path="data/english_stop_list.txt"
-        with open(stop_words_path,'r') as file:
-            stop_word_set=set(file.read().split())
-
-        query_terms=[word for word in query_terms if word not in stop_word_set or word in ["and", "or", "not"]]
-
-        
-        #stemmer
-        query_terms=text_stemmer(query_terms)
-
-        operand_stack=[]
-        operator_stack=[]
-        operator_precedence = {"or":1,"and":2,"not":3}
-
-        # print(query_terms)
-        #Create operator and operand stacks
-        for term in query_terms:
-            term=term.lower()
-
-            if term in operator_precedence.keys():
-                #precedence wise operator search
-                while len(operator_stack)>0 and operator_precedence[operator_stack[-1]] >= operator_precedence[term]:
-                    op=operator_stack.pop()
-                    if op=="not":
-                        operand_doc_ids= operand_stack.pop()
-                        all_doc_ids=set(index["__all_docs__"])
-                        operand_stack.append(all_doc_ids - operand_doc_ids)
-                    else: #and and or
-                        right_doc_ids=operand_stack.pop()
-                        left_doc_ids=operand_stack.pop()
-
-                        if op=="and":
-                            operand_stack.append(left_doc_ids & right_doc_ids)
-                        elif op=="or":
-                            operand_stack.append(left_doc_ids | right_doc_ids)
-
-                # outside loop -> precedence of current operator is more  -> push to operator stack           
-                operator_stack.append(term)
-            else:
-                # Process phrase operand by using phrase search function
-                if term[0]=='"' and term[-1]=='"':
-                    phrase = term.strip('"')
-                    phrase_result = phrase_search([phrase], index)
-                    doc_ids = set(phrase_result)
-                else:
-                    if term in index:
-                        doc_ids=set(index[term]["postings_list"].keys())
-                    else:
-                        doc_ids=set()
-                operand_stack.append(doc_ids)
-                # print("doc ids pushed in stack for"+term)
-        
-
-        while operator_stack:
-            op=operator_stack.pop()
-
-            if op=="not":
-                operand_doc_ids= operand_stack.pop()
-                all_doc_ids=set(index["__all_docs__"])
-                operand_stack.append(all_doc_ids - operand_doc_ids)
-            else: #and and or
-                right_doc_ids=operand_stack.pop()
-                left_doc_ids=operand_stack.pop()
-
-                if op=="and":
-                    operand_stack.append(left_doc_ids & right_doc_ids)
-                elif op=="or":
-                    operand_stack.append(left_doc_ids | right_doc_ids)
-        res_docs=list(operand_stack.pop())
-        query_results[query] ={"matches":len(res_docs) ,"documents":res_docs}
-    logging.info("Time taken: {}".format(datetime.datetime.now()-start_time))
+    with span("boolean_search"):
+        for query in query_list:
+            res_docs=to_docnos(boolean_doc_ids(query, index, cache), index)
+            query_results[query] ={"matches":len(res_docs) ,"documents":res_docs}
+    if cache is not None:
+        #hits and misses are counted in the metrics (query_cache_hits, query_cache_misses)
+        logger.debug("Query cache: {}".format(cache.stats()))
     return query_results    
 
-def phrase_search(query_list,index):
-    start_time=datetime.datetime.now()
-    logger.info("Phrase search started {}".format(start_time))
-    for query in query_list:
-        q=query
-
-        query=text_cleaner(query)
-        query_terms=text_tokenizer(query)
-        
-        #remove stop words
-        stop_words_path="data/english_stop_list.txt"
-        with open(stop_words_path,'r') as file:
-            stop_word_set=set(file.read().split())
-        query_terms=[word for word in query_terms if word not in stop_word_set or word in ["and", "or", "not"]]
-        
-        #stemmer
-        
-        # query_terms=text_stemmer(query_terms)
-        #concatenate AND between all query terms and do boolean search
-        query_terms_bool=" and ".join(query_terms)
-
-        # print(query_terms_bool)
-        
-        bool_search_res=boolean_search([query_terms_bool],index)
-        # print(bool_search_res[query_terms_bool]["documents"])
+def phrase_matches(query, index):
+    '''
+    Positional phrase match. Returns {doc id: positions where the phrase starts} for every doc containing it.
+    '''
+    #clean, tokenize, remove stop words and stem
+    #positions in the index are counted after stop word removal, so the offset of a term is its place in this list
+    query_terms=get_analyzer().analyze(query)
+    matches=OrderedDict()
+    if not query_terms or any(term not in index for term in query_terms):
+        return matches
+    entries=[index[term] for term in query_terms]
+    offsets=list(range(len(query_terms)))
+
+    #docs containing every term, rarest term first
+    with span("merge"):
+        common_docs=entries[0]["doc_ids"]
+        for entry in sorted(entries, key=lambda entry: entry["doc_freq"]):
+            common_docs=intersect(common_docs, entry["doc_ids"])
+
+    for doc in common_docs:
+        positions=phrase_positions([doc_positions(entry, doc) for entry in entries], offsets)
+        if positions:
+            matches[doc]=positions
+    return matches
+
+def phrase_doc_ids(query, index):
+    '''
+    Returns the sorted integer doc ids containing the phrase.
+    '''
+    with span("phrase_query"):
+        return array('I', phrase_matches(query, index).keys())
 
-        #for all docs in bool search result,see pos diff for each term if more than 1; break;
-        common_docs=bool_search_res[query_terms_bool]["documents"]
-        query_terms=text_stemmer(query_terms)
-        # print(common_docs)
-        doc_list=[]
-
-        for doc in common_docs:
-            first_term_pos_list = index[query_terms[0]]["postings_list"][doc]
-            
-
-            for pos in first_term_pos_list:
-                phrase_match=1
-                for i in range(1,len(query_terms)):
-                    posting_list_n=index[query_terms[i]]["postings_list"][doc]
-                    if pos+1 not in posting_list_n:
-                        phrase_match=0
-                        break
-                if phrase_match>0:
-                    doc_list.append(doc)
-                    break
-    logger.info("Phrase search complete. Time: {}".format(datetime.datetime.now()-start_time))
+def phrase_search(query_list,index):
+    doc_list=[]
+    with span("phrase_search"):
+        for query in query_list:
+            doc_list.extend(to_docnos(phrase_doc_ids(query, index), index))
     return doc_list
     
-def proximity_search(query_list,index):
-    start_time=datetime.datetime.now()
-    logger.info("Proximity search started {}".format(start_time))
-    for query in query_list:
-        q=query
-
-        query=query.split('(')
-        pos_diff=int(query[0].replace('#',''))
-        query_terms=query[1].lower().replace(")",'').split(',')
-
-        # query=text_cleaner(query)
-        # query_terms=text_tokenizer(query)
-        
-        #remove stop words
-        # stop_words_path="data/english_stop_list.txt"
-        # with open(stop_words_path,'r') as file:
-            # stop_word_set=set(file.read().split())
-        # query_terms=[word for word in query_terms if word not in stop_word_set or word in ["and", "or", "not"]]
-        
-        #stemmer
-        
-
-        #concatenate AND between all query terms and do boolean search
-        query_terms_bool=" and ".join(query_terms)
-
-        # print(query_terms_bool)
-
-        
-        bool_search_res=boolean_search([query_terms_bool],index)
-        # print(bool_search_res[query_terms_bool]["documents"])
-
-        #for all docs in bool search result,see pos diff for each term if more than 1; break;
-        common_docs=bool_search_res[query_terms_bool]["documents"]
-        query_terms=text_stemmer(query_terms)
-
-        query_terms=[word.strip() for word in query_terms]
-
-        # print(common_docs)
-        doc_list=[]
-
+PROXIMITY_RE=re.compile(r"#\s*(od|uw)?(\d+)\s*\((.*)\)")
+
+def parse_proximity(query):
+    '''
+    Splits a proximity query into (width, stemmed terms, ordered).
+    #N(a,b,...) and #uwN(a,b,...) match the terms in any order within N positions,
+    #odN(a,b,...) only in the given order.
+    '''
+    match=PROXIMITY_RE.match(query.strip())
+    if match is None:
+        raise ValueError("not a proximity query: {}".format(query))
+    ordered=match.group(1)=="od"
+    pos_diff=int(match.group(2))
+    query_terms=[word.strip() for word in match.group(3).lower().split(',')]
+    query_terms=get_analyzer().stem([word for word in query_terms if word])
+    return pos_diff, query_terms, ordered
+
+def proximity_doc_ids(query, index, entries=None, cache=None):
+    '''
+    Returns the sorted integer doc ids matching a proximity query.
+    entries can carry already fetched term -> index entry lookups shared between queries.
+    '''
+    with span("proximity_query"):
+        pos_diff, query_terms, ordered=parse_proximity(query)
+        if cache is not None:
+            key=("proximity", pos_diff, tuple(query_terms), ordered)
+            doc_list=cache.get(key, index)
+            if doc_list is not None:
+                return doc_list
+            return cache.put(key, proximity_doc_ids(query, index, entries), index)
+        if entries is None:
+            entries={}
+        for term in query_terms:
+            if term not in entries:
+                entries[term]=index[term] if term in index else None
+        term_entries=[entries[term] for term in query_terms]
+        if not term_entries or None in term_entries:
+            return array('I')
+
+        #docs containing every term, rarest term first
+        with span("merge"):
+            common_docs=term_entries[0]["doc_ids"]
+            for entry in sorted(term_entries, key=lambda entry: entry["doc_freq"]):
+                common_docs=intersect(common_docs, entry["doc_ids"])
+
+        window_match=ordered_window if ordered else unordered_window
+        doc_list=array('I')
         for doc in common_docs:
-            first_term_pos_list=index[query_terms[0]]["postings_list"][doc]
-
-            for pos in first_term_pos_list:
-                posting_list_2=index[query_terms[1]]["postings_list"][doc]
-                found_match=0
-                for next_pos in posting_list_2:
-                    # if (pos < next_pos) and (next_pos <= pos + pos_diff): #if order matters -> incom should come bfore tax
-                    if abs(pos-next_pos)<=pos_diff:
-                        found_match=1
-                        break
-
-                if found_match>0:
-                    doc_list.append(int(doc))
-                    break
-
-        logger.info("Proximity search complete. Time: {}".format(datetime.datetime.now()-start_time))
+            if window_match([doc_positions(entry, doc) for entry in term_entries], pos_diff):
+                doc_list.append(doc)
+        return doc_list
+
+def proximity_search_batch(query_list,index,cache=None):
+    '''
+    Evaluates many proximity queries, fetching each distinct term's postings once for the whole batch.
+    Returns {query: sorted DOCNOs as int}.
+    '''
+    entries={}
+    query_results=OrderedDict()
+    with span("proximity_search"):
+        for query in query_list:
+            query_results[query]=sorted(int(docno) for docno in to_docnos(proximity_doc_ids(query, index, entries, cache), index))
+    return query_results
+
+def proximity_search(query_list,index,cache=None):
+    #docs matching any of the queries
+    doc_list=set()
+    for docs in proximity_search_batch(query_list, index, cache).values():
+        doc_list.update(docs)
     return sorted(doc_list)
 
 if __name__ == "__main__":
@@ -221,12 +197,9 @@ if __name__ == "__main__":
 
     # processed_text=preprocessor("data/trec.5000.xml")
     # index_dict=create_inverted_index(processed_text)
-    json_index={}
-    with open("data/index.json", 'r') as json_file:
-        json_index = json.load(json_file)
-    logging.info("JSON index loaded")  
+    index=open_index("data/index.bin")
 
-    # print(boolean_search(["Sadness"],json_index))
+    # print(boolean_search(["Sadness"],index))
 
     # logging.info(type(json_index))  
     
@@ -246,9 +219,9 @@ if __name__ == "__main__":
                     "result":[]}
         
         if '#' in q:
-            res[q_num]["result"]=proximity_search([q],json_index)
+            res[q_num]["result"]=proximity_search([q],index)
         else:
-            res[q_num]["result"]=boolean_search([q],json_index)[q]["documents"]
+            res[q_num]["result"]=boolean_search([q],index)[q]["documents"]
         res[q_num]["matches"]=len(res[q_num]["result"])
         q_num+=1
 
@@ -263,7 +236,7 @@ if __name__ == "__main__":
     logger.info("Result file written")
     
 
-    # bool_search_res=boolean_search(queries[:1],json_index)
+    # bool_search_res=boolean_search(queries[:1],index)
     # print(bool_search_res)
     # with open("data/bolean_search.txt",'w') as file:
     #    q_num=1
@@ -273,38 +246,38 @@ if __name__ == "__main__":
     #        q_num=q_num+1
     # logger.info("Bool search results saved to txt")
     
-    # phrase_search_res=boolean_search(['israel and "middle east"'],json_index)
+    # phrase_search_res=boolean_search(['israel and "middle east"'],index)
     # print(phrase_search_res)    
-    # phrase_search_res=boolean_search(['"middle east" AND israel'],json_index)
+    # phrase_search_res=boolean_search(['"middle east" AND israel'],index)
     # print(phrase_search_res)
 
-    # phrase_search_res=boolean_search(['"wall street" AND "dow jones"'],json_index)
+    # phrase_search_res=boolean_search(['"wall street" AND "dow jones"'],index)
     # print(phrase_search_res)    
-    # phrase_search_res=boolean_search(['"dow jones" and "wall street"'],json_index)
+    # phrase_search_res=boolean_search(['"dow jones" and "wall street"'],index)
     # print(phrase_search_res)
 
-    # phrase_search_res=boolean_search(['Sadness'],json_index)
+    # phrase_search_res=boolean_search(['Sadness'],index)
     # print(phrase_search_res)   
     
-    # phrase_search_res=boolean_search(['glasgow and scotland'],json_index)
+    # phrase_search_res=boolean_search(['glasgow and scotland'],index)
     # print(phrase_search_res) 
-    # phrase_search_res=boolean_search(['corporate and taxes'],json_index)
+    # phrase_search_res=boolean_search(['corporate and taxes'],index)
     # print(phrase_search_res) 
-    # phrase_search_res=boolean_search(['"corporate taxes"'],json_index)
+    # phrase_search_res=boolean_search(['"corporate taxes"'],index)
     # print(phrase_search_res) 
 
-    # proximity_search_res=proximity_search(["#30(corporate,taxes)"],json_index)
+    # proximity_search_res=proximity_search(["#30(corporate,taxes)"],index)
     # print("matches: {}".format(len(proximity_search_res)))
     # print(proximity_search_res)
 
-    # phrase_search_res=boolean_search(['"middle east" AND israel'],json_index)
+    # phrase_search_res=boolean_search(['"middle east" AND israel'],index)
     # print(phrase_search_res)    
 
-    # proximity_search_res=proximity_search(["#5(Palestinian, organisations)"],json_index)
+    # proximity_search_res=proximity_search(["#5(Palestinian, organisations)"],index)
     # print("matches: {}".format(len(proximity_search_res)))
     # print(proximity_search_res)
 
-    # phrase_search_res=boolean_search(['ft or articl or deal or bbc or bskyb'],json_index)
+    # phrase_search_res=boolean_search(['ft or articl or deal or bbc or bskyb'],index)
     # print(phrase_search_res)  
     
 
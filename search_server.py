@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import datetime
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+# Add the directory containing your module to the Python path (wants absolute paths)
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from indexing import get_analyzer
+from index_store import open_index, INDEX_PATH
+from postings import to_docnos
+from search import boolean_doc_ids, phrase_doc_ids, proximity_doc_ids
+from ranked_retrieval import rank_query
+from query_cache import QueryCache, QUERY_CACHE_BYTES
+from scoring import RESULTS_PER_QUERY
+
+logging.basicConfig(
+    level=logging.INFO,  # Set the logging level (e.g., INFO, DEBUG, WARNING)
+    format="{} : %(asctime)s - %(levelname)s : %(message)s".format("Search Server") # Log message format
+)
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Long running HTTP search server.
+
+    GET /boolean?q=glasgow and not scotland     {"query", "matches", "documents": [DOCNO, ...]}
+    GET /phrase?q=middle east                   {"query", "matches", "documents": [DOCNO, ...]}
+    GET /proximity?q=#5(income,taxes)           {"query", "matches", "documents": [DOCNO as int, ...]}
+    GET /ranked?q=income tax reduction&k=10     {"query", "results": [{"doc": DOCNO, "score": score}, ...]}
+    GET /health                                 {"status": "ok", "uptime": seconds}
+
+The asyncio event loop only parses requests and writes responses. Queries run on a process pool whose
+workers each memory-map the index once when they start, so the loop stays responsive while queries are
+evaluated and all workers share the index pages of the OS page cache. Every worker keeps its own QueryCache.
+Malformed queries (or a k below 1) get a 400 with {"error": message}, a query that fails otherwise a 500.
+A request line or header longer than MAX_REQUEST_LINE or a body over MAX_REQUEST_BODY gets a 413 and an invalid
+Content-Length a 400, after which the connection is closed.
+'''
+
+SERVER_PORT=8080
+MAX_REQUEST_LINE=65536
+MAX_REQUEST_BODY=1024*1024
+REASONS={200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+         500: "Internal Server Error"}
+
+#per worker process state, set up by init_worker
+WORKER={}
+
+
+def init_worker(index_path, cache_bytes):
+    WORKER["index"]=open_index(index_path)
+    WORKER["cache"]=QueryCache(cache_bytes) if cache_bytes else None
+
+def run_query(kind, query, k=RESULTS_PER_QUERY):
+    '''
+    Evaluates one query in a worker process and returns the JSON response body.
+    '''
+    index=WORKER["index"]
+    cache=WORKER["cache"]
+    if kind=="ranked":
+        ranked=rank_query(get_analyzer().analyze(query), index, k, cache=cache)
+        docnos=index["__docnos__"]
+        return {"query": query, "results": [{"doc": docnos[doc], "score": score} for score, doc in ranked]}
+    if kind=="boolean":
+        documents=to_docnos(boolean_doc_ids(query, index, cache), index)
+    elif kind=="phrase":
+        documents=to_docnos(phrase_doc_ids(query, index), index)
+    else:
+        documents=sorted(int(docno) for docno in to_docnos(proximity_doc_ids(query, index, cache=cache), index))
+    return {"query": query, "matches": len(documents), "documents": documents}
+
+class RequestError(Exception):
+    '''
+    A request that cannot be read, answered with status before the connection is closed.
+    '''
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status=status
+
+async def read_request(reader):
+    '''
+    Reads one request head and skips its body. Returns (request line parts, {lower cased header: value}),
+    None at the end of the connection.
+    '''
+    try:
+        request_line=await reader.readline()
+        if not request_line:
+            return None
+        headers={}
+        while True:
+            line=await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value=line.decode("latin-1").partition(":")
+            headers[name.strip().lower()]=value.strip()
+    except (ValueError, asyncio.LimitOverrunError):
+        #readline raises ValueError for a line over the stream limit
+        raise RequestError(413, "request line or header longer than {} bytes".format(MAX_REQUEST_LINE))
+    if "content-length" in headers:
+        length=headers["content-length"]
+        if not (length.isascii() and length.isdigit()):
+            raise RequestError(400, "invalid Content-Length {!r}".format(length))
+        if int(length)>MAX_REQUEST_BODY:
+            raise RequestError(413, "body longer than {} bytes".format(MAX_REQUEST_BODY))
+        await reader.readexactly(int(length))
+    return request_line.decode("latin-1").split(), headers
+
+async def write_response(writer, status, body, keep_alive):
+    payload=json.dumps(body).encode("utf-8")
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+        status, REASONS.get(status, ""), len(payload), "keep-alive" if keep_alive else "close").encode("latin-1")+payload)
+    await writer.drain()
+
+class SearchServer:
+    def __init__(self, index_path=INDEX_PATH, workers=None, cache_bytes=QUERY_CACHE_BYTES):
+        self.index_path=index_path
+        self.pool=ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(index_path, cache_bytes))
+        self.start_time=datetime.datetime.now()
+        self.requests=0
+
+    async def handle_request(self, method, target):
+        '''
+        Returns (status, response body) for one request.
+        '''
+        if method!="GET":
+            return 405, {"error": "only GET is supported"}
+        url=urlsplit(target)
+        params=parse_qs(url.query)
+        kind=url.path.strip("/")
+        if kind=="health":
+            return 200, {"status": "ok", "uptime": (datetime.datetime.now()-self.start_time).total_seconds(), "requests": self.requests}
+        if kind not in ("boolean", "phrase", "proximity", "ranked"):
+            return 404, {"error": "unknown endpoint {}".format(url.path)}
+        query=params.get("q", [""])[0].strip()
+        if not query:
+            return 400, {"error": "missing q parameter"}
+        try:
+            k=int(params["k"][0]) if "k" in params else RESULTS_PER_QUERY
+        except ValueError:
+            return 400, {"error": "k has to be an integer"}
+        if k<1:
+            return 400, {"error": "k has to be at least 1"}
+        loop=asyncio.get_running_loop()
+        try:
+            return 200, await loop.run_in_executor(self.pool, run_query, kind, query, k)
+        except ValueError as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            #the client still gets an answer on its connection
+            logger.exception("{} query {!r} failed".format(kind, query))
+            return 500, {"error": "{}: {}".format(type(error).__name__, error)}
+
+    async def handle_connection(self, reader, writer):
+        #HTTP/1.1 with keep-alive, requests on a connection are answered in order
+        try:
+            while True:
+                try:
+                    request=await read_request(reader)
+                except RequestError as error:
+                    #the rest of the stream cannot be framed, answer and close
+                    logger.warning("Rejected request: {}".format(error))
+                    await write_response(writer, error.status, {"error": str(error)}, False)
+                    break
+                if request is None:
+                    break
+                parts, headers=request
+                if len(parts)!=3:
+                    status, body=400, {"error": "malformed request line"}
+                else:
+                    self.requests+=1
+                    status, body=await self.handle_request(parts[0], parts[1])
+                keep_alive=headers.get("connection", "").lower()!="close" and len(parts)==3 and parts[2]=="HTTP/1.1"
+                await write_response(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=SERVER_PORT):
+        #readline refuses lines over the stream limit, so no request line or header is buffered past MAX_REQUEST_LINE
+        return await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_LINE)
+
+    async def serve(self, host="127.0.0.1", port=SERVER_PORT):
+        server=await self.start(host, port)
+        logger.info("Serving {} on http://{}:{}".format(self.index_path, host, port))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="HTTP search server")
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="query worker processes, defaults to the number of cores")
+    parser.add_argument("--cache-bytes", type=int, default=QUERY_CACHE_BYTES, help="query cache size per worker, 0 disables it")
+    args=parser.parse_args()
+
+    search_server=SearchServer(args.index, args.workers, args.cache_bytes)
+    try:
+        asyncio.run(search_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        search_server.close()
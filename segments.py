@@ -0,0 +1,441 @@
+import os
+import json
+import datetime
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from indexing import get_analyzer
+from index_store import write_binary_index, write_atomic, open_index, POSTINGS_CACHE_SIZE
+from scoring import idf, posting_weights
+from query_cache import next_generation
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Segment based incremental indexing.
+
+An index directory holds immutable segments, each a binary index file (index_store format) numbering its docs
+from 0, plus a manifest listing the live segments in order:
+    segments.json:    {"segments": [{"name": "segment_0", "num_docs": 1000}, ...], "next_segment": 3}
+    segment_0.bin:    the segment's postings
+    segment_0.del:    tombstone bitmap, bit i set when the segment's doc i is deleted (only once something is)
+
+New documents go into an in-memory segment that is flushed to a new immutable segment every flush_docs docs
+(or on flush()). Deletes set the doc's tombstone bit, nothing is rewritten. A MergeScheduler (merge_scheduler.py)
+merges adjacent segments in the background and swaps the result in with commit_merge.
+
+Searching sees the segments one after the other as a single index: a doc's id is its id in its segment plus
+the number of docs in the segments before it. index[term] merges the term's postings of every segment, drops
+tombstoned docs and recomputes doc_freq, idf and weights against the live doc count, so doc_freq,
+"__all_docs__" (the live doc ids) and TF-IDF scores are the same as for an index built from the live docs.
+Lookups are served by an IndexSnapshot of the current generation, which caches the merged entries; every
+change starts a new generation while queries still holding the previous snapshot keep reading it.
+'''
+
+MANIFEST="segments.json"
+SEGMENT_FLUSH_DOCS=1000
+
+
+class MemorySegment:
+    '''
+    Segment being filled with new documents, in the {term: [doc_freq, {doc_id: positions}]} form of build_index.
+    '''
+    def __init__(self):
+        self.name=None
+        self.index={}
+        self.docnos=[]
+        self.deleted=bytearray()
+
+    @property
+    def num_docs(self):
+        return len(self.docnos)
+
+    def add(self, docno, words):
+        doc_id=len(self.docnos)
+        self.docnos.append(docno)
+        if doc_id%8==0:
+            self.deleted.append(0)
+        pos=1
+        for word in words:
+            if word not in self.index:
+                self.index[word]=[1,{doc_id:array('I',[pos])}]
+            elif doc_id in self.index[word][1]:
+                self.index[word][1][doc_id].append(pos)
+            else:
+                self.index[word][0]+=1
+                self.index[word][1][doc_id]=array('I',[pos])
+            pos=pos+1
+        return doc_id
+
+    def postings(self, term, num_docs=None):
+        '''
+        (doc ids, positions) of a term in this segment, None if it does not occur.
+        num_docs leaves out the docs added after the first num_docs.
+        '''
+        entry=self.index.get(term)
+        if entry is None:
+            return None
+        #docs are added in id order, so the dict is already sorted
+        doc_ids=array('I', entry[1].keys())
+        positions=list(entry[1].values())
+        if num_docs is not None and doc_ids[-1]>=num_docs:
+            end=bisect_left(doc_ids, num_docs)
+            if end==0:
+                return None
+            doc_ids, positions=doc_ids[:end], positions[:end]
+        return doc_ids, positions
+
+    def terms(self):
+        return self.index.keys()
+
+class Segment:
+    '''
+    Flushed, immutable segment: a memory-mapped binary index and its tombstone bitmap.
+    '''
+    def __init__(self, directory, name, cache_size=POSTINGS_CACHE_SIZE):
+        self.name=name
+        self.path=os.path.join(directory, name+".bin")
+        self.deleted_path=os.path.join(directory, name+".del")
+        self.index=open_index(self.path, cache_size)
+        self.num_docs=self.index.num_docs
+        self.docnos=self.index["__docnos__"]
+        if os.path.exists(self.deleted_path):
+            with open(self.deleted_path, 'rb') as file:
+                self.deleted=bytearray(file.read())
+        else:
+            self.deleted=bytearray((self.num_docs+7)//8)
+
+    def postings(self, term):
+        entry=self.index.get(term)
+        if entry is None:
+            return None
+        return entry["doc_ids"], entry["positions"]
+
+    def terms(self):
+        for i in range(self.index.num_terms):
+            yield self.index.term(i)
+
+    def iter_postings(self):
+        '''
+        (term, doc ids, positions) of every term in term order, decoded without going through the LRU.
+        '''
+        for i in range(self.index.num_terms):
+            entry=self.index.decode_term(i)
+            yield self.index.term(i), entry["doc_ids"], entry["positions"]
+
+    def save_deleted(self):
+        write_atomic(self.deleted_path, bytes(self.deleted))
+
+    def close(self):
+        self.index.close()
+
+def is_deleted(deleted, doc_id):
+    return deleted[doc_id>>3]>>(doc_id&7) & 1
+
+def live_count(num_docs, deleted):
+    return num_docs-int.from_bytes(deleted, "little").bit_count()
+
+class IndexSnapshot:
+    '''
+    Read-only view of a SegmentedIndex as it was at one generation: its segments, the docs of the in-memory
+    segment at that time and copies of the tombstone bitmaps. Adds, deletes, flushes and merges that happen
+    later build a new snapshot, so a query that runs on one sees the same doc ids and postings throughout.
+    It serves the same lookups as MappedIndex, so every search function runs on it unchanged.
+    '''
+    def __init__(self, generation, parts, buffer_lock, cache_size=POSTINGS_CACHE_SIZE):
+        self.generation=generation
+        #(first doc id, segment, tombstones, number of docs), in doc id order
+        self.parts=parts
+        self.buffer_lock=buffer_lock
+        self.cache_size=cache_size
+        self.cache=OrderedDict()
+        self.all_docs=None
+        self.docnos=None
+
+    def postings(self, segment, term, num_docs):
+        if isinstance(segment, MemorySegment):
+            #the in-memory segment keeps growing, read it under the index lock and only up to this snapshot's docs
+            with self.buffer_lock:
+                return segment.postings(term, num_docs)
+        return segment.postings(term)
+
+    def live_doc_ids(self):
+        if self.all_docs is None:
+            all_docs=array('I')
+            for base, segment, deleted, num_docs in self.parts:
+                all_docs.extend(base+doc_id for doc_id in range(num_docs) if not is_deleted(deleted, doc_id))
+            self.all_docs=all_docs
+        return self.all_docs
+
+    def merge_term(self, term):
+        '''
+        The term's live postings across all segments as an index entry, None if no live doc contains it.
+        '''
+        doc_ids=array('I')
+        positions=[]
+        for base, segment, deleted, num_docs in self.parts:
+            postings=self.postings(segment, term, num_docs)
+            if postings is None:
+                continue
+            any_deleted=any(deleted)
+            for doc_id, doc_positions in zip(*postings):
+                if any_deleted and is_deleted(deleted, doc_id):
+                    continue
+                doc_ids.append(base+doc_id)
+                positions.append(doc_positions)
+        if not doc_ids:
+            return None
+        num_docs=len(self.live_doc_ids())
+        weights=posting_weights(positions, num_docs)
+        return {"doc_freq": len(doc_ids), "doc_ids": doc_ids, "positions": positions,
+                "idf": idf(num_docs, len(doc_ids)), "weights": weights, "max_score": max(weights)}
+
+    def get(self, term, default=None):
+        if term=="__all_docs__":
+            return self.live_doc_ids()
+        if term=="__docnos__":
+            if self.docnos is None:
+                self.docnos=[docno for _, segment, _, num_docs in self.parts for docno in segment.docnos[:num_docs]]
+            return self.docnos
+        cache=self.cache
+        if term in cache:
+            cache.move_to_end(term)
+            entry=cache[term]
+        else:
+            entry=self.merge_term(term)
+            cache[term]=entry
+            if len(cache)>self.cache_size:
+                cache.popitem(last=False)
+        return default if entry is None else entry
+
+    def __getitem__(self, term):
+        entry=self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def doc_freq(self, term):
+        entry=self.get(term)
+        return entry["doc_freq"] if entry is not None else 0
+
+    def keys(self):
+        yield "__all_docs__"
+        yield "__docnos__"
+        terms=set()
+        for _, segment, _, _ in self.parts:
+            if isinstance(segment, MemorySegment):
+                with self.buffer_lock:
+                    terms.update(segment.terms())
+            else:
+                terms.update(segment.terms())
+        for term in sorted(terms):
+            #a term only in deleted docs is gone from the index
+            if term in self:
+                yield term
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        for term in self.keys():
+            yield term, self[term]
+
+class SegmentedIndex:
+    '''
+    Index over a directory of segments that takes new and deleted documents without a rebuild.
+    Lookups go to the snapshot of the current generation; a query that has to see one consistent index while
+    documents are added or segments merged in the background should run on index.snapshot().
+    '''
+    def __init__(self, directory, flush_docs=SEGMENT_FLUSH_DOCS, cache_size=POSTINGS_CACHE_SIZE):
+        self.directory=directory
+        self.flush_docs=flush_docs
+        self.cache_size=cache_size
+        self.lock=threading.RLock()
+        #set by a MergeScheduler, woken up after every flush
+        self.merge_scheduler=None
+        os.makedirs(directory, exist_ok=True)
+        manifest_path=os.path.join(directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as file:
+                manifest=json.load(file)
+        else:
+            manifest={"segments": [], "next_segment": 0}
+        self.next_segment=manifest["next_segment"]
+        self.segments=[Segment(directory, segment["name"], cache_size) for segment in manifest["segments"]]
+        self.buffer=MemorySegment()
+        #DOCNO -> (segment, doc id in the segment) of every live doc
+        self.locations={}
+        for segment in self.segments:
+            for doc_id, docno in enumerate(segment.docnos):
+                if not is_deleted(segment.deleted, doc_id):
+                    self.locations[docno]=(segment, doc_id)
+        self.version=0
+        self.changed()
+
+    def changed(self):
+        #every add, delete, flush or merge is a new generation: snapshots and cached query results are stale
+        self.version+=1
+        self.generation=next_generation()
+        self.current=None
+
+    def snapshot(self):
+        with self.lock:
+            if self.current is None:
+                parts=[]
+                base=0
+                for segment in self.segments+[self.buffer]:
+                    parts.append((base, segment, bytes(segment.deleted), segment.num_docs))
+                    base+=segment.num_docs
+                self.current=IndexSnapshot(self.generation, parts, self.lock, self.cache_size)
+            return self.current
+
+    def add_document(self, doc):
+        '''
+        Indexes a raw document {"id": DOCNO, "headline": ..., "text": ...} as iter_xml yields it.
+        A document whose DOCNO is already indexed replaces the old version.
+        '''
+        analyzer=get_analyzer()
+        words=analyzer.analyze(doc["headline"])+analyzer.analyze(doc["text"])
+        with self.lock:
+            if doc["id"] in self.locations:
+                self.delete_document(doc["id"])
+            doc_id=self.buffer.add(doc["id"], words)
+            self.locations[doc["id"]]=(self.buffer, doc_id)
+            self.changed()
+            if self.buffer.num_docs>=self.flush_docs:
+                self.flush()
+
+    def add_documents(self, docs):
+        for doc in docs:
+            self.add_document(doc)
+
+    def delete_document(self, docno):
+        '''
+        Marks a document deleted. Returns False if no live document has that DOCNO.
+        '''
+        with self.lock:
+            location=self.locations.pop(docno, None)
+            if location is None:
+                return False
+            segment, doc_id=location
+            segment.deleted[doc_id>>3]|=1<<(doc_id&7)
+            if segment is not self.buffer:
+                segment.save_deleted()
+            self.changed()
+            return True
+
+    def flush(self):
+        '''
+        Writes the in-memory segment as a new immutable segment and records it in the manifest.
+        '''
+        with self.lock:
+            buffer=self.buffer
+            if not buffer.num_docs:
+                return
+            start_time=datetime.datetime.now()
+            name=self.reserve_segment_name()
+            write_binary_index(buffer.index, buffer.docnos, os.path.join(self.directory, name+".bin"))
+            if any(buffer.deleted):
+                write_atomic(os.path.join(self.directory, name+".del"), bytes(buffer.deleted))
+            segment=Segment(self.directory, name, self.cache_size)
+            self.segments=self.segments+[segment]
+            self.write_manifest()
+
+            for doc_id, docno in enumerate(buffer.docnos):
+                if not is_deleted(buffer.deleted, doc_id):
+                    self.locations[docno]=(segment, doc_id)
+            self.buffer=MemorySegment()
+            self.changed()
+            logger.info("Flushed {} docs to {}. Time: {}".format(segment.num_docs, name, datetime.datetime.now()-start_time))
+        if self.merge_scheduler is not None:
+            self.merge_scheduler.wake()
+
+    def reserve_segment_name(self):
+        with self.lock:
+            name="segment_{}".format(self.next_segment)
+            self.next_segment+=1
+            return name
+
+    def commit_merge(self, run, name, doc_maps):
+        '''
+        Swaps the merged segment name in for the segments of run ([(segment, tombstones when the merge started)]).
+        doc_maps[i][doc_id] is the new id of a doc of the i-th segment, -1 for a doc the merge dropped.
+        Deletes that arrived while the merge ran are carried over to the merged segment.
+        Returns False, leaving the index as it was, if the segments of run are no longer adjacent in the index.
+        '''
+        old_segments=[segment for segment, _ in run]
+        with self.lock:
+            start=next((i for i, segment in enumerate(self.segments) if segment is old_segments[0]), None)
+            if start is None or self.segments[start:start+len(old_segments)]!=old_segments:
+                return False
+            segment=Segment(self.directory, name, self.cache_size)
+            for (old_segment, deleted), doc_map in zip(run, doc_maps):
+                for doc_id, new_doc_id in enumerate(doc_map):
+                    if new_doc_id<0:
+                        continue
+                    if is_deleted(old_segment.deleted, doc_id):
+                        #deleted after the merge started
+                        segment.deleted[new_doc_id>>3]|=1<<(new_doc_id&7)
+                    else:
+                        self.locations[old_segment.docnos[doc_id]]=(segment, new_doc_id)
+            if any(segment.deleted):
+                segment.save_deleted()
+            self.segments=self.segments[:start]+[segment]+self.segments[start+len(old_segments):]
+            self.write_manifest()
+            self.changed()
+        #snapshots taken before the swap keep their own references, the mappings stay readable after the unlink
+        for old_segment in old_segments:
+            for path in (old_segment.path, old_segment.deleted_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return True
+
+    def write_manifest(self):
+        manifest={"segments": [{"name": segment.name, "num_docs": segment.num_docs} for segment in self.segments],
+                  "next_segment": self.next_segment}
+        write_atomic(os.path.join(self.directory, MANIFEST), json.dumps(manifest, indent=4).encode("utf-8"))
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def get(self, term, default=None):
+        return self.snapshot().get(term, default)
+
+    def __getitem__(self, term):
+        return self.snapshot()[term]
+
+    def __contains__(self, term):
+        return term in self.snapshot()
+
+    def doc_freq(self, term):
+        return self.snapshot().doc_freq(term)
+
+    def keys(self):
+        return self.snapshot().keys()
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        return self.snapshot().items()
+
+
+def open_segmented_index(directory, flush_docs=SEGMENT_FLUSH_DOCS, cache_size=POSTINGS_CACHE_SIZE):
+    return SegmentedIndex(directory, flush_docs, cache_size)
+
+
+if __name__ == "__main__":
+    from indexing import iter_xml
+
+    index=open_segmented_index("data/segments")
+    index.add_documents(iter_xml("data/trec.5000.xml"))
+    index.flush()
+    logger.info("{} live docs in {} segments".format(len(index["__all_docs__"]), len(index.segments)))
@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import heapq
+import itertools
+import argparse
+import datetime
+import logging
+import tempfile
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the directory containing your module to the Python path (wants absolute paths)
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from indexing import iter_xml, chunk_docs, index_chunk, merge_indexes, get_analyzer
+from index_store import write_binary_index, write_atomic, open_index
+from search import boolean_doc_ids, phrase_doc_ids, proximity_doc_ids
+from ranked_retrieval import rank_query, score_top_k, score_top_k_impact
+from batch_search import BatchIndex, read_query_file, write_boolean_results, write_ranked_results
+from scoring import RESULTS_PER_QUERY, RESULT_DIGITS
+from metrics import span
+from corpus_stats import CorpusStatistics, GlobalStatsIndex
+
+logging.basicConfig(
+    level=logging.INFO,  # Set the logging level (e.g., INFO, DEBUG, WARNING)
+    format="{} : %(asctime)s - %(levelname)s : %(message)s".format("Sharded Search Module") # Log message format
+)
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Document partitioned (sharded) index with scatter-gather query execution.
+
+The build deals the documents of the collection round robin over num_shards shards: the doc with global id g
+(its place in the XML stream) becomes doc g//num_shards of shard g%num_shards. Every shard is a binary index of
+its own docs, so a worker only reads the postings of its part of the collection:
+    shards.json:    {"num_shards": 4, "num_docs": 5000, "impact_ordered": false, "global_weights": true,
+                     "shards": [{"name": "shard_0", "num_docs": 1250}, ...]}
+    shard_0.bin:    postings of docs 0, 4, 8, ... as shard doc ids 0, 1, 2, ...
+The build streams the XML to the workers in chunks, like parallel_create_inverted_index; workers spill every
+shard's part of a chunk to disk and return its doc freqs, then one worker per shard merges its parts and writes
+the shard file (atomically, see write_binary_index).
+
+The idf and max score of every shard's terms are computed at build time against the collection wide N and
+doc freqs (write_binary_index with collection_stats), so the weights a reader computes from the stored idf, and
+the score of a doc, are exactly the ones of an unsharded index and every shard's top k can be merged as is.
+A build with global_weights=False keeps every shard's idf its own, so a shard can be rebuilt on its own;
+the coordinator then keeps a CorpusStatistics over the shards and sends the collection statistics of a batch's
+terms along with it, and the workers rescore through a GlobalStatsIndex.
+
+A ShardedIndex coordinator sends a batch of queries to every shard on a process pool, one task per shard and
+batch. Workers memory-map the shard files on first use, evaluate the batch with the usual search functions and
+send back arrays of shard doc ids (and scores), which pickle as flat bytes. The coordinator merges boolean,
+phrase and proximity results by global doc id, ranked results by score with ties on ascending global doc id,
+and maps global doc ids to DOCNOs with the DOCNO tables of the shards. Results are the ones of the unsharded index, in the shapes of
+batch_boolean_search and batch_ranked_search.
+'''
+
+SHARD_MANIFEST="shards.json"
+
+#per worker process state, set up by init_shard_worker
+WORKER={}
+
+
+def shard_name(shard):
+    return "shard_{}".format(shard)
+
+def global_doc_id(doc_id, shard, num_shards):
+    return doc_id*num_shards+shard
+
+def shard_part_path(spill_directory, chunk, shard):
+    return os.path.join(spill_directory, "chunk_{}_{}.pickle".format(chunk, shard))
+
+def index_shard_chunk(task):
+    '''
+    Runs in a worker process: preprocesses a chunk of raw documents, deals it round robin over the shards and
+    spills every shard's partial index of the chunk to spill_directory.
+    Returns only what the collection statistics need, the chunk's doc count and {term: doc_freq}.
+    '''
+    chunk, start, docs, num_shards, spill_directory=task
+    doc_freqs={}
+    for shard in range(num_shards):
+        #the doc with global id g goes to shard g%num_shards, chunks start at any global id
+        shard_docs=docs[(shard-start)%num_shards::num_shards]
+        index, all_docs=index_chunk(shard_docs)
+        for term, (doc_freq, _) in index.items():
+            doc_freqs[term]=doc_freqs.get(term, 0)+doc_freq
+        with open(shard_part_path(spill_directory, chunk, shard), 'wb') as file:
+            pickle.dump((index, all_docs), file, pickle.HIGHEST_PROTOCOL)
+    return len(docs), doc_freqs
+
+def read_shard_parts(spill_directory, num_chunks, shard):
+    #a shard's partial indexes in stream order, one chunk in memory at a time
+    for chunk in range(num_chunks):
+        with open(shard_part_path(spill_directory, chunk, shard), 'rb') as file:
+            yield pickle.load(file)
+
+def write_shard(task):
+    '''
+    Runs in a worker process: merges the spilled partial indexes of one shard and writes the shard file.
+    Returns the shard's doc count.
+    '''
+    directory, spill_directory, num_chunks, shard, impact_ordered, collection_stats=task
+    #every chunk's partial numbers its docs from 0, merging in chunk order gives the shard doc ids g//num_shards
+    index, all_docs=merge_indexes(read_shard_parts(spill_directory, num_chunks, shard))
+    #written atomically, query workers that still map the old shard file keep reading it
+    write_binary_index(index, all_docs, os.path.join(directory, shard_name(shard)+".bin"), impact_ordered,
+                       collection_stats=collection_stats)
+    return len(all_docs)
+
+def build_sharded_index(input_file_path, directory, num_shards, processes=None, impact_ordered=False, global_weights=True, chunk_size=500):
+    '''
+    Preprocesses and indexes the collection as num_shards shards in directory on a process pool.
+    The XML stream is handed to the workers in chunks of chunk_size documents; the workers spill their shards'
+    partial indexes to disk and send back only doc freqs, so this process holds the collection statistics
+    and no postings. global_weights computes the shards' idf against the whole collection. Returns the manifest.
+    '''
+    start_time=datetime.datetime.now()
+    os.makedirs(directory, exist_ok=True)
+    spill_directory=tempfile.mkdtemp(prefix="build_", dir=directory)
+    try:
+        with multiprocessing.Pool(processes or num_shards) as pool:
+            tasks=((chunk, chunk*chunk_size, docs, num_shards, spill_directory)
+                   for chunk, docs in enumerate(chunk_docs(iter_xml(input_file_path), chunk_size)))
+            #collection wide statistics every shard's weights are computed against
+            num_docs=0
+            num_chunks=0
+            doc_freqs={}
+            for chunk_num_docs, chunk_doc_freqs in pool.imap(index_shard_chunk, tasks):
+                num_docs+=chunk_num_docs
+                num_chunks+=1
+                for term, doc_freq in chunk_doc_freqs.items():
+                    doc_freqs[term]=doc_freqs.get(term, 0)+doc_freq
+
+            collection_stats=(num_docs, doc_freqs) if global_weights else None
+            shard_num_docs=pool.map(write_shard, [(directory, spill_directory, num_chunks, shard, impact_ordered, collection_stats)
+                                                  for shard in range(num_shards)])
+    finally:
+        shutil.rmtree(spill_directory, ignore_errors=True)
+
+    manifest={"num_shards": num_shards, "num_docs": num_docs, "impact_ordered": impact_ordered,
+              "global_weights": global_weights, "shards": []}
+    for shard, shard_docs in enumerate(shard_num_docs):
+        manifest["shards"].append({"name": shard_name(shard), "num_docs": shard_docs})
+    write_atomic(os.path.join(directory, SHARD_MANIFEST), json.dumps(manifest, indent=4).encode("utf-8"))
+    logger.info("{} docs indexed into {} shards. Time: {}".format(num_docs, num_shards, datetime.datetime.now()-start_time))
+    return manifest
+
+def read_manifest(directory):
+    with open(os.path.join(directory, SHARD_MANIFEST), 'r') as file:
+        return json.load(file)
+
+def init_shard_worker(directory):
+    WORKER["directory"]=directory
+    WORKER["manifest"]=read_manifest(directory)
+    WORKER["shards"]={}
+
+def shard_index(shard):
+    shards=WORKER["shards"]
+    if shard not in shards:
+        shards[shard]=open_index(os.path.join(WORKER["directory"], shard_name(shard)+".bin"))
+    return shards[shard]
+
+def search_shard(shard, kind, query_list, k=RESULTS_PER_QUERY, stats=None):
+    '''
+    Evaluates a batch of queries on one shard in a worker process.
+    Returns per query the sorted array of matching shard doc ids, or for kind "ranked" the top k as
+    (array of scores, array of shard doc ids) best first. Boolean batches evaluate #... queries as proximity
+    queries, like batch_boolean_search. stats (a StatsSnapshot) rescores against collection statistics.
+    '''
+    index=shard_index(shard)
+    if kind=="ranked":
+        analyzed=[get_analyzer().analyze(query) for query in query_list]
+        batch_index=BatchIndex(index, (term for query_terms in analyzed for term in query_terms))
+        if stats is not None:
+            batch_index=GlobalStatsIndex(batch_index, stats)
+        scorer=score_top_k_impact if WORKER["manifest"]["impact_ordered"] else score_top_k
+        results=[]
+        for query_terms in analyzed:
+            ranked=rank_query(query_terms, batch_index, k, scorer)
+            results.append((array('d', [score for score, _ in ranked]), array('I', [doc for _, doc in ranked])))
+        return results
+    #postings fetched once for the batch
+    batch_index=BatchIndex(index)
+    results=[]
+    for query in query_list:
+        if kind=="phrase":
+            doc_ids=phrase_doc_ids(query, batch_index)
+        elif kind=="proximity" or '#' in query:
+            doc_ids=proximity_doc_ids(query, batch_index, batch_index.entries)
+        else:
+            doc_ids=boolean_doc_ids(query, batch_index)
+        results.append(array('I', doc_ids))
+    return results
+
+class ShardedIndex:
+    '''
+    Coordinator of a sharded index directory. workers=0 evaluates the shards one after the other in this
+    process instead of on a process pool.
+    '''
+    def __init__(self, directory, workers=None):
+        self.directory=directory
+        self.manifest=read_manifest(directory)
+        self.num_shards=self.manifest["num_shards"]
+        shard_files=[open_index(os.path.join(directory, shard_name(shard)+".bin")) for shard in range(self.num_shards)]
+        self.docnos=[shard_file["__docnos__"] for shard_file in shard_files]
+        if self.manifest.get("global_weights", True):
+            self.stats=None
+            for shard_file in shard_files:
+                shard_file.close()
+        else:
+            #doc freqs are read from the shards' dictionaries, no postings get decoded here
+            self.stats=CorpusStatistics(shard_files)
+        if workers==0:
+            self.pool=None
+            init_shard_worker(directory)
+        else:
+            self.pool=ProcessPoolExecutor(max_workers=workers or self.num_shards, initializer=init_shard_worker, initargs=(directory,))
+
+    def scatter(self, kind, query_list, k=RESULTS_PER_QUERY):
+        #one task per shard for the whole batch, results per shard in shard order
+        stats=None
+        if kind=="ranked" and self.stats is not None:
+            analyzer=get_analyzer()
+            stats=self.stats.snapshot(term for query in query_list for term in analyzer.analyze(query))
+        if self.pool is None:
+            return [search_shard(shard, kind, query_list, k, stats) for shard in range(self.num_shards)]
+        futures=[self.pool.submit(search_shard, shard, kind, query_list, k, stats) for shard in range(self.num_shards)]
+        return [future.result() for future in futures]
+
+    def docno(self, doc_id):
+        #DOCNO of a global doc id
+        return self.docnos[doc_id%self.num_shards][doc_id//self.num_shards]
+
+    def search(self, kind, query_list):
+        '''
+        Boolean ("boolean", #... queries as proximity), phrase or proximity queries as one batch.
+        Returns {query number: DOCNOs} in doc order, query numbers counting from 1; proximity DOCNOs come back
+        sorted as ints like proximity_search returns them.
+        '''
+        with span("sharded_search"):
+            shard_results=self.scatter(kind, query_list)
+        num_shards=self.num_shards
+        res=OrderedDict()
+        for q, query in enumerate(query_list):
+            doc_ids=sorted(itertools.chain.from_iterable(
+                (global_doc_id(doc, shard, num_shards) for doc in results[q]) for shard, results in enumerate(shard_results)))
+            docnos=[self.docno(doc_id) for doc_id in doc_ids]
+            if kind=="proximity" or (kind=="boolean" and '#' in query):
+                docnos=sorted(int(docno) for docno in docnos)
+            res[q+1]=docnos
+        return res
+
+    def boolean_search(self, query_list):
+        return self.search("boolean", query_list)
+
+    def phrase_search(self, query_list):
+        return self.search("phrase", query_list)
+
+    def proximity_search(self, query_list):
+        return self.search("proximity", query_list)
+
+    def ranked_retrieval(self, query_list, k=RESULTS_PER_QUERY):
+        '''
+        Top k docs of every query over all shards. Returns {query number: [(DOCNO, score)]} best first,
+        like ranked_retrieval on the unsharded index. k=None keeps every matching doc.
+        '''
+        with span("sharded_ranked_retrieval"):
+            shard_results=self.scatter("ranked", query_list, k)
+        num_shards=self.num_shards
+        res=OrderedDict()
+        for q in range(len(query_list)):
+            #every shard's list is best first with ties on ascending doc id, which is ascending global doc id too
+            shard_lists=[[(score, global_doc_id(doc, shard, num_shards)) for score, doc in zip(*results[q])]
+                         for shard, results in enumerate(shard_results)]
+            merged=heapq.merge(*shard_lists, key=lambda result: (-result[0], result[1]))
+            if k is not None:
+                merged=itertools.islice(merged, k)
+            res[q+1]=[(self.docno(doc_id), score) for score, doc_id in merged]
+        return res
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.stats is not None:
+            for shard_file in self.stats.indexes:
+                shard_file.close()
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Build and query a sharded index")
+    parser.add_argument("--directory", default="data/shards")
+    parser.add_argument("--build", default=None, help="XML collection to index first")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=None, help="query worker processes, defaults to the number of shards")
+    args=parser.parse_args()
+
+    if args.build is not None:
+        build_sharded_index(args.build, args.directory, args.shards)
+    sharded_index=ShardedIndex(args.directory, args.workers)
+    try:
+        write_boolean_results(sharded_index.boolean_search(read_query_file("data/test_set/queries.boolean.txt")), "data/test_set/result/results.boolean.txt")
+        logger.info("Boolean results written")
+        write_ranked_results(sharded_index.ranked_retrieval(read_query_file("data/test_set/queries.ranked.txt")), "data/test_set/result/results.ranked.txt", RESULT_DIGITS)
+        logger.info("Ranked results written")
+    finally:
+        sharded_index.close()
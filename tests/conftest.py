@@ -0,0 +1,93 @@
+import os
+import sys
+import copy
+import random
+from xml.sax.saxutils import escape
+
+import pytest
+
+# Add the repository root, where the modules live, to the Python path (wants absolute paths)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+'''
+Shared fixtures: a small synthetic collection and a working directory with the stop list the analyzer reads.
+'''
+
+#a few frequent words give postings lists long enough for the NumPy codec paths
+WORDS=("market", "oil", "price", "tax", "income", "bank", "dollar", "stock", "trade", "energy", "vote", "party",
+       "labour", "election", "growth", "profit", "pound", "europe", "israel", "glasgow", "scotland", "street",
+       "wall", "dow", "jones", "policy", "company", "shares", "loss", "rate")
+STOP_WORDS=("the", "and", "of", "a", "in", "to", "on", "for")
+NUM_DOCS=400
+SEED=7
+
+
+def random_words(rand, count):
+    #Zipf like: the first words of WORDS are by far the most frequent
+    return rand.choices(WORDS+STOP_WORDS, weights=[1/(rank+1) for rank in range(len(WORDS))]+[0.2]*len(STOP_WORDS), k=count)
+
+def make_docs(num_docs=NUM_DOCS, seed=SEED):
+    '''
+    Raw documents {"id": DOCNO, "headline": text, "text": text} as iter_xml yields them.
+    '''
+    rand=random.Random(seed)
+    return [{"id": str(1000+i),
+             "headline": " ".join(random_words(rand, rand.randint(2, 6))),
+             "text": " ".join(random_words(rand, rand.randint(5, 60)))}
+            for i in range(num_docs)]
+
+def write_collection(path, docs):
+    #TREC style XML, as the collections under data/ are laid out
+    with open(path, 'w') as file:
+        file.write("<document>\n")
+        for doc in docs:
+            file.write("<DOC>\n<DOCNO> {} </DOCNO>\n<HEADLINE>\n{}\n</HEADLINE>\n<TEXT>\n{}\n</TEXT>\n</DOC>\n".format(
+                escape(doc["id"]), escape(doc["headline"]), escape(doc["text"])))
+        file.write("</document>\n")
+
+@pytest.fixture
+def docs():
+    return make_docs()
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    '''
+    Runs a test in tmp_path with data/english_stop_list.txt in place, the relative path the analyzer reads.
+    '''
+    os.makedirs(tmp_path/"data")
+    with open(tmp_path/"data"/"english_stop_list.txt", 'w') as file:
+        file.write("\n".join(STOP_WORDS))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def collection(workdir, docs):
+    '''
+    Path of the docs fixture written as an XML collection in the working directory.
+    '''
+    path=str(workdir/"data"/"collection.xml")
+    write_collection(path, docs)
+    return path
+
+@pytest.fixture
+def analyzed_docs(workdir, docs):
+    '''
+    The docs fixture after the analyzer, as build_index gets them: headline and text as lists of terms.
+    '''
+    from indexing import get_analyzer
+    analyzer=get_analyzer()
+    return [{"id": doc["id"], "headline": analyzer.analyze(doc["headline"]), "text": analyzer.analyze(doc["text"])}
+            for doc in docs]
+
+@pytest.fixture
+def index(workdir, analyzed_docs):
+    '''
+    The analyzed docs written as a binary index and opened memory mapped.
+    '''
+    from indexing import build_index
+    from index_store import write_binary_index, open_index
+    path=str(workdir/"index.bin")
+    write_binary_index(*build_index(copy.deepcopy(analyzed_docs)), path)
+    mapped_index=open_index(path)
+    yield mapped_index
+    mapped_index.close()
@@ -0,0 +1,69 @@
+import os
+
+from batch_search import BatchIndex, batch_boolean_search, batch_ranked_search, read_query_file, run_query_files
+from search import boolean_doc_ids, proximity_doc_ids
+from ranked_retrieval import ranked_retrieval
+from postings import to_docnos
+from scoring import RESULTS_PER_QUERY, RESULT_DIGITS
+
+BOOLEAN_QUERIES=["market and oil", "tax or not bank", '"oil price" and not dollar', "#5(oil,price)", "#od2(income,tax)",
+                 "nosuchterm"]
+RANKED_QUERIES=["income tax", "the price of oil on the market", "glasgow and scotland", "nosuchterm"]
+
+
+class CountingIndex:
+    #counts the postings lists fetched from the index behind it
+    def __init__(self, index):
+        self.index=index
+        self.generation=index.generation
+        self.fetched=[]
+
+    def get(self, term, default=None):
+        self.fetched.append(term)
+        return self.index.get(term, default)
+
+    def __getitem__(self, term):
+        return self.index[term]
+
+def write_query_file(path, queries):
+    with open(path, 'w') as file:
+        for q_num, query in enumerate(queries, 1):
+            file.write("{} {}\n".format(q_num, query))
+
+def test_batch_index_fetches_every_term_once(index):
+    counting=CountingIndex(index)
+    batch_index=BatchIndex(counting, ["oil", "price", "oil", "nosuchterm"])
+    assert batch_index["oil"] is index["oil"]
+    assert "nosuchterm" not in batch_index and batch_index.doc_freq("nosuchterm")==0
+    batch_index.get("price")
+    batch_index.get("market")
+    assert counting.fetched==["oil", "price", "nosuchterm", "market"]
+    assert batch_index.lookups==5
+
+def test_batch_boolean_search_matches_single_queries(index):
+    expected={}
+    for q_num, query in enumerate(BOOLEAN_QUERIES, 1):
+        if '#' in query:
+            expected[q_num]=sorted(int(docno) for docno in to_docnos(proximity_doc_ids(query, index), index))
+        else:
+            expected[q_num]=to_docnos(boolean_doc_ids(query, index), index)
+    assert dict(batch_boolean_search(BOOLEAN_QUERIES, index))==expected
+
+def test_batch_ranked_search_matches_ranked_retrieval(index):
+    for k in (1, 10, None):
+        assert batch_ranked_search(RANKED_QUERIES, index, k)==ranked_retrieval(RANKED_QUERIES, index, k)
+
+def test_run_query_files_writes_the_results_files(workdir, index):
+    write_query_file("data/queries.boolean.txt", BOOLEAN_QUERIES)
+    write_query_file("data/queries.ranked.txt", RANKED_QUERIES)
+    assert read_query_file("data/queries.ranked.txt")==RANKED_QUERIES
+    run_query_files(index, "data/queries.boolean.txt", "data/queries.ranked.txt", "data")
+
+    with open(os.path.join("data", "results.boolean.txt"), 'r') as file:
+        assert file.read()=="".join("{},{}\n".format(q_num, docno)
+                                    for q_num, docnos in batch_boolean_search(BOOLEAN_QUERIES, index).items() for docno in docnos)
+    #the top RESULTS_PER_QUERY with rounded scores, like the ranked_retrieval entry point
+    with open(os.path.join("data", "results.ranked.txt"), 'r') as file:
+        assert file.read()=="".join("{},{},{}\n".format(q_num, docno, round(score, RESULT_DIGITS))
+                                    for q_num, ranked in ranked_retrieval(RANKED_QUERIES, index, RESULTS_PER_QUERY).items()
+                                    for docno, score in ranked)
@@ -0,0 +1,91 @@
+import copy
+
+import pytest
+
+from corpus_stats import CorpusStatistics, GlobalStatsIndex, StatsSnapshot, federated_ranked_retrieval
+from indexing import build_index, get_analyzer
+from index_store import write_binary_index, open_index, load_index
+from segments import SegmentedIndex
+from ranked_retrieval import ranked_retrieval, rank_query, score_top_k_impact
+from query_planner import term_doc_freq
+from test_batch_search import RANKED_QUERIES
+
+#consecutive parts of the collection, of different sizes
+SPLITS=[0, 90, 250]
+
+
+def write_part(workdir, name, analyzed_docs, impact_ordered=False):
+    path=str(workdir/(name+".bin"))
+    write_binary_index(*build_index(copy.deepcopy(analyzed_docs)), path, impact_ordered)
+    return path
+
+@pytest.fixture
+def parts(workdir, docs, analyzed_docs):
+    '''
+    The collection split over a MappedIndex, a loaded dict and a SegmentedIndex, in collection order.
+    '''
+    first=open_index(write_part(workdir, "part_0", analyzed_docs[SPLITS[0]:SPLITS[1]]))
+    second=load_index(write_part(workdir, "part_1", analyzed_docs[SPLITS[1]:SPLITS[2]]))
+    third=SegmentedIndex(str(workdir/"segments"), flush_docs=50)
+    third.add_documents(copy.deepcopy(docs[SPLITS[2]:]))
+    yield [first, second, third]
+    first.close()
+    third.close()
+
+def test_statistics_add_up_over_the_parts(parts, index):
+    stats=CorpusStatistics(parts, cache_size=3)
+    assert stats.num_docs==len(index["__all_docs__"])
+    terms=["oil", "price", "market", "tax", "nosuchterm"]
+    assert stats.doc_freqs(terms+["oil"])=={term: term_doc_freq(index, term) for term in terms}
+    assert stats.misses==len(terms) and len(stats.cache)==3
+    stats.doc_freq("nosuchterm")
+    assert stats.hits==1
+
+def test_changed_part_drops_the_statistics(parts):
+    stats=CorpusStatistics(parts)
+    num_docs=stats.num_docs
+    doc_freq=stats.doc_freq("oil")
+    parts[2].add_document({"id": "new", "headline": "oil", "text": "oil price"})
+    assert stats.num_docs==num_docs+1
+    assert stats.doc_freq("oil")==doc_freq+1
+
+    #a term dropped from the loaded dict is a new generation too
+    part_doc_freq=parts[1]["oil"]["doc_freq"]
+    del parts[1]["oil"]
+    assert stats.doc_freq("oil")==doc_freq+1-part_doc_freq
+
+def test_global_stats_weights_are_the_ones_of_the_whole_index(parts, index):
+    stats=CorpusStatistics(parts)
+    for part in parts:
+        view=GlobalStatsIndex(part, stats)
+        docnos=view["__docnos__"]
+        for term in ("oil", "market", "tax"):
+            whole=index[term]
+            expected={index["__docnos__"][doc]: weight for doc, weight in zip(whole["doc_ids"], whole["weights"])}
+            entry=view[term]
+            assert entry["idf"]==whole["idf"]
+            assert {docnos[doc]: weight for doc, weight in zip(entry["doc_ids"], entry["weights"])}=={
+                docno: expected[docno] for docno in (docnos[doc] for doc in entry["doc_ids"])}
+            assert entry["max_score"]==max(entry["weights"])
+        assert "nosuchterm" not in view and view.doc_freq("oil")==term_doc_freq(part, "oil")
+
+@pytest.mark.parametrize("k", [1, 10, None])
+def test_federated_ranking_matches_the_whole_index(parts, index, k):
+    assert federated_ranked_retrieval(RANKED_QUERIES, parts, k)==ranked_retrieval(RANKED_QUERIES, index, k)
+
+def test_federated_impact_ranking_matches_the_whole_index(workdir, analyzed_docs, index):
+    parts=[open_index(write_part(workdir, "impact_{}".format(i), analyzed_docs[start:end], impact_ordered=True))
+           for i, (start, end) in enumerate(zip(SPLITS, SPLITS[1:]+[None]))]
+    try:
+        stats=CorpusStatistics(parts)
+        assert federated_ranked_retrieval(RANKED_QUERIES, parts, 10, stats, impact_ordered=True)==ranked_retrieval(RANKED_QUERIES, index, 10)
+        #a snapshot of the query terms serves the views like the statistics it was taken from
+        query_terms=get_analyzer().analyze(RANKED_QUERIES[0])
+        snapshot=stats.snapshot(query_terms)
+        assert isinstance(snapshot, StatsSnapshot) and snapshot.generation!=stats.generation
+        for part in parts:
+            assert rank_query(query_terms, GlobalStatsIndex(part, snapshot), 10, score_top_k_impact)==rank_query(
+                query_terms, GlobalStatsIndex(part, stats), 10, score_top_k_impact)
+    finally:
+        for part in parts:
+            part.close()
@@ -0,0 +1,73 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+import Stemmer
+
+from indexing import iter_xml, read_xml, StemCache, preprocessor, create_inverted_index, parallel_create_inverted_index
+from index_store import INDEX_PATH
+from conftest import write_collection
+
+
+def test_iter_xml_yields_the_docs_in_order(collection, docs):
+    streamed=iter_xml(collection)
+    assert next(streamed)==docs[0]
+    assert list(streamed)==docs[1:]
+    assert read_xml(collection)==docs
+
+def test_iter_xml_streams_before_the_end_of_the_file(workdir, docs):
+    #docs are handed out as they are parsed, a broken tail only fails once the stream reaches it
+    path=str(workdir/"broken.xml")
+    write_collection(path, docs[:3])
+    with open(path, 'r') as file:
+        text=file.read()
+    with open(path, 'w') as file:
+        file.write(text.replace("</document>", "<DOC><DOCNO>broken</DOC>"))
+    streamed=iter_xml(path)
+    assert [next(streamed) for _ in range(3)]==docs[:3]
+    with pytest.raises(ET.ParseError):
+        next(streamed)
+
+class CountingStemmer:
+    #stands in for a PyStemmer stemmer, counts the words that reach it
+    def __init__(self):
+        self.calls=0
+
+    def stemWord(self, word):
+        self.calls+=1
+        return word.rstrip("s")
+
+def test_stem_cache_stems_like_the_stemmer():
+    stemmer=Stemmer.Stemmer("porter")
+    words="markets prices rising taxes taxation markets rising".split()
+    assert StemCache(stemmer).stem(words)==stemmer.stemWords(words)
+
+def test_stem_cache_only_stems_misses():
+    stemmer=CountingStemmer()
+    cache=StemCache(stemmer)
+    assert cache.stem(["taxes", "markets", "taxes", "taxes"])==["taxe", "market", "taxe", "taxe"]
+    assert stemmer.calls==2
+    assert cache.stats()=={"size": 2, "maxsize": cache.maxsize, "hits": 2, "misses": 2, "hit_rate": 0.5}
+    cache.clear()
+    assert cache.stats()["size"]==0 and cache.stats()["hits"]==0
+
+def test_stem_cache_evicts_the_least_recently_used_word():
+    stemmer=CountingStemmer()
+    cache=StemCache(stemmer, maxsize=2)
+    cache.stem(["oils", "banks"])
+    #a hit makes oils the most recently used, the next miss evicts banks
+    cache.stem(["oils", "prices"])
+    assert list(cache.cache)==["oils", "prices"]
+    cache.stem(["banks"])
+    assert stemmer.calls==4
+
+@pytest.mark.parametrize("chunk_size", [7, 500])
+def test_parallel_build_matches_the_serial_build(collection, workdir, chunk_size):
+    os.makedirs(workdir/"data"/"test_set"/"result")
+    serial_index=create_inverted_index(preprocessor(collection))
+    with open(INDEX_PATH, 'rb') as file:
+        serial_file=file.read()
+    parallel_index=parallel_create_inverted_index(collection, processes=2, chunk_size=chunk_size)
+    assert parallel_index==serial_index
+    with open(INDEX_PATH, 'rb') as file:
+        assert file.read()==serial_file
@@ -0,0 +1,55 @@
+import time
+
+from segments import SegmentedIndex
+from merge_scheduler import MergeScheduler, TieredMergePolicy
+from search import boolean_doc_ids
+from test_segments import add_delete_replace, fresh_build, assert_same_index
+
+
+def test_policy_merges_a_full_tier():
+    policy=TieredMergePolicy(merge_factor=3, floor_docs=10)
+    assert policy.find_merge([(10, 10), (8, 10)]) is None
+    assert policy.find_merge([(500, 500), (10, 10), (9, 10), (10, 10)])==[1, 2, 3]
+
+def test_policy_rewrites_a_segment_with_many_deletes():
+    policy=TieredMergePolicy(merge_factor=3, floor_docs=10, deletes_pct=30)
+    assert policy.find_merge([(500, 500), (6, 10)])==[1]
+    assert policy.find_merge([(500, 500), (8, 10)]) is None
+
+def test_merged_segments_match_a_fresh_build(workdir, docs):
+    index=SegmentedIndex(str(workdir/"segments"), flush_docs=25)
+    try:
+        live_docs=add_delete_replace(index, docs)
+        index.flush()
+        num_segments=len(index.segments)
+        before_merge=index.snapshot()
+        market=list(boolean_doc_ids("market", before_merge))
+
+        scheduler=MergeScheduler(index, TieredMergePolicy(merge_factor=3, floor_docs=20, deletes_pct=10))
+        while scheduler.maybe_merge():
+            pass
+        assert scheduler.merges>0
+        assert len(index.segments)<num_segments
+        assert_same_index(index.snapshot(), fresh_build(workdir, live_docs))
+        #a snapshot taken before the merges still reads the segments it started with
+        assert list(boolean_doc_ids("market", before_merge))==market
+    finally:
+        index.close()
+
+def test_scheduler_thread_merges_after_flushes(workdir, docs):
+    index=SegmentedIndex(str(workdir/"segments"), flush_docs=10)
+    scheduler=MergeScheduler(index, TieredMergePolicy(merge_factor=3, floor_docs=10), interval=0.05)
+    scheduler.start()
+    try:
+        index.add_documents([dict(doc) for doc in docs[:120]])
+        index.flush()
+        deadline=time.monotonic()+10
+        while len(index.segments)>3 and time.monotonic()<deadline:
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    try:
+        assert scheduler.merges>0
+        assert_same_index(index.snapshot(), fresh_build(workdir, docs[:120]))
+    finally:
+        index.close()
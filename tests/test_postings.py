@@ -0,0 +1,52 @@
+import random
+from array import array
+
+import pytest
+
+from postings import gallop, intersect, union, difference, Complement, boolean_and, boolean_or, boolean_not, resolve
+
+ALL_DOCS=range(200)
+
+
+def random_doc_ids(rand, size):
+    return array('I', sorted(rand.sample(ALL_DOCS, size)))
+
+def as_set(operand):
+    #the docs an operator result stands for, a Complement is every doc of ALL_DOCS it does not hold
+    if isinstance(operand, Complement):
+        return set(ALL_DOCS)-set(operand.doc_ids)
+    return set(operand)
+
+@pytest.fixture(params=range(20))
+def lists(request):
+    rand=random.Random(request.param)
+    return random_doc_ids(rand, rand.randint(0, 60)), random_doc_ids(rand, rand.randint(0, 150))
+
+def test_gallop_finds_the_first_doc_at_or_after_target():
+    doc_ids=array('I', [2, 3, 5, 8, 13, 21, 34, 55])
+    for lo in range(len(doc_ids)):
+        for target in range(60):
+            expected=next((i for i in range(lo, len(doc_ids)) if doc_ids[i]>=target), len(doc_ids))
+            assert gallop(doc_ids, target, lo)==expected
+
+def test_merges_match_set_algebra(lists):
+    left, right=lists
+    for merged, expected in ((intersect(left, right), set(left)&set(right)),
+                             (union(left, right), set(left)|set(right)),
+                             (difference(left, right), set(left)-set(right))):
+        assert isinstance(merged, array)
+        assert list(merged)==sorted(expected)
+
+def test_not_stays_lazy_through_and_and_or(lists):
+    left, right=lists
+    operands=[left, right, boolean_not(left), boolean_not(right)]
+    for a in operands:
+        for b in operands:
+            assert as_set(boolean_and(a, b))==as_set(a)&as_set(b)
+            assert as_set(boolean_or(a, b))==as_set(a)|as_set(b)
+    assert boolean_not(boolean_not(left)) is left
+
+def test_resolve_walks_the_collection_only_for_a_complement(lists):
+    left, _=lists
+    assert resolve(left, ALL_DOCS) is left
+    assert list(resolve(boolean_not(left), ALL_DOCS))==sorted(set(ALL_DOCS)-set(left))
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from postings_codecs import CODECS, CODEC_NAMES, CODEC_MIN_LENGTH, PFOR_BLOCK, encode_postings
+
+#short lists take the pure Python paths, the others NumPy's; block sized lists hit the PForDelta block edges
+LENGTHS=[1, 2, 7, CODEC_MIN_LENGTH-1, CODEC_MIN_LENGTH, PFOR_BLOCK+1, 3*PFOR_BLOCK, 2500]
+#average gap between doc ids: one byte varbyte gaps, multi byte gaps, and huge gaps that make PForDelta exceptions
+GAPS=[1, 20, 300, 100000]
+
+
+def random_doc_ids(rand, length, gap):
+    doc_ids=[]
+    doc_id=rand.randint(0, gap)
+    for _ in range(length):
+        doc_ids.append(doc_id)
+        doc_id+=rand.randint(1, 2*gap)
+    return doc_ids
+
+def random_positions(rand, length):
+    #mostly short position lists, now and then a long one or a far away position
+    positions=[]
+    for _ in range(length):
+        tf=rand.choice([1, 1, 1, 2, 3, 5, 200])
+        positions.append(sorted(rand.sample(range(1, rand.choice([300, 70000])), tf)))
+    return positions
+
+@pytest.mark.parametrize("gap", GAPS)
+@pytest.mark.parametrize("length", LENGTHS)
+@pytest.mark.parametrize("codec", list(CODECS.values()), ids=lambda codec: codec.name)
+def test_doc_ids_round_trip(codec, length, gap):
+    doc_ids=random_doc_ids(random.Random(length*gap), length, gap)
+    out=bytearray()
+    codec.encode_doc_ids(doc_ids, out)
+    assert list(codec.decode_doc_ids(memoryview(bytes(out)), length))==doc_ids
+
+@pytest.mark.parametrize("length", LENGTHS)
+@pytest.mark.parametrize("codec", [codec for codec in CODECS.values() if codec.positions], ids=lambda codec: codec.name)
+def test_positions_round_trip(codec, length):
+    positions=random_positions(random.Random(length), length)
+    out=bytearray()
+    codec.encode_positions(positions, out)
+    assert [list(doc_positions) for doc_positions in codec.decode_positions(memoryview(bytes(out)), length)]==positions
+
+@pytest.mark.parametrize("length", LENGTHS)
+@pytest.mark.parametrize("codec", [None]+sorted(CODEC_NAMES))
+def test_encode_postings_round_trip(codec, length):
+    rand=random.Random(length)
+    doc_ids=random_doc_ids(rand, length, rand.choice(GAPS))
+    positions=random_positions(rand, length)
+    doc_codec, doc_block, position_codec, position_block=encode_postings(doc_ids, positions, codec)
+    if codec is not None and length>=CODEC_MIN_LENGTH:
+        assert doc_codec is CODEC_NAMES[codec]
+    #the term info keeps only the codec ids, decoding goes through the registry
+    assert list(CODECS[doc_codec.codec_id].decode_doc_ids(memoryview(bytes(doc_block)), length))==doc_ids
+    decoded=CODECS[position_codec.codec_id].decode_positions(memoryview(bytes(position_block)), length)
+    assert [list(doc_positions) for doc_positions in decoded]==positions
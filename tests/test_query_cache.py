@@ -0,0 +1,76 @@
+import gc
+import pickle
+from array import array
+
+import pytest
+
+from index_store import load_index, VersionedIndex
+from query_cache import QueryCache, index_generation, size_of
+from search import boolean_doc_ids
+
+
+@pytest.fixture
+def loaded(index, workdir):
+    return load_index(str(workdir/"index.bin"))
+
+def test_cached_result_is_served_until_the_index_changes(loaded):
+    cache=QueryCache()
+    expected=boolean_doc_ids("oil and not price", loaded)
+    assert boolean_doc_ids("oil and not price", loaded, cache)==expected
+    misses=cache.misses
+    assert boolean_doc_ids("OIL AND NOT the price", loaded, cache)==expected
+    assert cache.misses==misses and cache.hits>0
+
+    #a term replaced in place is a new generation, the cached result is dropped
+    loaded["oil"]=loaded["market"]
+    assert boolean_doc_ids("oil and not price", loaded, cache)==boolean_doc_ids("market and not price", loaded)
+    assert cache.invalidations==1
+
+def test_changed_entry_needs_changed(loaded):
+    generation=index_generation(loaded)
+    loaded["oil"]["doc_ids"]=array('I')
+    assert index_generation(loaded)==generation
+    loaded.changed()
+    assert index_generation(loaded)!=generation
+
+def test_every_loaded_index_is_a_new_generation(index, workdir):
+    seen=set()
+    for _ in range(5):
+        #a collected index can leave its address to the next one, its generation is never reused
+        seen.add(index_generation(load_index(str(workdir/"index.bin"))))
+        gc.collect()
+    assert len(seen)==5
+
+def test_mutations_start_a_new_generation():
+    index=VersionedIndex({"__all_docs__": range(0), "__docnos__": []})
+    seen={index.generation}
+    for mutate in (lambda: index.update(a=1), lambda: index.setdefault("b", 2), lambda: index.pop("a"),
+                   lambda: index.popitem(), lambda: index.__delitem__("__docnos__"), lambda: index.clear()):
+        mutate()
+        seen.add(index.generation)
+    assert len(seen)==7
+
+def test_pickled_index_keeps_its_generation(loaded):
+    copy=pickle.loads(pickle.dumps(loaded))
+    assert copy.generation==loaded.generation and list(copy)==list(loaded)
+
+def test_plain_dict_has_no_generation():
+    with pytest.raises(TypeError):
+        QueryCache().get(("boolean", ("oil",)), {"__all_docs__": range(0), "__docnos__": []})
+
+def test_bytes_bound_evicts_least_recently_used(loaded):
+    value=array('I', range(100))
+    entry_size=size_of(("k", 1))+size_of(value)
+    cache=QueryCache(max_bytes=2*entry_size)
+    cache.put(("k", 1), value, loaded)
+    cache.put(("k", 2), value, loaded)
+    assert cache.get(("k", 1), loaded) is value
+    cache.put(("k", 3), value, loaded)
+    assert cache.get(("k", 2), loaded) is None
+    assert cache.get(("k", 1), loaded) is value
+    stats=cache.stats()
+    assert stats["size"]==2 and stats["evictions"]==1 and stats["bytes"]<=stats["max_bytes"]
+
+    #a result larger than the whole cache is returned without evicting anything
+    assert cache.put(("big",), array('I', range(10_000)), loaded) is not None
+    assert cache.stats()["size"]==2
@@ -0,0 +1,50 @@
+import pytest
+
+from query_planner import parse_query, plan_query
+from search import analyze_boolean_query, boolean_doc_ids
+
+QUERIES=["market", "oil and price", "oil price", "oil or tax and bank", "not market", "tax and not oil",
+         "not oil and not price", "glasgow or not scotland and dow", "not not market", '"oil price" and not bank',
+         "bank and nosuchterm", "nosuchterm or dollar", "not nosuchterm"]
+
+
+def doc_words(analyzed_doc):
+    return analyzed_doc["headline"]+analyzed_doc["text"]
+
+def naive_docs(node, analyzed_docs):
+    #set evaluation of an unplanned AST, straight from the docs' words
+    op=node["op"]
+    if op=="term":
+        return {doc_id for doc_id, doc in enumerate(analyzed_docs) if node["term"] in doc_words(doc)}
+    if op=="phrase":
+        words=node["phrase"].split()
+        return {doc_id for doc_id, doc in enumerate(analyzed_docs)
+                if any(doc_words(doc)[i:i+len(words)]==words for i in range(len(doc_words(doc))))}
+    if op=="not":
+        return set(range(len(analyzed_docs)))-naive_docs(node["child"], analyzed_docs)
+    results=[naive_docs(child, analyzed_docs) for child in node["children"]]
+    return set.intersection(*results) if op=="and" else set.union(*results)
+
+def test_parse_query_precedence():
+    assert parse_query(["a", "or", "b", "and", "not", "c"])=={"op": "or", "children": [
+        {"op": "term", "term": "a"},
+        {"op": "and", "children": [{"op": "term", "term": "b"}, {"op": "not", "child": {"op": "term", "term": "c"}}]}]}
+    #operands next to each other are an AND
+    assert parse_query(["a", "b"])==parse_query(["a", "and", "b"])
+    with pytest.raises(ValueError):
+        parse_query(["a", "and"])
+    with pytest.raises(ValueError):
+        parse_query(["or", "a"])
+
+def test_plan_orders_by_doc_freq_and_rewrites_and_not(index):
+    plan=plan_query(parse_query(["market", "and", "glasgow", "and", "not", "oil"]), index)
+    assert plan["op"]=="diff"
+    assert [child["term"] for child in plan["minus"]]==["oil"]
+    costs=[child["cost"] for child in plan["base"]["children"]]
+    assert costs==sorted(costs)
+    assert costs==sorted([index.doc_freq("market"), index.doc_freq("glasgow")])
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_planned_query_matches_set_evaluation(index, analyzed_docs, query):
+    expected=naive_docs(parse_query(analyze_boolean_query(query)), analyzed_docs)
+    assert list(boolean_doc_ids(query, index))==sorted(expected)
@@ -0,0 +1,49 @@
+import pytest
+
+from indexing import build_index
+from index_store import write_binary_index, open_index, load_index
+from ranked_retrieval import score_top_k, score_top_k_impact
+from conftest import WORDS
+
+QUERIES=[["market"], ["oil", "price"], ["tax", "income", "tax"], ["rate", "loss", "shares"],
+         ["market", "oil", "price", "tax", "income", "bank"], ["scotland", "nosuchterm"], ["nosuchterm"],
+         list(WORDS)]
+
+
+def exhaustive_top_k(query_terms, index, k):
+    #scores every doc of every query term's list, adding the weights up in query term order
+    scores={}
+    for term in query_terms:
+        if term not in index:
+            continue
+        entry=index[term]
+        for doc, weight in zip(entry["doc_ids"], entry["weights"]):
+            scores[doc]=scores.get(doc, 0.0)+weight
+    ranked=sorted(((score, doc) for doc, score in scores.items()), key=lambda result: (-result[0], result[1]))
+    return ranked if k is None else ranked[:k]
+
+@pytest.fixture
+def index_path(tmp_path, docs):
+    #the words are used as they are, no analyzer involved
+    index, all_docs=build_index([{"id": doc["id"], "headline": doc["headline"].split(), "text": doc["text"].split()}
+                                 for doc in docs])
+    path=str(tmp_path/"index.bin")
+    write_binary_index(index, all_docs, path, impact_ordered=True)
+    return path
+
+@pytest.mark.parametrize("k", [1, 3, 10, 50, None])
+@pytest.mark.parametrize("scorer", [score_top_k, score_top_k_impact])
+def test_pruned_top_k_matches_exhaustive(index_path, scorer, k):
+    mapped_index=open_index(index_path)
+    try:
+        for index in (mapped_index, load_index(index_path)):
+            for query_terms in QUERIES:
+                assert scorer(query_terms, index, k)==exhaustive_top_k(query_terms, index, k), query_terms
+    finally:
+        mapped_index.close()
+
+@pytest.mark.parametrize("scorer", [score_top_k, score_top_k_impact])
+def test_top_k_rejects_k_below_one(index_path, scorer):
+    index=load_index(index_path)
+    with pytest.raises(ValueError):
+        scorer(["market"], index, 0)
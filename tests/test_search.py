@@ -0,0 +1,82 @@
+import random
+import itertools
+from array import array
+
+import pytest
+
+from indexing import get_analyzer
+from postings import phrase_positions, unordered_window, ordered_window
+from search import phrase_matches, phrase_doc_ids, parse_proximity, proximity_doc_ids
+
+PHRASES=["oil price", "market oil", "wall street", "the market", "oil price market", "market market",
+         "tax nosuchterm", "dow jones"]
+
+
+def doc_words(analyzed_doc):
+    return analyzed_doc["headline"]+analyzed_doc["text"]
+
+def naive_phrase_starts(words, terms):
+    #positions count from 1, as build_index numbers them
+    return [i+1 for i in range(len(words)-len(terms)+1) if words[i:i+len(terms)]==terms]
+
+def test_phrase_positions_with_offsets():
+    position_lists=[array('I', [1, 5, 9, 20]), array('I', [2, 6, 15, 21]), array('I', [3, 11, 22])]
+    assert list(phrase_positions(position_lists, [0, 1, 2]))==[1, 20]
+    #a gap in the offsets, as left by a stop word
+    assert list(phrase_positions(position_lists[:1]+position_lists[2:], [0, 2]))==[1, 9, 20]
+    assert list(phrase_positions([array('I', [4]), array('I')], [0, 1]))==[]
+
+def test_phrase_positions_match_a_scan():
+    rand=random.Random(3)
+    for _ in range(200):
+        words=rand.choices("abc", k=rand.randint(1, 40))
+        terms=rand.choices("abc", k=rand.randint(1, 3))
+        position_lists=[array('I', [i+1 for i, word in enumerate(words) if word==term]) for term in terms]
+        assert list(phrase_positions(position_lists, list(range(len(terms)))))==naive_phrase_starts(words, terms)
+
+@pytest.mark.parametrize("phrase", PHRASES)
+def test_phrase_matches_match_a_scan_of_the_docs(index, analyzed_docs, phrase):
+    terms=get_analyzer().analyze(phrase)
+    expected={}
+    for doc_id, doc in enumerate(analyzed_docs):
+        starts=naive_phrase_starts(doc_words(doc), terms)
+        if starts:
+            expected[doc_id]=starts
+    assert {doc: list(starts) for doc, starts in phrase_matches(phrase, index).items()}==expected
+    assert list(phrase_doc_ids(phrase, index))==sorted(expected)
+
+PROXIMITY_QUERIES=["#5(oil,price)", "#1(market,oil)", "#uw3(tax,income)", "#od2(oil,price)", "#od2(price,oil)",
+                   "#10(bank,dollar,stock)", "#od6(market,oil,price)", "#4(tax,nosuchterm)"]
+
+
+def naive_window(position_lists, width, ordered):
+    #tries every choice of one position per list
+    for choice in itertools.product(*position_lists):
+        if ordered and any(a>=b for a, b in zip(choice, choice[1:])):
+            continue
+        if max(choice)-min(choice)<=width:
+            return True
+    return False
+
+def test_windows_match_every_choice_of_positions():
+    rand=random.Random(5)
+    for _ in range(300):
+        position_lists=[array('I', sorted(rand.sample(range(1, 40), rand.randint(0, 5)))) for _ in range(rand.randint(1, 3))]
+        width=rand.randint(0, 8)
+        assert unordered_window(position_lists, width)==naive_window(position_lists, width, False), (position_lists, width)
+        assert ordered_window(position_lists, width)==naive_window(position_lists, width, True), (position_lists, width)
+
+@pytest.mark.parametrize("query", PROXIMITY_QUERIES)
+def test_proximity_matches_a_scan_of_the_docs(index, analyzed_docs, query):
+    width, terms, ordered=parse_proximity(query)
+    expected=[]
+    for doc_id, doc in enumerate(analyzed_docs):
+        words=doc_words(doc)
+        position_lists=[[i+1 for i, word in enumerate(words) if word==term] for term in terms]
+        if naive_window(position_lists, width, ordered):
+            expected.append(doc_id)
+    assert list(proximity_doc_ids(query, index))==expected
+
+def test_proximity_rejects_other_queries(index):
+    with pytest.raises(ValueError):
+        proximity_doc_ids("#x(oil", index)
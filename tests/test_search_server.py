@@ -0,0 +1,112 @@
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import search_server
+from search_server import SearchServer, init_worker, run_query, MAX_REQUEST_LINE, MAX_REQUEST_BODY
+from indexing import get_analyzer
+from postings import to_docnos
+from search import boolean_doc_ids, phrase_doc_ids, proximity_search
+from ranked_retrieval import rank_query
+
+
+@pytest.fixture
+def server(index, workdir):
+    #queries run on a thread of this process instead of the worker processes
+    init_worker(str(workdir/"index.bin"), 1024*1024)
+    http_server=SearchServer(str(workdir/"index.bin"), workers=1)
+    http_server.pool.shutdown()
+    http_server.pool=ThreadPoolExecutor(max_workers=1)
+    yield http_server
+    http_server.close()
+
+def request(server, method, target):
+    return asyncio.run(server.handle_request(method, target))
+
+def exchange(server, data):
+    '''
+    Sends raw bytes to a running server and returns [(status, headers, body)] of every response until it closes.
+    '''
+    async def talk():
+        listener=await server.start("127.0.0.1", 0)
+        port=listener.sockets[0].getsockname()[1]
+        reader, writer=await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        await writer.drain()
+        responses=[]
+        while True:
+            status_line=await reader.readline()
+            if not status_line:
+                break
+            headers={}
+            while True:
+                line=(await reader.readline()).decode("latin-1")
+                if line=="\r\n":
+                    break
+                name, _, value=line.partition(":")
+                headers[name.strip().lower()]=value.strip()
+            body=json.loads(await reader.readexactly(int(headers["content-length"])))
+            responses.append((int(status_line.split()[1]), headers, body))
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return responses
+    return asyncio.run(talk())
+
+def test_run_query_matches_the_search_functions(server, index):
+    assert run_query("boolean", "oil and not price")["documents"]==to_docnos(boolean_doc_ids("oil and not price", index), index)
+    assert run_query("phrase", "market bank")["documents"]==to_docnos(phrase_doc_ids("market bank", index), index)
+    assert run_query("proximity", "#5(oil,price)")["documents"]==proximity_search(["#5(oil,price)"], index)
+    ranked=rank_query(get_analyzer().analyze("oil price market"), index, 5)
+    assert run_query("ranked", "oil price market", 5)["results"]==[
+        {"doc": index["__docnos__"][doc], "score": score} for score, doc in ranked]
+
+def test_handle_request_answers(server, index):
+    status, body=request(server, "GET", "/boolean?q=oil%20and%20price")
+    assert status==200 and body["matches"]==len(body["documents"])
+    status, body=request(server, "GET", "/ranked?q=oil+price&k=3")
+    assert status==200 and len(body["results"])==3
+    assert request(server, "GET", "/health")[0]==200
+    assert request(server, "POST", "/boolean?q=oil")[0]==405
+    assert request(server, "GET", "/nosuchendpoint?q=oil")[0]==404
+    assert request(server, "GET", "/boolean")[0]==400
+    assert request(server, "GET", "/ranked?q=oil&k=ten")[0]==400
+    assert request(server, "GET", "/ranked?q=oil&k=0")[0]==400
+
+def test_handle_request_query_errors(server, monkeypatch):
+    #a malformed query raises ValueError in the worker
+    status, body=request(server, "GET", "/boolean?q=oil%20and")
+    assert status==400 and "operator" in body["error"]
+
+    def broken_query(kind, query, k):
+        raise KeyError(query)
+    monkeypatch.setattr(search_server, "run_query", broken_query)
+    status, body=request(server, "GET", "/boolean?q=oil")
+    assert status==500 and body["error"].startswith("KeyError")
+
+def test_keep_alive_answers_every_request_in_order(server):
+    responses=exchange(server, b"GET /boolean?q=oil HTTP/1.1\r\nHost: x\r\n\r\n"
+                               b"GET /health HTTP/1.1\r\nContent-Length: 4\r\n\r\nbody"
+                               b"GET /boolean?q=price HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert [(status, body.get("query")) for status, _, body in responses]==[(200, "oil"), (200, None), (200, "price")]
+    assert [headers["connection"] for _, headers, _ in responses]==["keep-alive", "keep-alive", "close"]
+
+def test_malformed_request_line(server):
+    responses=exchange(server, b"GET\r\n\r\n")
+    assert [status for status, _, _ in responses]==[400]
+
+@pytest.mark.parametrize("data, status", [
+    (b"GET /boolean?q=" + b"a"*MAX_REQUEST_LINE + b" HTTP/1.1\r\n\r\n", 413),
+    (b"GET /health HTTP/1.1\r\nX-Long: " + b"a"*MAX_REQUEST_LINE + b"\r\n\r\n", 413),
+    (b"GET /health HTTP/1.1\r\nContent-Length: " + str(MAX_REQUEST_BODY+1).encode() + b"\r\n\r\n", 413),
+    (b"GET /health HTTP/1.1\r\nContent-Length: abc\r\n\r\n", 400),
+    (b"GET /health HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400),
+    (b"GET /health HTTP/1.1\r\nContent-Length: +1\r\n\r\nx", 400),
+    ])
+def test_unreadable_request_is_answered_and_closed(server, data, status):
+    #a request that follows on the connection is not answered
+    responses=exchange(server, data+b"GET /health HTTP/1.1\r\n\r\n")
+    assert [(code, headers["connection"]) for code, headers, _ in responses]==[(status, "close")]
+    assert "error" in responses[0][2]
@@ -0,0 +1,82 @@
+import copy
+
+from indexing import index_chunk
+from index_store import write_binary_index, load_index
+from segments import SegmentedIndex
+from ranked_retrieval import score_top_k
+from search import boolean_doc_ids
+
+QUERIES=[["market"], ["oil", "price"], ["tax", "income", "bank"]]
+
+
+def postings_by_docno(index):
+    #{term: [(DOCNO, positions, weight)]}, comparable between indexes that number their docs differently
+    docnos=index["__docnos__"]
+    return {term: [(docnos[doc_id], list(positions), weight)
+                   for doc_id, positions, weight in zip(entry["doc_ids"], entry["positions"], entry["weights"])]
+            for term, entry in index.items() if term not in ("__all_docs__", "__docnos__")}
+
+def ranked_docnos(index, query_terms, k=20):
+    return [(score, index["__docnos__"][doc]) for score, doc in score_top_k(query_terms, index, k)]
+
+def fresh_build(workdir, live_docs):
+    index, all_docs=index_chunk(copy.deepcopy(live_docs))
+    write_binary_index(index, all_docs, str(workdir/"fresh.bin"))
+    return load_index(str(workdir/"fresh.bin"))
+
+def assert_same_index(index, fresh):
+    assert len(index["__all_docs__"])==len(fresh["__all_docs__"])
+    assert postings_by_docno(index)==postings_by_docno(fresh)
+    for query_terms in QUERIES:
+        assert ranked_docnos(index, query_terms)==ranked_docnos(fresh, query_terms)
+
+def add_delete_replace(index, docs):
+    '''
+    Adds docs, deletes every 7th and replaces docs[3] with a new version. Returns the live docs in index order.
+    '''
+    index.add_documents(copy.deepcopy(docs))
+    deleted=[doc["id"] for doc in docs[::7]]
+    for docno in deleted:
+        assert index.delete_document(docno)
+    assert not index.delete_document(deleted[0])
+    #a new version of a doc goes to the end of the index
+    replaced=dict(docs[3], text="oil price oil market")
+    index.add_document(dict(replaced))
+    return [doc for doc in docs if doc["id"] not in deleted and doc["id"]!=replaced["id"]]+[replaced]
+
+def test_segments_match_a_fresh_build(workdir, docs):
+    index=SegmentedIndex(str(workdir/"segments"), flush_docs=25)
+    try:
+        live_docs=add_delete_replace(index, docs)
+        assert len(index.segments)==len(docs)//25
+        #the in-memory segment is searched before it is flushed
+        assert_same_index(index.snapshot(), fresh_build(workdir, live_docs))
+        index.flush()
+        assert_same_index(index.snapshot(), fresh_build(workdir, live_docs))
+    finally:
+        index.close()
+
+def test_reopened_index_keeps_segments_and_deletes(workdir, docs):
+    index=SegmentedIndex(str(workdir/"segments"), flush_docs=25)
+    live_docs=add_delete_replace(index, docs)
+    index.flush()
+    index.close()
+    reopened=SegmentedIndex(str(workdir/"segments"), flush_docs=25)
+    try:
+        assert_same_index(reopened.snapshot(), fresh_build(workdir, live_docs))
+    finally:
+        reopened.close()
+
+def test_snapshot_does_not_see_later_changes(workdir, docs):
+    index=SegmentedIndex(str(workdir/"segments"), flush_docs=25)
+    try:
+        index.add_documents(copy.deepcopy(docs[:30]))
+        snapshot=index.snapshot()
+        before=list(boolean_doc_ids("market", snapshot))
+        index.add_document({"id": "new", "headline": "market", "text": "market"})
+        index.delete_document(docs[0]["id"])
+        index.flush()
+        assert list(boolean_doc_ids("market", snapshot))==before
+        assert list(boolean_doc_ids("market", index.snapshot()))!=before
+    finally:
+        index.close()
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from shards import build_sharded_index, ShardedIndex, SHARD_MANIFEST, shard_name
+from index_store import open_index
+from batch_search import batch_boolean_search
+from search import phrase_doc_ids, proximity_search
+from ranked_retrieval import ranked_retrieval
+from postings import to_docnos
+from test_batch_search import BOOLEAN_QUERIES, RANKED_QUERIES
+
+PHRASE_QUERIES=["oil price", "market bank", "nosuchterm"]
+
+
+def build(workdir, collection, num_shards=3, chunk_size=7, global_weights=True):
+    directory=str(workdir/"shards")
+    manifest=build_sharded_index(collection, directory, num_shards, processes=1, global_weights=global_weights, chunk_size=chunk_size)
+    return directory, manifest
+
+def postings_by_docno(index):
+    #{term: {DOCNO: (positions, weight)}}
+    docnos=index["__docnos__"]
+    return {term: {docnos[doc_id]: (list(positions), weight)
+                   for doc_id, positions, weight in zip(entry["doc_ids"], entry["positions"], entry["weights"])}
+            for term, entry in index.items() if term not in ("__all_docs__", "__docnos__")}
+
+@pytest.mark.parametrize("chunk_size", [7, 500])
+def test_shards_partition_the_unsharded_index(workdir, collection, index, chunk_size):
+    directory, manifest=build(workdir, collection, chunk_size=chunk_size)
+    docnos=list(index["__docnos__"])
+    assert manifest["num_docs"]==len(docnos)
+    assert [shard["num_docs"] for shard in manifest["shards"]]==[len(docnos[shard::3]) for shard in range(3)]
+    #the spill directory is gone and every file was renamed into place
+    assert sorted(os.listdir(directory))==sorted([SHARD_MANIFEST]+[shard_name(shard)+".bin" for shard in range(3)])
+
+    merged={}
+    for shard in range(3):
+        shard_index=open_index(os.path.join(directory, shard_name(shard)+".bin"))
+        #round robin: global doc g is doc g//3 of shard g%3
+        assert list(shard_index["__docnos__"])==docnos[shard::3]
+        for term, postings in postings_by_docno(shard_index).items():
+            merged.setdefault(term, {}).update(postings)
+        shard_index.close()
+    #global weights: every posting carries the weight of the unsharded index
+    assert merged==postings_by_docno(index)
+
+@pytest.mark.parametrize("global_weights", [True, False])
+def test_sharded_search_matches_the_unsharded_index(workdir, collection, index, global_weights):
+    directory, _=build(workdir, collection, global_weights=global_weights)
+    sharded_index=ShardedIndex(directory, workers=0)
+    try:
+        assert sharded_index.boolean_search(BOOLEAN_QUERIES)==batch_boolean_search(BOOLEAN_QUERIES, index)
+        assert list(sharded_index.phrase_search(PHRASE_QUERIES).values())==[
+            to_docnos(phrase_doc_ids(query, index), index) for query in PHRASE_QUERIES]
+        assert list(sharded_index.proximity_search(["#5(oil,price)", "#od2(income,tax)"]).values())==[
+            proximity_search([query], index) for query in ["#5(oil,price)", "#od2(income,tax)"]]
+        for k in (1, 10, None):
+            assert sharded_index.ranked_retrieval(RANKED_QUERIES, k)==ranked_retrieval(RANKED_QUERIES, index, k)
+    finally:
+        sharded_index.close()
+
+def test_worker_pool_matches_in_process_search(workdir, collection):
+    directory, _=build(workdir, collection, num_shards=2)
+    in_process=ShardedIndex(directory, workers=0)
+    pooled=ShardedIndex(directory, workers=1)
+    try:
+        assert pooled.boolean_search(BOOLEAN_QUERIES)==in_process.boolean_search(BOOLEAN_QUERIES)
+        assert pooled.ranked_retrieval(RANKED_QUERIES)==in_process.ranked_retrieval(RANKED_QUERIES)
+    finally:
+        pooled.close()
+        in_process.close()
@@ -0,0 +1,47 @@
+import pytest
+
+np=pytest.importorskip("numpy")
+
+import vectorized_scoring
+from vectorized_scoring import TermDocMatrix, top_k
+from ranked_retrieval import score_top_k
+from index_store import load_index
+from conftest import WORDS
+
+QUERIES=[["market"], ["oil", "price"], ["tax", "income", "tax"], ["rate", "loss", "shares"],
+         ["market", "oil", "price", "tax", "income", "bank"], ["scotland", "nosuchterm"], ["nosuchterm"], [],
+         list(WORDS)]
+
+
+@pytest.fixture
+def matrix(index):
+    return TermDocMatrix.from_index(index)
+
+@pytest.mark.parametrize("k", [1, 3, 10, 50, None])
+def test_score_batch_matches_score_top_k(index, matrix, k):
+    #bit for bit the same scores and the same order of tied docs
+    assert matrix.score_batch(QUERIES, k)==[score_top_k(query_terms, index, k) for query_terms in QUERIES]
+
+def test_batches_split_by_cells_give_the_same_results(index, matrix, monkeypatch):
+    expected=matrix.score_batch(QUERIES, 10)
+    #room for two queries per batch
+    monkeypatch.setattr(vectorized_scoring, "BATCH_CELLS", 2*matrix.num_docs)
+    assert matrix.score_batch(QUERIES, 10)==expected
+
+def test_top_k_keeps_the_lowest_doc_ids_of_tied_scores():
+    scores=np.array([1.0, 3.0, 2.0, 3.0, 2.0, 2.0, 0.0])
+    matched=np.array([True, True, True, True, True, True, False])
+    assert top_k(scores, matched, 3)==[(3.0, 1), (3.0, 3), (2.0, 2)]
+    assert top_k(scores, matched, 4)==[(3.0, 1), (3.0, 3), (2.0, 2), (2.0, 4)]
+    assert top_k(scores, matched)==[(3.0, 1), (3.0, 3), (2.0, 2), (2.0, 4), (2.0, 5), (1.0, 0)]
+    with pytest.raises(ValueError):
+        top_k(scores, matched, 0)
+
+def test_saved_matrix_loads_the_same(workdir, index, matrix):
+    path=str(workdir/"matrix.npz")
+    matrix.save(path)
+    loaded=TermDocMatrix.load(path)
+    assert loaded.terms==matrix.terms and loaded.docnos==matrix.docnos
+    assert loaded.score_batch(QUERIES, 10)==matrix.score_batch(QUERIES, 10)
+    #a loaded dict index exports the same matrix as the memory mapped one
+    assert TermDocMatrix.from_index(load_index(str(workdir/"index.bin"))).score_batch(QUERIES, 10)==matrix.score_batch(QUERIES, 10)
@@ -0,0 +1,158 @@
+import datetime
+import logging
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np=None
+
+from indexing import get_analyzer
+from scoring import RESULTS_PER_QUERY, check_k
+from metrics import span, count, enabled
+
+# Create a logger instance
+logger = logging.getLogger()
+
+'''
+Vectorized TF-IDF ranking over a CSR term-document matrix, as an alternative backend to ranked_retrieval.
+
+    indptr:  T+1 row offsets, row i holds term i
+    indices: doc ids of each row, ascending
+    data:    the TF-IDF weight the index serves for each (term, doc)
+
+A batch of queries is scored by gathering the rows of its terms, tagging every weight with its query number
+and doc id and summing them with one bincount into a (queries x docs) score matrix. bincount adds the
+weights of a cell in input order, and the rows are gathered in query term order, so every score is bit for bit
+the one score_top_k computes. The top k of a row is taken with argpartition.
+
+numpy is optional, only this module needs it.
+'''
+
+#score matrix cells per batch. Every cell costs 17 bytes: the float64 scores, the int64 bincount of matched
+#terms and its boolean mask, so a batch stays under about 340 MB
+BATCH_CELLS=20_000_000
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("vectorized scoring needs numpy, install it with pip install numpy")
+
+class TermDocMatrix:
+    '''
+    CSR matrix of the index weights, one row per term and one column per doc id.
+    '''
+    def __init__(self, terms, indptr, indices, data, docnos):
+        require_numpy()
+        self.terms=terms
+        self.term_ids={term: i for i, term in enumerate(terms)}
+        self.indptr=indptr
+        self.indices=indices
+        self.data=data
+        self.docnos=docnos
+        self.num_docs=len(docnos)
+
+    @classmethod
+    def from_index(cls, index):
+        '''
+        Exports an index (a loaded dict or a MappedIndex) to CSR. Every term's postings are decoded once.
+        '''
+        require_numpy()
+        start_time=datetime.datetime.now()
+        terms=sorted(term for term in index.keys() if term not in ("__all_docs__", "__docnos__"))
+        indptr=np.zeros(len(terms)+1, dtype=np.int64)
+        indices=[]
+        data=[]
+        for i, term in enumerate(terms):
+            entry=index[term]
+            indices.append(np.frombuffer(entry["doc_ids"], dtype=np.uint32))
+            data.append(np.frombuffer(entry["weights"], dtype=np.float64))
+            indptr[i+1]=indptr[i]+entry["doc_freq"]
+        indices=np.concatenate(indices).astype(np.int64) if terms else np.zeros(0, dtype=np.int64)
+        data=np.concatenate(data) if terms else np.zeros(0, dtype=np.float64)
+        matrix=cls(terms, indptr, indices, data, list(index["__docnos__"]))
+        logger.info("CSR matrix of {} terms x {} docs built. Time: {}".format(len(terms), matrix.num_docs, datetime.datetime.now()-start_time))
+        return matrix
+
+    def save(self, path):
+        np.savez(path, terms=np.array(self.terms), docnos=np.array(self.docnos),
+                 indptr=self.indptr, indices=self.indices, data=self.data)
+
+    @classmethod
+    def load(cls, path):
+        require_numpy()
+        with np.load(path) as arrays:
+            return cls(arrays["terms"].tolist(), arrays["indptr"], arrays["indices"], arrays["data"], arrays["docnos"].tolist())
+
+    def rows(self, query_terms):
+        '''
+        Concatenated (doc ids, weights) of the query terms' rows in query order, a repeated term once per occurrence.
+        '''
+        spans=[(self.indptr[i], self.indptr[i+1]) for i in (self.term_ids.get(term, -1) for term in query_terms) if i>=0]
+        if not spans:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        doc_ids=np.concatenate([self.indices[start:end] for start, end in spans])
+        weights=np.concatenate([self.data[start:end] for start, end in spans])
+        return doc_ids, weights
+
+    def score_batch(self, queries_terms, k=None):
+        '''
+        Scores analyzed queries. Returns one [(score, doc id)] list per query, best first,
+        equal scores by ascending doc id, like score_top_k. k=None keeps every matching doc.
+        '''
+        check_k(k)
+        results=[]
+        batch_size=max(1, BATCH_CELLS//max(1, self.num_docs))
+        with span("score"):
+            for batch_start in range(0, len(queries_terms), batch_size):
+                batch=queries_terms[batch_start:batch_start+batch_size]
+                flat_cells=[]
+                flat_weights=[]
+                for q, query_terms in enumerate(batch):
+                    doc_ids, weights=self.rows(query_terms)
+                    flat_cells.append(doc_ids+q*self.num_docs)
+                    flat_weights.append(weights)
+                flat_cells=np.concatenate(flat_cells)
+                flat_weights=np.concatenate(flat_weights)
+                size=len(batch)*self.num_docs
+                scores=np.bincount(flat_cells, weights=flat_weights, minlength=size).reshape(len(batch), self.num_docs)
+                #a doc matches when any of its query terms occurs in it, even with a zero weight
+                matched=np.bincount(flat_cells, minlength=size).reshape(len(batch), self.num_docs)>0
+                if enabled():
+                    count("docs_scored", int(matched.sum()))
+                for q in range(len(batch)):
+                    results.append(top_k(scores[q], matched[q], k))
+        return results
+
+    def score(self, query_terms, k=None):
+        return self.score_batch([query_terms], k)[0]
+
+def top_k(scores, matched, k=None):
+    '''
+    [(score, doc id)] of the k best matched docs, best first and equal scores by ascending doc id.
+    '''
+    check_k(k)
+    doc_ids=np.flatnonzero(matched)
+    doc_scores=scores[doc_ids]
+    if k is not None and k<len(doc_ids):
+        #argpartition picks any of the docs tied at the k-th score, keep the ones with the lowest doc ids
+        kth=doc_scores[np.argpartition(-doc_scores, k-1)[k-1]]
+        above=np.flatnonzero(doc_scores>kth)
+        tied=np.flatnonzero(doc_scores==kth)[:k-len(above)]
+        keep=np.concatenate([above, tied])
+        doc_ids, doc_scores=doc_ids[keep], doc_scores[keep]
+    order=np.lexsort((doc_ids, -doc_scores))
+    return list(zip(doc_scores[order].tolist(), doc_ids[order].tolist()))
+
+def vectorized_ranked_retrieval(query_list, matrix, k=RESULTS_PER_QUERY):
+    '''
+    ranked_retrieval on a TermDocMatrix: the whole query list is scored as one batch.
+    Returns {query number: [(DOCNO, score)]} best first, query numbers counting from 1.
+    '''
+    analyzer=get_analyzer()
+    with span("vectorized_ranked_retrieval"):
+        ranked=matrix.score_batch([analyzer.analyze(query) for query in query_list], k)
+    res=OrderedDict()
+    for q_num, query_res in enumerate(ranked, 1):
+        res[q_num]=[(matrix.docnos[doc], score) for score, doc in query_res]
+    return res